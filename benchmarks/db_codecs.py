@@ -0,0 +1,118 @@
+"""
+Сравнение кодеков DatabaseManager: размер файла, время записи и чтения.
+
+    python benchmarks/db_codecs.py [--users 2000] [--points 50000] [--runs 3]
+
+Наборы данных повторяют реальные файлы: rates.json с курсами и служебными
+полями, портфели пользователей и история курсов одним документом
+(как exchange_rates.json). Перед каждым чтением кеш документов сбрасывается,
+поэтому замеряется разбор файла, а не обращение к кешу.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from valutatrade_hub.infra.database import DatabaseManager  # noqa: E402
+
+CODECS = ("json", "json-compact", "marshal", "json-compact+gzip", "marshal+gzip",
+          "json-compact+lzma", "marshal+lzma")
+CURRENCIES = ["USD", "EUR", "RUB", "GBP", "JPY", "CNY", "BTC", "ETH", "SOL", "ADA"]
+
+
+def rates_dataset(pairs: int = 300) -> dict:
+    now = datetime.now(timezone.utc)
+    data = {
+        f"C{i:03d}_USD": {
+            "rate": random.uniform(0.001, 100_000),
+            "updated_at": (now - timedelta(seconds=i)).isoformat(),
+            "source": random.choice(["coingecko", "exchangerate"]),
+        }
+        for i in range(pairs)
+    }
+    return dict(data, source="ParserService", last_refresh=now.isoformat(), version=42)
+
+
+def portfolios_dataset(users: int) -> list:
+    return [
+        {
+            "user_id": user_id,
+            "wallets": {
+                code: {"currency_code": code,
+                       "balance": round(random.uniform(0, 10_000), 4)}
+                for code in random.sample(CURRENCIES, 5)
+            },
+        }
+        for user_id in range(1, users + 1)
+    ]
+
+
+def history_dataset(points: int) -> list:
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(points):
+        code = CURRENCIES[i % len(CURRENCIES)]
+        moment = (start + timedelta(minutes=5 * (i // len(CURRENCIES)))).isoformat()
+        rows.append({
+            "id": f"{code}_USD_{moment}",
+            "from_currency": code,
+            "to_currency": "USD",
+            "rate": random.uniform(0.5, 100_000),
+            "timestamp": moment,
+            "source": "coingecko",
+        })
+    return rows
+
+
+def best_ms(func, runs: int) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        best = min(best, (time.perf_counter() - start) * 1000)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--points", type=int, default=50_000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    datasets = {
+        "rates.json": rates_dataset(),
+        "portfolios.json": portfolios_dataset(args.users),
+        "exchange_rates.json": history_dataset(args.points),
+    }
+    db = DatabaseManager()
+    db.set_durability("none")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, data in datasets.items():
+            path = os.path.join(tmp, name)
+            print(f"\n{name}")
+            print(f"{'кодек':<20}{'размер, КБ':>12}{'запись, мс':>12}"
+                  f"{'чтение, мс':>12}")
+            for codec in CODECS:
+                db.set_codecs(codec)
+                save_ms = best_ms(lambda: db.save(path, data), args.runs)
+
+                def load():
+                    db.invalidate(path)
+                    return db.load(path)
+
+                load_ms = best_ms(load, args.runs)
+                assert load() == data, f"{codec}: данные не совпадают"
+                print(f"{codec:<20}{os.path.getsize(path) / 1024:>12.1f}"
+                      f"{save_ms:>12.1f}{load_ms:>12.1f}")
+    db.set_codecs("json")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Сравнение форматов истории курсов: размер файла и скорость полного прохода.
+
+    python benchmarks/history_formats.py [--points 200000] [--pairs 20]
+
+Сравниваются exchange_rates.json (один JSON-массив), сегмент JSON Lines
+и бинарный файл BinaryHistory (построчно через struct и, если установлен
+numpy, через массив поверх mmap).
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from valutatrade_hub.infra.database import DatabaseManager  # noqa: E402
+from valutatrade_hub.parser_service.binary_history import (  # noqa: E402
+    BinaryHistory,
+    load_numpy,
+)
+
+
+def generate(points: int, pairs: int):
+    codes = [f"C{i:02d}" for i in range(pairs)]
+    ts = datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp()
+    for i in range(points):
+        code = codes[i % pairs]
+        if i % pairs == 0:
+            ts += 300
+        moment = datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+        yield {
+            "id": f"{code}_USD_{moment}",
+            "from_currency": code,
+            "to_currency": "USD",
+            "rate": random.uniform(0.5, 100_000),
+            "timestamp": moment,
+            "source": "coingecko",
+        }
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--points", type=int, default=200_000)
+    parser.add_argument("--pairs", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = list(generate(args.points, args.pairs))
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "exchange_rates.json")
+        jsonl_path = os.path.join(tmp, "rates-2025-01-01.jsonl")
+        binary = BinaryHistory(os.path.join(tmp, "rates.bin"))
+
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2, ensure_ascii=False)
+        DatabaseManager().append_many(jsonl_path, rows)
+        binary.append((f"{r['from_currency']}_{r['to_currency']}",
+                       datetime.fromisoformat(r["timestamp"]).timestamp(), r["rate"])
+                      for r in rows)
+
+        def scan_json():
+            with open(json_path, encoding="utf-8") as f:
+                return sum(r["rate"] for r in json.load(f))
+
+        def scan_jsonl():
+            return sum(r["rate"] for r, _ in DatabaseManager().iter_lines(jsonl_path))
+
+        def scan_binary():
+            return sum(rate for _, _, rate in binary.scan())
+
+        results = [
+            ("exchange_rates.json", os.path.getsize(json_path), *timed(scan_json)),
+            ("JSON Lines", os.path.getsize(jsonl_path), *timed(scan_jsonl)),
+            ("binary (struct)", os.path.getsize(binary.path), *timed(scan_binary)),
+        ]
+        if load_numpy() is not None:
+            def scan_numpy():
+                records, _ = binary.arrays()
+                return float(records["rate"].sum())
+            results.append(("binary (numpy)", os.path.getsize(binary.path),
+                            *timed(scan_numpy)))
+
+    print(f"Точек: {args.points}, пар: {args.pairs}")
+    print(f"{'формат':<22}{'размер, КБ':>12}{'байт/точку':>12}{'проход, мс':>12}")
+    for name, size, _, elapsed in results:
+        print(f"{name:<22}{size / 1024:>12.0f}{size / args.points:>12.1f}"
+              f"{elapsed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Нагрузочный тест HTTP/JSON-сервиса.
+
+    python benchmarks/load_test.py [--users 20] [--requests 100] [--workers 8]
+                                   [--backend json|sqlite] [--url http://host:port]
+
+Без --url сервис запускается в отдельном процессе во временном каталоге
+с собственным config.json и заранее записанными курсами, поэтому внешние
+API не нужны. Каждый виртуальный пользователь регистрируется, входит
+и в одном keep-alive соединении выполняет смесь запросов: курс, портфель,
+покупка и продажа. Завершается с кодом 1, если были ответы 5xx или
+ошибки соединения.
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from http.client import HTTPConnection
+from pathlib import Path
+from urllib.parse import urlsplit
+
+ROOT = Path(__file__).resolve().parent.parent
+RATES = {"BTC_USD": 60000.0, "ETH_USD": 3000.0, "EUR_USD": 1.08, "GBP_USD": 1.27}
+MIX = [
+    ("GET", "/rate?from=BTC&to=USD", None),
+    ("GET", "/portfolio", None),
+    ("POST", "/buy", {"currency": "EUR", "amount": 1}),
+    ("POST", "/sell", {"currency": "EUR", "amount": 1}),
+]
+
+
+def prepare_workdir(path: str, backend: str, workers: int):
+    now = datetime.now(timezone.utc).isoformat()
+    config = {
+        "BASE_CURRENCY": "USD",
+        "RATES_TTL_SECONDS": 10 ** 9,
+        "LOG_DIR": "logs",
+        "LOG_LEVEL": "WARNING",
+        "STORAGE_BACKEND": backend,
+        "SERVER_WORKERS": workers,
+    }
+    rates = {pair: {"rate": rate, "updated_at": now, "source": "load-test"}
+             for pair, rate in RATES.items()}
+    rates.update(source="load-test", last_refresh=now, version=1)
+    Path(path, "data").mkdir()
+    Path(path, "config.json").write_text(json.dumps(config), encoding="utf-8")
+    Path(path, "data", "rates.json").write_text(json.dumps(rates), encoding="utf-8")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def request(conn: HTTPConnection, method: str, path: str, body=None,
+            token: str | None = None) -> tuple[int, dict]:
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    conn.request(method, path, body=data, headers=headers)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def wait_ready(host: str, port: int, timeout: float = 15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = HTTPConnection(host, port, timeout=1)
+            request(conn, "GET", "/metrics")
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Сервис на {host}:{port} не ответил за {timeout} с")
+
+
+def credit_users(workdir: str, user_ids: list[int], amount: float):
+    """Начисляет USD через хранилище (только для сервиса, запущенного тестом)."""
+    os.chdir(workdir)
+    sys.path.insert(0, str(ROOT))
+    from valutatrade_hub.infra.repository import PortfolioStore
+
+    for user_id in user_ids:
+        PortfolioStore().apply(user_id, {"USD": amount})
+
+
+def run_user(host: str, port: int, index: int, requests_count: int, token: str,
+             results: list, errors: Counter):
+    conn = HTTPConnection(host, port, timeout=30)
+    for i in range(requests_count):
+        method, path, body = MIX[(index + i) % len(MIX)]
+        start = time.perf_counter()
+        try:
+            status, _ = request(conn, method, path, body, token)
+        except (OSError, ValueError) as e:
+            errors[type(e).__name__] += 1
+            conn.close()
+            conn = HTTPConnection(host, port, timeout=30)
+            continue
+        results.append((path.split("?")[0], status,
+                        (time.perf_counter() - start) * 1000))
+    conn.close()
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=100,
+                        help="запросов на пользователя")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="потоков сервиса (только без --url)")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json",
+                        help="хранилище сервиса (только без --url)")
+    parser.add_argument("--url", help="адрес уже запущенного сервиса")
+    args = parser.parse_args()
+
+    tmp = process = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        prepare_workdir(tmp.name, args.backend, args.workers)
+        host, port = "127.0.0.1", free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "valutatrade_hub.api.server",
+             "--host", host, "--port", str(port)],
+            cwd=tmp.name, env=dict(os.environ, PYTHONPATH=str(ROOT)),
+            stdout=subprocess.DEVNULL)
+    try:
+        wait_ready(host, port)
+        prefix = f"load{int(time.time())}"
+        conn = HTTPConnection(host, port, timeout=30)
+        user_ids = []
+        for i in range(args.users):
+            _, reply = request(conn, "POST", "/register",
+                               {"username": f"{prefix}_{i}", "password": "secret"})
+            user_ids += [int(m) for m in re.findall(r"id=(\d+)",
+                                                    reply.get("output", ""))]
+        if tmp is not None:
+            credit_users(tmp.name, user_ids, 1_000_000.0)
+        tokens = []
+        for i in range(args.users):
+            _, reply = request(conn, "POST", "/login",
+                               {"username": f"{prefix}_{i}", "password": "secret"})
+            tokens.append(reply["token"])
+
+        results: list = []
+        errors: Counter = Counter()
+        threads = [threading.Thread(target=run_user, args=(
+            host, port, i, args.requests, tokens[i], results, errors))
+            for i in range(args.users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        conn.close()
+        conn = HTTPConnection(host, port, timeout=30)
+        _, metrics = request(conn, "GET", "/metrics")
+        conn.close()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        if tmp is not None:
+            tmp.cleanup()
+
+    by_path = defaultdict(list)
+    for path, _, ms in results:
+        by_path[path].append(ms)
+    statuses = Counter(status for _, status, _ in results)
+    print(f"Пользователей: {args.users}, запросов: {len(results)} за {elapsed:.2f} с "\
+          f"({len(results) / elapsed:.0f} запросов/с)")
+    print("Статусы: " + ", ".join(f"{s}: {n}" for s, n in sorted(statuses.items())))
+    if errors:
+        print("Ошибки соединения: " + ", ".join(f"{k}: {v}" for k, v in errors.items()))
+    print(f"{'запрос':<14}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for path, values in sorted(by_path.items()):
+        print(f"{path:<14}{len(values):>8}{percentile(values, 0.5):>10.1f}"
+              f"{percentile(values, 0.95):>10.1f}{percentile(values, 0.99):>10.1f}")
+    print(f"Сервис: отклонено {metrics['rejected']}, "\
+          f"тайм-аутов {metrics['timeouts']}, сессий {metrics['sessions']}, "\
+          f"кеш документов: "\
+          f"{metrics['db_cache'].get('hits')} попаданий / "\
+          f"{metrics['db_cache'].get('misses')} промахов")
+    failed = errors or any(status >= 500 for status in statuses)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
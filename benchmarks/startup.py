@@ -0,0 +1,81 @@
+"""
+Время запуска CLI и бюджет на импорт.
+
+    python benchmarks/startup.py [--runs 5] [--budget-ms 150]
+
+Замеряет импорт valutatrade_hub.cli.interface (python -X importtime)
+и пакетный вызов 'help' через main.py. Завершается с кодом 1, если импорт
+дольше бюджета или при запуске загружаются тяжёлые модули, нужные
+только отдельным командам.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+ENTRY = "valutatrade_hub.cli.interface"
+# Модули, которые должны загружаться только командами, которым они нужны.
+HEAVY_MODULES = ("requests", "urllib3", "prettytable", "numpy", "prompt", "sqlite3",
+                 "logging.handlers")
+
+
+def run_python(args: list[str], cwd: str, stdin: str | None = None):
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    return subprocess.run([sys.executable, *args], cwd=cwd, env=env, input=stdin,
+                          capture_output=True, text=True, check=True)
+
+
+def import_time_ms(cwd: str) -> float:
+    """Суммарное время импорта точки входа CLI по данным -X importtime."""
+    result = run_python(["-X", "importtime", "-c", f"import {ENTRY}"], cwd)
+    for line in result.stderr.splitlines():
+        parts = [p.strip() for p in line.split("|")]
+        if len(parts) == 3 and parts[2] == ENTRY:
+            return int(parts[1]) / 1000
+    raise RuntimeError(f"В выводе -X importtime нет {ENTRY}")
+
+
+def loaded_heavy_modules(cwd: str) -> list[str]:
+    code = (f"import sys, {ENTRY}; "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    return [m for m in run_python(["-c", code], cwd).stdout.strip().split(",") if m]
+
+
+def batch_help_ms(cwd: str) -> float:
+    start = time.perf_counter()
+    run_python([str(ROOT / "main.py"), "--batch", "-"], cwd, stdin="help\n")
+    return (time.perf_counter() - start) * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    args = parser.parse_args()
+
+    # Запуск из пустого каталога: старт не должен читать config.json и данные.
+    with tempfile.TemporaryDirectory() as cwd:
+        imports = min(import_time_ms(cwd) for _ in range(args.runs))
+        process = min(batch_help_ms(cwd) for _ in range(args.runs))
+        heavy = loaded_heavy_modules(cwd)
+        created = sorted(os.listdir(cwd))
+
+    print(f"Импорт {ENTRY}: {imports:.1f} мс (бюджет {args.budget_ms:.0f} мс)")
+    print(f"Процесс 'project --batch' с командой help: {process:.1f} мс")
+    ok = imports <= args.budget_ms
+    if heavy:
+        print(f"При запуске загружены тяжёлые модули: {', '.join(heavy)}")
+        ok = False
+    if created:
+        print(f"При запуске созданы файлы: {', '.join(created)}")
+        ok = False
+    print("OK" if ok else "Бюджет запуска превышен")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
+import sys
+
 
 def main():
     from valutatrade_hub.cli.interface import cli
 
-    cli()
+    sys.exit(cli(sys.argv[1:]))
+
+
+def serve():
+    from valutatrade_hub.api.server import serve
+
+    sys.exit(serve(sys.argv[1:]))
+
 
 if __name__ == "__main__":
     main()
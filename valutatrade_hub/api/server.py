@@ -0,0 +1,458 @@
+"""
+HTTP/JSON-сервис для торговых операций.
+
+    python -m valutatrade_hub.api.server [--host 127.0.0.1] [--port 8000]
+    poetry run project-server
+
+Запросы и ответы — JSON. После POST /login клиент получает токен и передаёт
+его в заголовке 'Authorization: Bearer <токен>'. Каждому токену соответствует
+своя TradingSession, поэтому один процесс обслуживает многих пользователей.
+"""
+import argparse
+import asyncio
+import json
+import math
+import secrets
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from threading import Lock
+from urllib.parse import parse_qsl, urlsplit
+
+from valutatrade_hub.core import usecase
+from valutatrade_hub.core import utils as u
+from valutatrade_hub.core.exceptions import (
+    ApiRequestError,
+    CurrencyNotFoundError,
+    InsufficientFundsError,
+    OrderRejectedError,
+    RateNotFoundError,
+)
+from valutatrade_hub.core.session import TradingSession
+from valutatrade_hub.infra.database import DatabaseManager
+from valutatrade_hub.infra.settings import SettingsLoader
+from valutatrade_hub.logging_config import logger
+
+# Статус ответа для исключений бизнес-логики (проверяются по порядку).
+ERROR_STATUS = [
+    (ApiRequestError, HTTPStatus.BAD_GATEWAY),
+    (CurrencyNotFoundError, HTTPStatus.NOT_FOUND),
+    (RateNotFoundError, HTTPStatus.NOT_FOUND),
+    (InsufficientFundsError, HTTPStatus.CONFLICT),
+    (OrderRejectedError, HTTPStatus.BAD_REQUEST),
+    (ValueError, HTTPStatus.BAD_REQUEST),
+]
+LATENCY_SAMPLES = 4096
+
+
+def _value(params: dict, name: str):
+    value = params.get(name)
+    if value is None or value == "":
+        raise ValueError(f"Не указан параметр '{name}'")
+    return value
+
+
+def _param(params: dict, name: str) -> str:
+    value = _value(params, name)
+    if not isinstance(value, str):
+        raise ValueError(f"Параметр '{name}' должен быть строкой")
+    return value
+
+
+def _optional_str(params: dict, name: str) -> str | None:
+    value = params.get(name)
+    if value is None or value == "":
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"Параметр '{name}' должен быть строкой")
+    return value
+
+
+def _number(params: dict, name: str) -> float:
+    value = _value(params, name)
+    try:
+        number = math.nan if isinstance(value, bool) else float(value)
+    except (TypeError, ValueError):
+        number = math.nan
+    if not math.isfinite(number):
+        raise ValueError(f"Параметр '{name}' должен быть числом")
+    return number
+
+
+def _optional_int(params: dict, name: str) -> int | None:
+    value = params.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Параметр '{name}' должен быть целым числом")
+
+
+class SessionRegistry:
+    """
+    Токены → торговые сессии. Сессия, к которой не обращались дольше
+    SERVER_SESSION_TTL секунд, удаляется.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._sessions: dict[str, tuple[TradingSession, float]] = {}
+
+    def create(self, session: TradingSession) -> str:
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[token] = (session, time.monotonic())
+        return token
+
+    def get(self, token: str) -> TradingSession | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None:
+                return None
+            if now - entry[1] > self.ttl:
+                del self._sessions[token]
+                return None
+            self._sessions[token] = (entry[0], now)
+            return entry[0]
+
+    def drop(self, token: str):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def __len__(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            for token in [t for t, (_, used) in self._sessions.items()
+                          if now - used > self.ttl]:
+                del self._sessions[token]
+            return len(self._sessions)
+
+
+class TradingServer:
+    """
+    JSON-сервис поверх asyncio: соединения обслуживает цикл событий,
+    а блокирующие операции (файлы, SQLite, обращения к API курсов)
+    выполняются в пуле из SERVER_WORKERS потоков. Если занятых и ожидающих
+    задач больше SERVER_WORKERS + SERVER_MAX_PENDING, запрос сразу получает
+    503; запрос, не уложившийся в SERVER_REQUEST_TIMEOUT секунд, — 504.
+    """
+
+    def __init__(self, host: str | None = None, port: int | None = None,
+                 workers: int | None = None):
+        settings = SettingsLoader()
+        self.host = host or settings.get("SERVER_HOST", "127.0.0.1")
+        self.port = port if port is not None else int(settings.get("SERVER_PORT", 8000))
+        self.workers = workers or int(settings.get("SERVER_WORKERS", 8))
+        self.max_pending = int(settings.get("SERVER_MAX_PENDING", 64))
+        self.request_timeout = float(settings.get("SERVER_REQUEST_TIMEOUT", 10))
+        self.idle_timeout = float(settings.get("SERVER_IDLE_TIMEOUT", 15))
+        self.max_body = int(settings.get("SERVER_MAX_BODY", 64 * 1024))
+        self.sessions = SessionRegistry(float(settings.get("SERVER_SESSION_TTL", 3600)))
+        self.scheduler = None
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="api")
+        self._busy = 0
+        self._started = time.monotonic()
+        self._stats = {"requests": 0, "rejected": 0, "timeouts": 0}
+        self._routes_stats: dict[str, dict] = {}
+        self._latency: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        # (метод, путь) → (обработчик, нужен ли токен)
+        self.routes = {
+            ("POST", "/register"): (self.register, False),
+            ("POST", "/login"): (self.login, False),
+            ("POST", "/logout"): (self.logout, True),
+            ("GET", "/portfolio"): (self.portfolio, True),
+            ("POST", "/buy"): (self.buy, True),
+            ("POST", "/sell"): (self.sell, True),
+            ("POST", "/orders"): (self.orders, True),
+            ("GET", "/rate"): (self.rate, False),
+            ("GET", "/rates"): (self.rates, False),
+            ("GET", "/rate-history"): (self.rate_history, False),
+        }
+
+    # Обработчики выполняются в пуле потоков и возвращают тело ответа.
+
+    def register(self, session, params: dict) -> dict:
+        return {"output": usecase.register(_param(params, "username"),
+                                           _param(params, "password"))}
+
+    def login(self, session, params: dict) -> dict:
+        session = TradingSession()
+        output = session.login(_param(params, "username"), _param(params, "password"))
+        return {"output": output, "token": self.sessions.create(session)}
+
+    def logout(self, session, params: dict) -> dict:
+        self.sessions.drop(params["_token"])
+        return {"output": f"Сессия пользователя '{session.username}' завершена"}
+
+    def portfolio(self, session, params: dict) -> dict:
+        return {"output": session.show_portfolio(
+            _optional_str(params, "base") or "USD")}
+
+    def buy(self, session, params: dict) -> dict:
+        return {"output": session.buy(_param(params, "currency"),
+                                      _number(params, "amount"))}
+
+    def sell(self, session, params: dict) -> dict:
+        return {"output": session.sell(_param(params, "currency"),
+                                       _number(params, "amount"))}
+
+    def orders(self, session, params: dict) -> dict:
+        orders = _value(params, "orders")
+        try:
+            parsed = [(str(side), str(currency), float(amount))
+                      for side, currency, amount in orders]
+        except (TypeError, ValueError):
+            parsed = None
+        if parsed is None or not all(math.isfinite(amount) for _, _, amount in parsed):
+            raise ValueError("Параметр 'orders' — список [side, currency, amount]")
+        return {"output": session.execute_orders(parsed)}
+
+    def rate(self, session, params: dict) -> dict:
+        return {"output": usecase.get_rate(_param(params, "from"),
+                                           _param(params, "to"))}
+
+    def rates(self, session, params: dict) -> dict:
+        return {"output": usecase.show_rates(
+            _optional_str(params, "currency"), _optional_int(params, "top"),
+            _optional_int(params, "page"), _optional_int(params, "page_size"))}
+
+    def rate_history(self, session, params: dict) -> dict:
+        return {"output": usecase.rate_history(
+            _param(params, "pair"), at=_optional_str(params, "at"),
+            start=_optional_str(params, "start"), end=_optional_str(params, "end"),
+            bucket=_optional_str(params, "bucket"),
+            agg=_optional_str(params, "agg") or "ohlc",
+            limit=_optional_int(params, "limit") or 50)}
+
+    def metrics(self) -> dict:
+        """Счётчики сервиса, кеша документов, обновления курсов и планировщика."""
+        samples = sorted(self._latency)
+
+        def percentile(q: float) -> float | None:
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(q * len(samples)))], 3)
+
+        return {
+            "uptime_seconds": round(time.monotonic() - self._started, 1),
+            **self._stats,
+            "in_flight": self._busy,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "sessions": len(self.sessions),
+            "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95),
+                           "p99": percentile(0.99),
+                           "max": round(samples[-1], 3) if samples else None},
+            "routes": self._routes_stats,
+            "db_cache": DatabaseManager().cache_stats(),
+            "rates_refresh": u.refresh_stats(),
+            "scheduler": self.scheduler.status() if self.scheduler else None,
+        }
+
+    async def dispatch(self, method: str, target: str, headers: dict,
+                       body: bytes) -> tuple[int, dict]:
+        """Разбирает запрос, выполняет обработчик в пуле и возвращает (статус, тело)."""
+        url = urlsplit(target)
+        if method == "GET" and url.path == "/metrics":
+            return HTTPStatus.OK, self.metrics()
+        route = self.routes.get((method, url.path))
+        if route is None:
+            allowed = any(path == url.path for _, path in self.routes)
+            status = HTTPStatus.METHOD_NOT_ALLOWED if allowed else HTTPStatus.NOT_FOUND
+            return status, {"ok": False, "error": f"Нет метода {method} {url.path}"}
+        handler, auth = route
+
+        params = dict(parse_qsl(url.query))
+        if body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return HTTPStatus.BAD_REQUEST, {"ok": False,
+                                                "error": "Тело запроса не JSON"}
+            if not isinstance(data, dict):
+                return HTTPStatus.BAD_REQUEST, {"ok": False,
+                                                "error": "Ожидался JSON-объект"}
+            params.update(data)
+
+        session = None
+        if auth:
+            scheme, _, token = headers.get("authorization", "").partition(" ")
+            session = self.sessions.get(token) if scheme.lower() == "bearer" else None
+            if session is None:
+                return HTTPStatus.UNAUTHORIZED, {
+                    "ok": False, "error": "Нужен токен: выполните POST /login"}
+            params["_token"] = token
+
+        if self._busy >= self.workers + self.max_pending:
+            self._stats["rejected"] += 1
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"ok": False,
+                                                    "error": "Сервис перегружен"}
+        loop = asyncio.get_running_loop()
+        self._busy += 1
+        future = self._pool.submit(handler, session, params)
+        # Слот освобождается, когда задача действительно завершилась в пуле,
+        # а не когда клиент перестал её ждать.
+        future.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(self._release))
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future),
+                                            self.request_timeout)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            return HTTPStatus.GATEWAY_TIMEOUT, {
+                "ok": False, "error": f"Запрос не выполнен за "\
+                                      f"{self.request_timeout:g} с"}
+        except Exception as e:
+            for exc_type, status in ERROR_STATUS:
+                if isinstance(e, exc_type):
+                    return status, {"ok": False, "error": str(e),
+                                    "type": type(e).__name__}
+            logger.error(f"API {method} {url.path}: {type(e).__name__}: {e}",
+                         exc_info=True)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {
+                "ok": False, "error": "Внутренняя ошибка", "type": type(e).__name__}
+
+        # show-rates и подобные операции сообщают об ошибке текстом.
+        if result["output"].startswith("ERROR"):
+            return HTTPStatus.BAD_REQUEST, {"ok": False, "error": result["output"]}
+        return HTTPStatus.OK, {"ok": True, **result}
+
+    def _release(self):
+        self._busy -= 1
+
+    def _record(self, path: str, status: int, elapsed_ms: float):
+        self._stats["requests"] += 1
+        self._latency.append(elapsed_ms)
+        if path != "/metrics" and not any(p == path for _, p in self.routes):
+            path = "other"
+        route = self._routes_stats.setdefault(
+            path, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        route["count"] += 1
+        route["errors"] += status >= 400
+        route["total_ms"] = round(route["total_ms"] + elapsed_ms, 3)
+        route["max_ms"] = max(route["max_ms"], round(elapsed_ms, 3))
+
+    async def handle_connection(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter):
+        """Обслуживает соединение HTTP/1.1 (с keep-alive) до закрытия или простоя."""
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(),
+                                                          self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                start = time.perf_counter()
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST,
+                                        {"ok": False, "error": "Некорректный запрос"},
+                                        keep_alive=False)
+                    break
+                method, target, version = parts
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(),
+                                                  self.idle_timeout)
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = version == "HTTP/1.1" and \
+                    headers.get("connection", "").lower() != "close"
+
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST,
+                                        {"ok": False,
+                                         "error": "Некорректный Content-Length"},
+                                        keep_alive=False)
+                    break
+                if length > self.max_body:
+                    await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                        {"ok": False,
+                                         "error": "Слишком большой запрос"},
+                                        keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, payload = await self.dispatch(method.upper(), target,
+                                                      headers, body)
+                await self._respond(writer, status, payload, keep_alive)
+                self._record(urlsplit(target).path, status,
+                             (time.perf_counter() - start) * 1000)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload: dict,
+                       keep_alive: bool):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        status = HTTPStatus(status)
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self.handle_connection,
+                                            self.host, self.port)
+        address = server.sockets[0].getsockname()
+        logger.info(f"API-сервис запущен на http://{address[0]}:{address[1]}, "\
+                    f"потоков {self.workers}")
+        print(f"Сервис запущен на http://{address[0]}:{address[1]} "\
+              f"(Ctrl+C — остановка)", flush=True)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def serve(argv: list[str] | None = None) -> int:
+    """Точка входа project-server."""
+    parser = argparse.ArgumentParser(prog="project-server",
+                                     description="HTTP/JSON-сервис ValutaTrade Hub")
+    parser.add_argument("--host", help="адрес (по умолчанию SERVER_HOST)")
+    parser.add_argument("--port", type=int, help="порт (по умолчанию SERVER_PORT)")
+    parser.add_argument("--workers", type=int,
+                        help="потоков для операций (по умолчанию SERVER_WORKERS)")
+    parser.add_argument("--with-scheduler", action="store_true",
+                        help="обновлять курсы по расписанию в фоне")
+    args = parser.parse_args(argv)
+
+    server = TradingServer(args.host, args.port, args.workers)
+    if args.with_scheduler:
+        from valutatrade_hub.parser_service.scheduler import UpdateScheduler
+        server.scheduler = UpdateScheduler()
+        server.scheduler.start()
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("Сервис остановлен")
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(serve(sys.argv[1:]))
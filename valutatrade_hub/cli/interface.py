@@ -1,40 +1,61 @@
+import argparse
+import io
+import json
 import shlex
+import sys
+import time
+from contextlib import redirect_stdout
 from functools import wraps
 from json import JSONDecodeError
 
-import prompt
-
 from valutatrade_hub.core.currancies import getRegistryCurrencys
 from valutatrade_hub.core.exceptions import (
     ApiRequestError,
     CurrencyNotFoundError,
     InsufficientFundsError,
+    OrderRejectedError,
     RateNotFoundError,
 )
+from valutatrade_hub.infra.settings import SettingsLoader
 
 from ..core import usecase
 
+COMMANDS_HELP = [
+    ("register --username <имя> --password <пароль>", "регистрация"),
+    ("login --username <имя> --password <пароль>", "вход"),
+    ("show-portfolio [--base USD]", "показать портфель"),
+    ("buy --currency <код> --amount <число>", "купить валюту"),
+    ("sell --currency <код> --amount <число>", "продать валюту"),
+    ("execute-orders --orders buy:<код>:<число>,sell:<код>:<число>",
+     "исполнить пакет заявок одной операцией"),
+    ("get-rate --from <код> --to <код>", "получить курс"),
+    ("update-rates [--source coingecko|exchangerate]",
+     "обновить кэш курсов валют (по умолчанию все источники)"),
+    ("show-rates [--currency <код>] [--top <число>] [--page <номер>]"
+     " [--page-size <число>]",
+     "показать актуальные курсы из кэша"),
+    ("rate-history --pair <пара> [--at <время>] [--start <время>] [--end <время>]"
+     " [--bucket 1h] [--agg ohlc|mean] [--limit <число>]",
+     "история курса пары: на момент, за интервал или по интервалам"),
+    ("scheduler [--action start|stop|status]",
+     "фоновое обновление курсов по расписанию"),
+    ("migrate-storage", "перенести данные в новый формат хранения"),
+    ("migrate-sqlite", "скопировать пользователей, портфели и историю в SQLite"),
+    ("compact-history", "сжать старую историю курсов по политике хранения"),
+    ("convert-history", "собрать бинарную историю курсов из JSON-истории"),
+    ("help", "показать список доступных команд"),
+    ("exit", "выход"),
+]
+
+
+def help_text() -> str:
+    lines = ["", "Доступные команды:", ""]
+    lines += [f"  {cmd:<50} — {desc}" for cmd, desc in COMMANDS_HELP]
+    return "\n".join(lines) + "\n"
+
 
 def print_help():
-    commands = [
-        ("register --username <имя> --password <пароль>", "регистрация"),
-        ("login --username <имя> --password <пароль>", "вход"),
-        ("show-portfolio [--base USD]", "показать портфель"),
-        ("buy --currency <код> --amount <число>", "купить валюту"),
-        ("sell --currency <код> --amount <число>", "продать валюту"),
-        ("get-rate --from <код> --to <код>", "получить курс"),
-        ("update-rates [--source coingecko|exchangerate]",
-         "обновить кэш курсов валют (по умолчанию все источники)"),
-        ("show-rates [--currency <код>] [--top <число>]",
-         "показать актуальные курсы из кэша"),
-        ("help", "показать список доступных команд"),
-        ("exit", "выход"),
-    ]
-
-    print("\nДоступные команды:\n")
-    for cmd, desc in commands:
-        print(f"  {cmd:<50} — {desc}")
-    print()
+    print(help_text())
 
 
 def get_arg(params, name, default=None):
@@ -53,11 +74,26 @@ def get_arg(params, name, default=None):
     raise ValueError(f"Отсутствует обязательный параметр {name}")
 
 
+def parse_orders(raw: str) -> list[tuple[str, str, float]]:
+    """Разбирает строку заявок вида 'buy:BTC:0.01,sell:ETH:0.5'."""
+    orders = []
+    for item in raw.strip("\"'").split(","):
+        try:
+            side, currency, amount = item.strip().split(":")
+            orders.append((side, currency, float(amount)))
+        except ValueError:
+            raise ValueError(f"Некорректная заявка '{item}'. "\
+                             "Формат: buy:<код>:<число> или sell:<код>:<число>")
+    return orders
+
+
 def cli_command(required_args=None, optional_args=None):
     """
     Декоратор для CLI-команд.
     required_args: список обязательных аргументов (например ["--username", "--amount"])
     optional_args: словарь с параметрами по умолчанию, например {"--base": "USD"}
+    Обёрнутая команда принимает список параметров и возвращает пару
+    (успех, текст ответа); ошибки переводятся в понятные пользователю сообщения.
     """
     required_args = required_args or []
     optional_args = optional_args or {}
@@ -74,37 +110,229 @@ def cli_command(required_args=None, optional_args=None):
                     elif default is not None:
                         parsed[arg] = default
 
-                result = fn(**{k.lstrip('-'): \
-                               v for k, v in parsed.items() if v is not None})
-                print(result)
+                result = str(fn(**{k.lstrip('-'): \
+                                   v for k, v in parsed.items() if v is not None}))
+                return not result.startswith("ERROR"), result
 
             except JSONDecodeError as e:
-                print(f"Некорректный JSON-файл ({e.filename}).")
-                print(f"Проверьте синтаксис (строка {e.lineno}): {e.msg}")
+                return False, (f"Некорректный JSON-файл ({e.filename}).\n"
+                               f"Проверьте синтаксис (строка {e.lineno}): {e.msg}")
             except ValueError as e:
-                print(e)
+                return False, str(e)
+            except OrderRejectedError as e:
+                return False, f"Пакет заявок не исполнен, портфель не изменён.\n{e}"
             except InsufficientFundsError as e:
-                print(f"Недостаточно средств: доступно {e.available} {e.code}, "\
-                                            f"требуется {e.required} {e.code}")
+                return False, (f"Недостаточно средств: доступно {e.available} "\
+                               f"{e.code}, требуется {e.required} {e.code}")
             except RateNotFoundError as e:
-                print(f"Курс {e.code} не найден.")
-                print("Используйте show-rates для просмотра списка курсов.")
+                return False, (f"Курс {e.code} не найден.\n"
+                               "Используйте show-rates для просмотра списка курсов.")
             except CurrencyNotFoundError as e:
-                print(f"Неизвестная валюта '{e.code}'. Доступные валюты: \n")
-                print(getRegistryCurrencys())
+                return False, (f"Неизвестная валюта '{e.code}'. "\
+                               f"Доступные валюты: \n\n{getRegistryCurrencys()}")
             except ApiRequestError as e:
-                print(f"{e} Попробуйте позже или проверьте сеть.")
+                return False, f"{e} Попробуйте позже или проверьте сеть."
             except FileNotFoundError as e:
-                print(f"Файл данных не найден: {e.filename}")
+                return False, f"Файл данных не найден: {e.filename}"
             except Exception as e:
-                print(f"Неожиданная ошибка: {e}")
+                return False, f"Неожиданная ошибка: {e}"
 
         return wrapper
     return decorator
 
 
-def cli():
+
+@cli_command(required_args=["--username", "--password"])
+def cmd_register(username, password):
+    return usecase.register(username, password)
+
+
+@cli_command(required_args=["--username", "--password"])
+def cmd_login(username, password):
+    return usecase.login(username, password)
+
+
+@cli_command(optional_args={"--base": "USD"})
+def cmd_show_portfolio(base):
+    return usecase.show_portfolio(base)
+
+
+@cli_command(required_args=["--currency", "--amount"])
+def cmd_buy(currency, amount):
+    try:
+        amount = float(amount) if amount is not None else None
+    except ValueError:
+        return "ERROR: Параметр --amount должен быть числом."
+    return usecase.buy(currency, amount)
+
+
+@cli_command(required_args=["--currency", "--amount"])
+def cmd_sell(currency, amount):
+    try:
+        amount = float(amount) if amount is not None else None
+    except ValueError:
+        return "ERROR: Параметр --amount должен быть числом."
+    return usecase.sell(currency, amount)
+
+
+@cli_command(required_args=["--orders"])
+def cmd_execute_orders(orders):
+    return usecase.execute_orders(parse_orders(orders))
+
+
+@cli_command(required_args=["--from", "--to"])
+def cmd_get_rate(**kwargs):
+    return usecase.get_rate(kwargs["from"], kwargs["to"])
+
+
+@cli_command(optional_args={"--source": None})
+def cmd_update_rates(source=None):
+    return usecase.update_rates(source)
+
+
+@cli_command(optional_args={"--currency": None, "--top": None,
+                            "--page": None, "--page-size": None})
+def cmd_show_rates(currency=None, top=None, **kwargs):
+    try:
+        top_value = int(top) if top is not None else None
+    except ValueError:
+        return "ERROR: Параметр --top должен быть числом."
+    try:
+        page = kwargs.get("page")
+        page_size = kwargs.get("page-size")
+        page = int(page) if page is not None else None
+        page_size = int(page_size) if page_size is not None else None
+    except ValueError:
+        return "ERROR: Параметры --page и --page-size должны быть числами."
+    return usecase.show_rates(currency, top_value, page, page_size)
+
+
+@cli_command(required_args=["--pair"],
+             optional_args={"--at": None, "--start": None, "--end": None,
+                            "--bucket": None, "--agg": "ohlc", "--limit": "50"})
+def cmd_rate_history(pair, agg, limit, at=None, start=None, end=None, bucket=None):
+    try:
+        limit_value = int(limit)
+    except ValueError:
+        return "ERROR: Параметр --limit должен быть числом."
+    return usecase.rate_history(pair, at, start, end, bucket, agg, limit_value)
+
+
+@cli_command(optional_args={"--action": "status"})
+def cmd_scheduler(action):
+    return usecase.scheduler(action)
+
+
+@cli_command()
+def cmd_migrate_storage():
+    return usecase.migrate_storage()
+
+
+@cli_command()
+def cmd_migrate_sqlite():
+    return usecase.migrate_sqlite()
+
+
+@cli_command()
+def cmd_compact_history():
+    return usecase.compact_history()
+
+
+@cli_command()
+def cmd_convert_history():
+    return usecase.convert_history()
+
+
+COMMANDS = {
+    "register": cmd_register,
+    "login": cmd_login,
+    "show-portfolio": cmd_show_portfolio,
+    "buy": cmd_buy,
+    "sell": cmd_sell,
+    "execute-orders": cmd_execute_orders,
+    "get-rate": cmd_get_rate,
+    "update-rates": cmd_update_rates,
+    "show-rates": cmd_show_rates,
+    "rate-history": cmd_rate_history,
+    "scheduler": cmd_scheduler,
+    "migrate-storage": cmd_migrate_storage,
+    "migrate-sqlite": cmd_migrate_sqlite,
+    "compact-history": cmd_compact_history,
+    "convert-history": cmd_convert_history,
+}
+
+
+def run_command(cmd: str, params: list[str]) -> tuple[bool, str]:
+    """Выполняет одну команду и возвращает (успех, текст ответа)."""
+    if cmd == "help":
+        return True, help_text()
+    handler = COMMANDS.get(cmd)
+    if handler is None:
+        return False, f"Неизвестная команда: {cmd}. "\
+                      f"Введите 'help' для списка доступных."
+    return handler(params)
+
+
+def _mask_secrets(params: list[str]) -> list[str]:
+    masked = list(params)
+    for i, value in enumerate(masked[:-1]):
+        if value == "--password":
+            masked[i + 1] = "****"
+    return masked
+
+
+def run_batch(lines, out=sys.stdout, stop_on_error: bool = False) -> int:
+    """
+    Пакетный режим: выполняет команды построчно в одном процессе и пишет
+    по одной JSON-строке на команду: номер строки, команда, успех, ответ и время.
+    Пустые строки и строки с '#' пропускаются, 'exit' завершает пакет.
+    Возвращает код выхода: 0 — все команды успешны, 1 — были ошибки.
+    """
+    failed = 0
+    for lineno, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        start = time.perf_counter()
+        captured = io.StringIO()
+        try:
+            cmd, *params = shlex.split(line, posix=False)
+        except ValueError as e:
+            cmd, params = line, []
+            ok, output = False, f"Некорректные параметры: {e}"
+        else:
+            if cmd == "exit":
+                break
+            # Команды и декораторы печатают служебные сообщения — собираем их
+            # отдельно, чтобы не ломать JSON Lines на stdout.
+            with redirect_stdout(captured):
+                ok, output = run_command(cmd, params)
+
+        record = {
+            "line": lineno,
+            "command": " ".join([cmd, *_mask_secrets(params)]),
+            "ok": ok,
+            "output": output,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+        if captured.getvalue():
+            record["log"] = captured.getvalue()
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+
+        if not ok:
+            failed += 1
+            if stop_on_error:
+                break
+    return 0 if failed == 0 else 1
+
+
+def interactive():
+    import prompt
+
     print_help()
+    if SettingsLoader().get("SCHEDULER_AUTOSTART", False):
+        print(run_command("scheduler", ["--action", "start"])[1])
 
     while True:
         try:
@@ -120,69 +348,37 @@ def cli():
             print(f"Некорректные параметры: {e}")
             continue
 
-        match cmd:
-            case "exit":
-                print("Выход из программы.")
-                break
-            case "help":
-                print_help()
-
-            case "register":
-                @cli_command(required_args=["--username", "--password"])
-                def cmd_register(username, password):
-                    return usecase.register(username, password)
-                cmd_register(params)
-            case "login":
-                @cli_command(required_args=["--username", "--password"])
-                def cmd_login(username, password):
-                    return usecase.login(username, password)
-                cmd_login(params)
-            case "show-portfolio":
-                @cli_command(optional_args={"--base": "USD"})
-                def cmd_show_portfolio(base):
-                    return usecase.show_portfolio(base)
-                cmd_show_portfolio(params)
-            case "buy":
-                @cli_command(required_args=["--currency", "--amount"])
-                def cmd_buy(currency, amount):
-                    try:
-                        amount = float(amount) if amount is not None else None
-                    except ValueError:
-                        return "ERROR: Параметр --amount должен быть числом."
-                    return usecase.buy(currency, amount)
-                cmd_buy(params)
-            case "sell":
-                @cli_command(required_args=["--currency", "--amount"])
-                def cmd_sell(currency, amount):
-                    try:
-                        amount = float(amount) if amount is not None else None
-                    except ValueError:
-                        return "ERROR: Параметр --amount должен быть числом."
-                    return usecase.sell(currency, amount)
-                cmd_sell(params)
-            case "get-rate":
-                @cli_command(required_args=["--from", "--to"])
-                def cmd_get_rate(**kwargs):
-                    return usecase.get_rate(kwargs["from"], kwargs["to"])
-                cmd_get_rate(params)
-
-            case "update-rates":
-                @cli_command(optional_args={"--source": None})
-                def cmd_update_rates(source=None):
-                    return usecase.update_rates(source)
-                cmd_update_rates(params)
-            case "show-rates":
-                @cli_command(optional_args={"--currency": None, "--top": None})
-                def cmd_show_rates(currency=None, top=None):
-                    try:
-                        top_value = int(top) if top is not None else None
-                    except ValueError:
-                        return "ERROR: Параметр --top должен быть числом."
-                    return usecase.show_rates(currency, top_value)
-                cmd_show_rates(params)
-
-
-            case _:
-                print(f"Неизвестная команда: {cmd}. "\
-                      f"Введите 'help' для списка доступных.")
+        if cmd == "exit":
+            print("Выход из программы.")
+            break
+        if cmd == "help":
+            print_help()
+            continue
+        _, output = run_command(cmd, params)
+        print(output)
+
+
+def cli(argv: list[str] | None = None) -> int:
+    """
+    Точка входа CLI. Без аргументов запускает интерактивный режим,
+    с --batch <файл|-> выполняет команды из файла или stdin.
+    """
+    parser = argparse.ArgumentParser(prog="project")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="выполнить команды из файла ('-' — из stdin) "\
+                             "и вывести результаты в формате JSON Lines")
+    parser.add_argument("--stop-on-error", action="store_true",
+                        help="в пакетном режиме остановиться на первой ошибке")
+    args = parser.parse_args(argv or [])
 
+    if args.batch is None:
+        interactive()
+        return 0
+    if args.batch == "-":
+        return run_batch(sys.stdin, stop_on_error=args.stop_on_error)
+    try:
+        with open(args.batch, encoding="utf-8") as f:
+            return run_batch(f, stop_on_error=args.stop_on_error)
+    except OSError as e:
+        print(f"Не удалось открыть файл команд: {e}", file=sys.stderr)
+        return 2
@@ -34,3 +34,14 @@ class ApiRequestError(Exception):
         self.reason = reason
         message = f"Ошибка при обращении к внешнему API: {reason}"
         super().__init__(message)
+
+class OrderRejectedError(Exception):
+    """Выбрасывается, если заявка из пакета не может быть исполнена."""
+
+    def __init__(self, index: int, order: tuple, reason: Exception):
+        self.index = index
+        self.order = order
+        self.reason = reason
+        side, currency, amount = order
+        message = f"Заявка #{index} ({side} {amount} {currency}) отклонена: {reason}"
+        super().__init__(message)
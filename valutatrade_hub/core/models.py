@@ -6,9 +6,9 @@ from valutatrade_hub.core.exceptions import (
     CurrencyNotFoundError,
     InsufficientFundsError,
 )
-from valutatrade_hub.infra.settings import SettingsLoader
+from valutatrade_hub.infra.repository import PortfolioStore
 
-from .utils import get_exchange_rate, load_json, save_json
+from .utils import get_exchange_rate
 
 
 class User:
@@ -175,34 +175,19 @@ class Portfolio:
     @staticmethod
     def load_portfolio(user_id: int) -> 'Portfolio':
         """Загружает портфель пользователя или создаёт новый."""
-        portfolios = load_json(SettingsLoader().get("PORTFOLIOS_FILE"))
-
-        data = next((d_ for d_ in portfolios if d_["user_id"] == user_id), None)
+        data = PortfolioStore().load(user_id)
 
         if not data:
             return Portfolio(user_id, wallets={})
 
         wallets = {
             code: Wallet(currency_code=code, balance=float(info.get("balance", 0.0)))
-            for code, info in data.get("wallets", {}).items()
+            for code, info in data.items()
         }
         return Portfolio(user_id, wallets=wallets)
 
 
     def save_portfolio(self):
         """Сохраняет портфель текущего пользователя."""
-        portfolios = load_json(SettingsLoader().get("PORTFOLIOS_FILE"))
-        for p in portfolios:
-            if p["user_id"] == self.user_id:
-                p["wallets"] = {code: {"balance": w.balance} \
-                                for code, w in self._wallets.items()}
-                break
-        else:
-            portfolios.append({
-                "user_id": self.user_id,
-                "wallets": {code: {"balance": w.balance} \
-                            for code, w in self._wallets.items()}
-            })
-        save_json(SettingsLoader().get("PORTFOLIOS_FILE"), portfolios)
-
-
+        PortfolioStore().save(self.user_id, {code: {"balance": w.balance} \
+                                             for code, w in self._wallets.items()})
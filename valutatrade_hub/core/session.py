@@ -0,0 +1,276 @@
+from datetime import datetime
+from threading import RLock
+
+from valutatrade_hub.decorators import log_action
+from valutatrade_hub.infra.repository import PortfolioStore, UserRepository
+from valutatrade_hub.infra.settings import SettingsLoader
+from valutatrade_hub.parser_service.snapshot import RatesSnapshot
+from valutatrade_hub.parser_service.storage import RatesStorage
+
+from . import utils as u
+from .currancies import get_currency
+from .exceptions import (
+    ApiRequestError,
+    CurrencyNotFoundError,
+    OrderRejectedError,
+    RateNotFoundError,
+)
+from .models import Portfolio, User
+
+
+class TradingSession:
+    """
+    Торговая сессия одного пользователя: пользователь, его портфель
+    и снимок курсов, по которому сессия последний раз проводила расчёты.
+    Состояние сессии защищено её собственной блокировкой, а кеши (снимок
+    курсов, документы DatabaseManager, индексы пользователей) общие для
+    процесса, поэтому один процесс обслуживает много сессий одновременно.
+    Балансы меняются через PortfolioStore.apply — атомарно и между сессиями.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self.user: User | None = None
+        self.portfolio: Portfolio | None = None
+        self.snapshot: RatesSnapshot | None = None
+
+    @property
+    def username(self) -> str | None:
+        return self.user.username if self.user is not None else None
+
+    def _require_login(self) -> User:
+        if self.user is None or self.portfolio is None:
+            raise ValueError("Сначала выполните login")
+        return self.user
+
+    def _reload_portfolio(self):
+        self.portfolio = Portfolio.load_portfolio(self.user.user_id)
+
+    def refresh_snapshot(self) -> RatesSnapshot | None:
+        """Запоминает в сессии актуальный снимок курсов и возвращает его."""
+        self.snapshot = RatesStorage().load_snapshot()
+        return self.snapshot
+
+    @log_action("LOGIN")
+    def login(self, username: str, password: str) -> str:
+        """Вход пользователя и загрузка его портфеля."""
+        user_entry = UserRepository().get_by_username(username)
+        if not user_entry:
+            raise ValueError(f"Пользователь '{username}' не найден")
+
+        user = User(
+            user_id=user_entry["user_id"],
+            username=user_entry["username"],
+            password=password,
+            salt=user_entry["salt"],
+            registration_date=datetime.fromisoformat(user_entry["registration_date"]),
+        )
+
+        if not user.verify_password(password):
+            if user.hashed_password != user_entry["hashed_password"]:
+                raise ValueError("Неверный пароль")
+
+        portfolio = Portfolio.load_portfolio(user.user_id)
+        with self._lock:
+            self.user, self.portfolio, self.snapshot = user, portfolio, None
+
+        return f"Вы вошли как '{username}'"
+
+    def show_portfolio(self, base: str = "USD") -> str:
+        """Показывает все кошельки и общую стоимость в базовой валюте."""
+        with self._lock:
+            user = self._require_login()
+            base = base.upper()
+            snapshot = self.refresh_snapshot()
+            if snapshot is None or not snapshot.has_currency(base):
+                raise RateNotFoundError(base)
+
+            wallets = self.portfolio.wallets
+            if not wallets:
+                return f"Портфель пользователя '{user.username}' пуст."
+
+            lines = [f"Портфель пользователя '{user.username}' (база: {base}):"]
+            total_value = 0.0
+
+            for code, wallet in wallets.items():
+                try:
+                    rate, _ = u.get_exchange_rate(code, base)
+                except RateNotFoundError:
+                    lines.append(f"- {code}: {wallet.balance:.4f} "\
+                                 f"(нет курса {code}→{base})")
+                    continue
+                except ApiRequestError as e:
+                    lines.append(f"- {code}: {wallet.balance:.4f} (ошибка API: {e})")
+                    continue
+                converted = wallet.balance * rate
+                total_value += converted
+                lines.append(f"- {code}: {wallet.balance:.4f}  "\
+                             f"→ {converted:.2f} {base}")
+
+            lines.append("-" * 33)
+            lines.append(f"ИТОГО: {total_value:.2f} {base}")
+            return "\n".join(lines)
+
+    @log_action("BUY", verbose=True)
+    def buy(self, currency: str, amount: float) -> str:
+        """
+        Купить валюту и увеличить баланс кошелька.
+        Списание базовой валюты и зачисление покупки — одно атомарное изменение.
+        """
+        with self._lock:
+            user = self._require_login()
+            if amount <= 0:
+                raise ValueError("'amount' должен быть положительным числом")
+
+            base_currency = SettingsLoader().get("BASE_CURRENCY")
+            currency = currency.upper()
+            if currency == base_currency:
+                raise ValueError(f"Нельзя покупать базовую валюту {base_currency}.")
+            get_currency(currency)
+            try:
+                rate, _ = u.get_exchange_rate(currency, base_currency)
+            except (CurrencyNotFoundError, ApiRequestError) as e:
+                raise ApiRequestError(\
+                    f"Не удалось получить курс для {currency}/{base_currency}: {e}")
+
+            cost_in_base = amount * rate
+            changes = PortfolioStore().apply(user.user_id, {
+                base_currency: -cost_in_base,
+                currency: amount,
+            })
+            self._reload_portfolio()
+            old_base_balance, new_base_balance = changes[base_currency]
+            old_balance, new_balance = changes[currency]
+
+        return (
+            f"Покупка выполнена: {amount:.4f} {currency} "\
+                f"по курсу {rate:.2f} {base_currency}/{currency}\n"
+            f"Изменения в портфеле:\n"
+            f"- {currency}: было {old_balance:.4f} → стало {new_balance:.4f}\n"
+            f"- {base_currency}: "\
+                f"было {old_base_balance:.2f} → стало {new_base_balance:.2f}\n"
+            f"Стоимость покупки: {cost_in_base:.2f} {base_currency}\n"
+        )
+
+    @log_action("SELL", verbose=True)
+    def sell(self, currency: str, amount: float) -> str:
+        """
+        Продать валюту: уменьшить баланс и начислить выручку в базовой валюте (USD).
+        Списание и начисление выручки — одно атомарное изменение; если курс
+        недоступен, балансы не меняются.
+        """
+        with self._lock:
+            user = self._require_login()
+            if amount <= 0:
+                raise ValueError("'amount' должен быть положительным числом")
+
+            code = currency.upper()
+            base_currency = SettingsLoader().get("BASE_CURRENCY")
+            if code == base_currency:
+                raise ValueError(f"Нельзя продавать базовую валюту {base_currency}")
+            get_currency(code)
+            try:
+                rate, _ = u.get_exchange_rate(code, base_currency)
+            except (CurrencyNotFoundError, ApiRequestError) as e:
+                raise ApiRequestError(\
+                    f"Не удалось получить курс для {code}/{base_currency}: {e}")
+
+            revenue_usd = amount * rate
+            changes = PortfolioStore().apply(user.user_id, {
+                code: -amount,
+                base_currency: revenue_usd,
+            })
+            self._reload_portfolio()
+            old_balance, new_balance = changes[code]
+            old_usd_balance, new_usd_balance = changes[base_currency]
+
+        return (
+            f"Продажа выполнена: {amount:.4f} {code} "\
+                f"по курсу {rate:.2f} {base_currency}/{code}\n"
+            f"Изменения в портфеле:\n"
+            f"- {code}: было {old_balance:.4f} → стало {new_balance:.4f}\n"
+            f"- {base_currency}: "\
+                f"было {old_usd_balance:.2f} → стало {new_usd_balance:.2f}\n"
+            f"Оценочная выручка: {revenue_usd:.2f} {base_currency}\n"
+        )
+
+    @log_action("ORDERS", verbose=True)
+    def execute_orders(self, orders: list[tuple[str, str, float]]) -> str:
+        """
+        Исполняет пакет заявок [(side, currency, amount), ...],
+        side — 'buy' или 'sell'. Все заявки считаются по одному снимку курсов
+        и применяются к копии портфеля: если хоть одна заявка не проходит,
+        портфель не меняется. Портфель сохраняется один раз на весь пакет.
+        """
+        with self._lock:
+            user = self._require_login()
+            if not orders:
+                raise ValueError("Список заявок пуст")
+
+            base_currency = SettingsLoader().get("BASE_CURRENCY")
+            orders = [(side.lower(), currency.upper(), amount)
+                      for side, currency, amount in orders]
+
+            for i, (side, currency, amount) in enumerate(orders, start=1):
+                try:
+                    if side not in ("buy", "sell"):
+                        raise ValueError(f"Неизвестный тип заявки '{side}'")
+                    if amount <= 0:
+                        raise ValueError("'amount' должен быть положительным числом")
+                    if currency == base_currency:
+                        raise ValueError(\
+                            f"Нельзя торговать базовой валютой {base_currency}")
+                    get_currency(currency)
+                    # Прогрев: при истёкшем TTL обновление случится здесь, до расчётов.
+                    u.get_exchange_rate(currency, base_currency)
+                except Exception as e:
+                    raise OrderRejectedError(i, (side, currency, amount), e)
+
+            snapshot = self.refresh_snapshot()
+            draft = Portfolio(user.user_id, self.portfolio.wallets)
+            deltas: dict[str, float] = {}
+            report = []
+            for i, (side, currency, amount) in enumerate(orders, start=1):
+                try:
+                    rate, _ = snapshot.rate(currency, base_currency)
+                    value = amount * rate
+                    if side == "buy":
+                        _get_or_add_wallet(draft, base_currency).withdraw(value)
+                        _get_or_add_wallet(draft, currency).deposit(amount)
+                        delta = -value
+                    else:
+                        _get_or_add_wallet(draft, currency).withdraw(amount)
+                        _get_or_add_wallet(draft, base_currency).deposit(value)
+                        delta = value
+                except Exception as e:
+                    raise OrderRejectedError(i, (side, currency, amount), e)
+                deltas[base_currency] = deltas.get(base_currency, 0.0) + delta
+                deltas[currency] = deltas.get(currency, 0.0) + \
+                    (amount if side == "buy" else -amount)
+                report.append(
+                    f"{i}. {side.upper()} {amount:.4f} {currency} "\
+                        f"по курсу {rate:.2f} {base_currency}/{currency} "\
+                        f"→ {delta:+.2f} {base_currency}"
+                )
+
+            # Пакет проверен на копии портфеля; в хранилище он применяется одним
+            # атомарным изменением балансов поверх их текущих значений.
+            PortfolioStore().apply(user.user_id, deltas)
+            self._reload_portfolio()
+
+            touched = {base_currency} | {currency for _, currency, _ in orders}
+            wallets = self.portfolio.wallets
+            lines = [f"Пакет из {len(orders)} заявок исполнен (курсы на "\
+                        f"{snapshot.last_refresh.strftime('%Y-%m-%d %H:%M:%S')}):"]
+            lines += report
+            lines.append("Балансы после исполнения:")
+            lines += [f"- {code}: {wallets[code].balance:.4f}"
+                      for code in sorted(touched) if code in wallets]
+            return "\n".join(lines)
+
+
+def _get_or_add_wallet(portfolio: Portfolio, code: str):
+    try:
+        return portfolio.get_wallet(code)
+    except CurrencyNotFoundError:
+        return portfolio.add_currency(code)
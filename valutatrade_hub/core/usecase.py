@@ -1,11 +1,12 @@
-from datetime import datetime
-
-from prettytable import PrettyTable
+import heapq
+from threading import Lock
 
 from valutatrade_hub.decorators import log_action
+from valutatrade_hub.infra.repository import PortfolioStore, UserRepository
 from valutatrade_hub.infra.settings import SettingsLoader
 from valutatrade_hub.logging_config import logger
 from valutatrade_hub.parser_service.config import ParserConfig
+from valutatrade_hub.parser_service.snapshot import SERVICE_KEYS, parse_timestamp
 from valutatrade_hub.parser_service.storage import RatesStorage
 
 from . import utils as u
@@ -13,209 +14,61 @@ from .currancies import get_currency
 from .exceptions import (
     ApiRequestError,
     CurrencyNotFoundError,
-    InsufficientFundsError,
     RateNotFoundError,
 )
-from .models import Portfolio, User
+from .models import User
+from .session import TradingSession
+
+# Сессия интерактивного CLI. Другие клиенты, обслуживающие нескольких
+# пользователей в одном процессе, создают по TradingSession на пользователя.
+_session = TradingSession()
 
-_current_user: User | None = None
-_current_portfolio: Portfolio | None = None
 
 @log_action("REGISTER")
 def register(username: str, password: str) -> str:
     """Создаёт нового пользователя и пустой портфель."""
-    users_file = SettingsLoader().get("USERS_FILE")
-    users_data = u.load_json(users_file)
+    users = UserRepository()
 
-    if any(u["username"] == username for u in users_data):
+    if users.get_by_username(username) is not None:
         raise ValueError(f"Имя пользователя '{username}' уже занято")
 
     if len(password) < 4:
         raise ValueError("Пароль должен быть не короче 4 символов")
 
-    user_id = u.next_id(users_data)
-    user = User(user_id=user_id, username=username, password=password)
-    users_data.append(user.get_user_info())
-    u.save_json(users_file, users_data)
-
-    portfolios_file = SettingsLoader().get("PORTFOLIOS_FILE")
-    portfolios = u.load_json(portfolios_file)
-    portfolios.append({
-        "user_id": user_id,
-        "wallets": {f"{SettingsLoader().get('BASE_CURRENCY')}": {"balance": 0.0}},
-    })
-    u.save_json(portfolios_file, portfolios)
+    record = users.create(
+        lambda user_id: User(user_id=user_id, username=username,
+                             password=password).get_user_info(),
+        {f"{SettingsLoader().get('BASE_CURRENCY')}": {"balance": 0.0}},
+    )
+    user_id = record["user_id"]
 
     return f"Пользователь '{username}' зарегистрирован (id={user_id}). "\
         f"Войдите: login --username {username} --password ****"
 
 
-@log_action("LOGIN")
 def login(username: str, password: str) -> str:
     """Вход пользователя и загрузка его портфеля."""
-    global _current_user, _current_portfolio
-
-    users_data = u.load_json(SettingsLoader().get("USERS_FILE"))
-    user_entry = next((u_ for u_ in users_data if u_["username"] == username), None)
-    if not user_entry:
-        raise ValueError(f"Пользователь '{username}' не найден")
-
-    user = User(
-        user_id=user_entry["user_id"],
-        username=user_entry["username"],
-        password=password,
-        salt=user_entry["salt"],
-        registration_date=datetime.fromisoformat(user_entry["registration_date"]),
-    )
-
-    if not user.verify_password(password):
-        if user.hashed_password != user_entry["hashed_password"]:
-            raise ValueError("Неверный пароль")
-
-    _current_user = user
-    _current_portfolio = Portfolio.load_portfolio(user.user_id)
-
-    return f"Вы вошли как '{username}'"
+    return _session.login(username, password)
 
 
 def show_portfolio(base: str = "USD") -> str:
     """Показывает все кошельки и общую стоимость в базовой валюте."""
-    if _current_user is None or _current_portfolio is None:
-        raise ValueError("Сначала выполните login")
-
-    base = base.upper()
-    rates = u.load_json(SettingsLoader().get("RATES_FILE"))
-    base_found = any(base in key.split("_") for key in rates.keys() if "_" in key)
-    if not base_found:
-        raise RateNotFoundError(base)
+    return _session.show_portfolio(base)
 
-    wallets = _current_portfolio.wallets
-    if not wallets:
-        return f"Портфель пользователя '{_current_user.username}' пуст."
 
-    lines = [f"Портфель пользователя '{_current_user.username}' (база: {base}):"]
-    total_value = 0.0
-
-    for code, wallet in wallets.items():
-        try:
-            rate, _ = u.get_exchange_rate(code, base)
-        except RateNotFoundError:
-            lines.append(f"- {code}: {wallet.balance:.4f} (нет курса {code}→{base})")
-            continue
-        except ApiRequestError as e:
-            lines.append(f"- {code}: {wallet.balance:.4f} (ошибка API: {e})")
-            continue
-        converted = wallet.balance * rate
-        total_value += converted
-        lines.append(f"- {code}: {wallet.balance:.4f}  → {converted:.2f} {base}")
-
-    lines.append("-" * 33)
-    lines.append(f"ИТОГО: {total_value:.2f} {base}")
-    return "\n".join(lines)
-
-
-@log_action("BUY", verbose=True)
 def buy(currency: str, amount: float) -> str:
     """Купить валюту и увеличить баланс кошелька."""
-    if _current_portfolio is None or _current_user is None:
-        raise ValueError("Сначала выполните login")
-    if amount <= 0:
-        raise ValueError("'amount' должен быть положительным числом")
-
-    base_currency = SettingsLoader().get("BASE_CURRENCY")
-    currency = currency.upper()
-    if currency == base_currency:
-        raise ValueError(f"Нельзя покупать базовую валюту {base_currency}.")
-    get_currency(currency)
-    try:
-        rate, _ = u.get_exchange_rate(currency, base_currency)
-    except (CurrencyNotFoundError, ApiRequestError) as e:
-        raise ApiRequestError(\
-            f"Не удалось получить курс для {currency}/{base_currency}: {e}")
+    return _session.buy(currency, amount)
 
-    cost_in_base = amount * rate
-    try:
-        base_wallet = _current_portfolio.get_wallet(base_currency)
-    except CurrencyNotFoundError:
-        raise InsufficientFundsError(0.0, cost_in_base, base_currency)
 
-    if base_wallet.balance < cost_in_base:
-        raise InsufficientFundsError(base_wallet.balance, cost_in_base, base_currency)
-    old_base_balance = base_wallet.balance
-    base_wallet.withdraw(cost_in_base)
-
-    try:
-        wallet = _current_portfolio.get_wallet(currency)
-    except CurrencyNotFoundError:
-        wallet = _current_portfolio.add_currency(currency)
-
-    old_balance = wallet.balance
-    wallet.deposit(amount)
-    _current_portfolio.save_portfolio()
-
-    return (
-        f"Покупка выполнена: {amount:.4f} {currency} "\
-            f"по курсу {rate:.2f} {base_currency}/{currency}\n"
-        f"Изменения в портфеле:\n"
-        f"- {currency}: было {old_balance:.4f} → стало {wallet.balance:.4f}\n"
-        f"- {base_currency}: "\
-            f"было {old_base_balance:.2f} → стало {base_wallet.balance:.2f}\n"
-        f"Стоимость покупки: {cost_in_base:.2f} {base_currency}\n"
-
-    )
-
-@log_action("SELL", verbose=True)
 def sell(currency: str, amount: float) -> str:
     """Продать валюту: уменьшить баланс и начислить выручку в базовой валюте (USD)."""
-    if _current_user is None or _current_portfolio is None:
-        raise ValueError("Сначала выполните login")
-    if amount <= 0:
-        raise ValueError("'amount' должен быть положительным числом")
-
-    try:
-        wallet = _current_portfolio.get_wallet(currency.upper())
-    except CurrencyNotFoundError:
-        raise InsufficientFundsError(0.0, amount, currency)
-
-    old_balance = wallet.balance
-    try:
-        wallet.withdraw(amount)
-    except ValueError:
-        raise InsufficientFundsError(wallet.balance, amount, currency)
+    return _session.sell(currency, amount)
 
-    base_currency = SettingsLoader().get("BASE_CURRENCY")
-    if currency == base_currency:
-        _current_portfolio.save_portfolio()
-        raise ValueError(f"Нельзя продавать базовую валюту {base_currency}")
 
-    try:
-        rate, _ = u.get_exchange_rate(currency, base_currency)
-    except (CurrencyNotFoundError, ApiRequestError) as e:
-        _current_portfolio.save_portfolio()
-        return (
-            f"Продажа частично выполнена: {amount:.4f} {currency} списано.\n"
-            f"Ошибка конверсии в {base_currency}: {e.__class__.__name__} ({e})\n"
-            f"Средства в {base_currency} не начислены, повторите позже."
-        )
-
-    revenue_usd = amount * rate
-    try:
-        usd_wallet = _current_portfolio.get_wallet(base_currency)
-    except CurrencyNotFoundError:
-        usd_wallet = _current_portfolio.add_currency(base_currency)
-    old_usd_balance = usd_wallet.balance
-    usd_wallet.deposit(revenue_usd)
-    _current_portfolio.save_portfolio()
-
-    return (
-        f"Продажа выполнена: {amount:.4f} {currency} "\
-            f"по курсу {rate:.2f} {base_currency}/{currency}\n"
-        f"Изменения в портфеле:\n"
-        f"- {currency}: было {old_balance:.4f} → стало {wallet.balance:.4f}\n"
-        f"- {base_currency}: "\
-            f"было {old_usd_balance:.2f} → стало {usd_wallet.balance:.2f}\n"
-        f"Оценочная выручка: {revenue_usd:.2f} {base_currency}\n"
-    )
+def execute_orders(orders: list[tuple[str, str, float]]) -> str:
+    """Исполняет пакет заявок [(side, currency, amount), ...] одной операцией."""
+    return _session.execute_orders(orders)
 
 
 def get_rate(frm: str, to: str) -> str:
@@ -229,15 +82,18 @@ def get_rate(frm: str, to: str) -> str:
         raise
 
     try:
-        rate, updated = u.get_exchange_rate(frm, to)
+        result = u.get_exchange_rate(frm, to)
+        rate, updated = result
         inv = 1 / rate
     except Exception as e:
         raise ApiRequestError(str(e))
 
+    stale_note = "\n(курс устарел, обновление выполняется в фоне)" \
+        if result.stale else ""
     return (
         f"Курс {frm} → {to}: {rate:.6f} "\
             f"(обновлено: {updated.strftime('%Y-%m-%d %H:%M:%S')})\n"
-        f"Обратный курс {to} → {frm}: {inv:.6f}"
+        f"Обратный курс {to} → {frm}: {inv:.6f}{stale_note}"
     )
 
 def update_rates(source: str| None = None) -> str:
@@ -249,12 +105,12 @@ def update_rates(source: str| None = None) -> str:
         print("INFO: Старт обновления курсов...")
         logger.info("Старт обновления курсов...")
 
-        u.update_rates(source)
+        u.refresh_rates(source)
 
         storage = RatesStorage()
         rates = storage.load_rates()
         last_refr = rates.get("last_refresh", "unknown").replace('T', ' ').split('+')[0]
-        total_updated = len([k for k in rates if k not in ("source", "last_refresh")])
+        total_updated = len([k for k in rates if k not in SERVICE_KEYS])
 
         logger.info(f"Обновление курсов успешно. Всего обновлено: {total_updated}. "\
             f"Время последнего обновления: {last_refr}")
@@ -265,12 +121,24 @@ def update_rates(source: str| None = None) -> str:
         logger.error(e)
         return f"ERROR: {e}"
 
-def show_rates(currency: str = None, top: int = None) -> str:
+# Готовые ответы show-rates для текущего снимка курсов: ключ — версия rates.json
+# (меняется при каждом сохранении) и параметры вывода. Между сохранениями
+# повторный вывод не строит таблицу заново.
+# Кеш общий для потоков (HTTP-сервис), поэтому обращения к нему под блокировкой.
+_rates_render_cache: dict[tuple, str] = {}
+_rates_render_lock = Lock()
+
+
+def show_rates(currency: str = None, top: int = None,
+               page: int = None, page_size: int = None) -> str:
     """
     Показать список актуальных курсов из локального кэша, упорядоченный по алфавиту.
     Опционально фильтрует по валюте (--currency),
-    показывает N самых дорогих и упорядочивает по стоимости (--top).
+    показывает N самых дорогих и упорядочивает по стоимости (--top),
+    выводит одну страницу списка (--page, --page-size).
     """
+    from prettytable import PrettyTable
+
     try:
         if currency is not None:
             currency = currency.upper()
@@ -281,43 +149,38 @@ def show_rates(currency: str = None, top: int = None) -> str:
     if top is not None and top < 0:
         logger.error("Параметр 'top' должен быть положительным числом")
         return "ERROR: Параметр 'top' должен быть положительным числом"
+    if page is not None and page < 1 or page_size is not None and page_size < 1:
+        logger.error("Параметры 'page' и 'page-size' должны быть положительными")
+        return "ERROR: Параметры 'page' и 'page-size' должны быть положительными"
+    if page_size is not None and page is None:
+        page = 1
+    if page is not None and page_size is None:
+        page_size = SettingsLoader().get("SHOW_RATES_PAGE_SIZE", 20)
 
     base =  ParserConfig().get("BASE_CURRENCY", "USD")
 
-    storage = RatesStorage()
-    rates = storage.load_rates()
-    if not rates or "last_refresh" not in rates:
+    snapshot = RatesStorage().load_snapshot()
+    if snapshot is None or snapshot.last_refresh is None:
         msg = "Локальный кеш курсов пуст. " \
         "Выполните 'update-rates', чтобы загрузить данные."
         logger.warning(msg)
         return f"WARNING: {msg}"
 
-    last_refresh = rates.get("last_refresh")
-    filtered = []
+    key = (snapshot.version, base, currency, top, page, page_size)
+    with _rates_render_lock:
+        cached = _rates_render_cache.get(key)
+    if cached is not None:
+        return cached
 
-    for pair, info in rates.items():
-        if pair in ("source", "last_refresh"):
+    filtered = []
+    for code in snapshot.codes:
+        if code == base or (currency and code != currency):
             continue
-
-        from_curr, to_curr = pair.split("_")
-        if currency and from_curr != currency:
+        try:
+            rate, updated_at = snapshot.rate(code, base)
+        except RateNotFoundError:
             continue
-
-        rate = info["rate"]
-        if base != to_curr:
-            try:
-                if (key := f"{to_curr}_{base}") in rates:
-                    base_rate = rates[key]["rate"], \
-                        datetime.fromisoformat(rates[key]["updated_at"])
-                if (rev := f"{base}_{to_curr}") in rates:
-                    base_rate = 1 / rates[rev]["rate"], \
-                        datetime.fromisoformat(rates[rev]["updated_at"])
-                rate /= base_rate
-                to_curr = base
-            except Exception:
-                continue
-
-        filtered.append((f"{from_curr}_{to_curr}", rate, info["updated_at"]))
+        filtered.append((f"{code}_{base}", rate, updated_at))
 
     if not filtered:
         msg = f"Курс для '{currency}' не найден в кеше." \
@@ -325,20 +188,176 @@ def show_rates(currency: str = None, top: int = None) -> str:
         logger.info(msg)
         return f"INFO: {msg}"
 
+    # snapshot.codes уже отсортированы, поэтому пары идут по алфавиту.
     if top:
-        filtered.sort(key=lambda x: x[1], reverse=True)
-        filtered = filtered[:int(top)]
-    else:
-        filtered.sort(key=lambda x: x[0])
+        filtered = heapq.nlargest(top, filtered, key=lambda x: x[1])
+    total = len(filtered)
+    if page is not None:
+        pages = (total + page_size - 1) // page_size
+        if page > pages:
+            return f"INFO: Страница {page} пуста, всего страниц: {pages}."
+        filtered = filtered[(page - 1) * page_size:page * page_size]
 
     table = PrettyTable()
     table.field_names = ["Валютная пара", "Курс", "Обновлено"]
     table.align["Курс"] = "r"
 
     for pair, rate, updated_at in filtered:
-        table.add_row([pair, f"{rate:.6f}", updated_at.replace('T', ' ').split('+')[0]])
+        table.add_row([pair, f"{rate:.6f}", updated_at.strftime('%Y-%m-%d %H:%M:%S')])
 
     table_str = f"Курсы из кэша "\
-        f"(обновлены {last_refresh.replace('T', ' ').split('+')[0]}):\n{table}"
+        f"(обновлены {snapshot.last_refresh.strftime('%Y-%m-%d %H:%M:%S')}):\n{table}"
+    if page is not None:
+        table_str += f"\nСтраница {page} из {pages} (всего пар: {total})"
+
+    with _rates_render_lock:
+        if any(k[0] != snapshot.version for k in _rates_render_cache):
+            _rates_render_cache.clear()
+        _rates_render_cache[key] = table_str
     return table_str
 
+
+def rate_history(pair: str, at: str = None, start: str = None, end: str = None,
+                 bucket: str = None, agg: str = "ohlc", limit: int = 50) -> str:
+    """
+    Запрос к истории курсов пары:
+    --at — курс на момент времени, --start/--end — точки интервала,
+    --bucket (30s, 5m, 1h, 1d) — агрегация интервала в OHLC или среднее (--agg).
+    """
+    from prettytable import PrettyTable
+
+    from valutatrade_hub.parser_service.history import RateHistory, parse_bucket
+
+    pair = pair.upper()
+    try:
+        from_curr, to_curr = pair.split("_")
+        get_currency(from_curr)
+        get_currency(to_curr)
+    except ValueError:
+        raise ValueError(f"Пара должна иметь вид BTC_USD, получено '{pair}'")
+    if limit <= 0:
+        raise ValueError("Параметр 'limit' должен быть положительным числом")
+
+    history = RateHistory()
+    fmt = '%Y-%m-%d %H:%M:%S'
+
+    if at is not None:
+        rate, updated_at = history.as_of(pair, parse_timestamp(at))
+        return f"Курс {pair} на {parse_timestamp(at).strftime(fmt)}: {rate:.6f} "\
+            f"(записан {updated_at.strftime(fmt)})"
+
+    start_dt = parse_timestamp(start) if start else None
+    end_dt = parse_timestamp(end) if end else None
+
+    if bucket is not None:
+        rows = history.resample(pair, parse_bucket(bucket), start_dt, end_dt, agg)
+    else:
+        rows = history.range(pair, start_dt, end_dt)
+    if not rows:
+        return f"INFO: Нет данных по {pair} за выбранный период."
+    total = len(rows)
+    rows = rows[-limit:]
+
+    table = PrettyTable()
+    if bucket is None:
+        table.field_names = ["Время", "Курс"]
+        table.add_rows([[moment.strftime(fmt), f"{rate:.6f}"] for moment, rate in rows])
+    elif agg == "ohlc":
+        table.field_names = ["Начало", "Open", "High", "Low", "Close", "Точек"]
+        table.add_rows([[r["start"].strftime(fmt), *(f"{r[k]:.6f}" for k in
+                        ("open", "high", "low", "close")), r["count"]] for r in rows])
+    else:
+        table.field_names = ["Начало", "Среднее", "Точек"]
+        table.add_rows([[r["start"].strftime(fmt), f"{r['mean']:.6f}", r["count"]]
+                        for r in rows])
+
+    shown = f" (последние {limit} из {total})" if total > limit else ""
+    return f"История {pair}{shown}:\n{table}"
+
+
+def scheduler(action: str = "status") -> str:
+    """Управление фоновым обновлением курсов: start, stop или status."""
+    from valutatrade_hub.parser_service.scheduler import UpdateScheduler
+
+    action = action.lower()
+    if action not in ("start", "stop", "status"):
+        raise ValueError(f"Неизвестное действие '{action}'. "\
+                         "Доступны: start, stop, status")
+    sched = UpdateScheduler()
+    if action == "start":
+        sched.start()
+    elif action == "stop":
+        sched.stop()
+
+    status = sched.status()
+    lines = [f"Планировщик: {'работает' if status['running'] else 'остановлен'}"]
+    for name, job in status["jobs"].items():
+        line = f"- {name}: каждые {job['interval']:.0f} с, запусков {job['runs']}, "\
+            f"ошибок {job['errors']}"
+        if job["last_run"]:
+            line += f", последний {job['last_run']} ({job['last_duration_ms']} мс)"
+        if job["next_run_in"] is not None:
+            line += f", следующий через {job['next_run_in']:.0f} с"
+        if job["last_error"]:
+            line += f", ошибка: {job['last_error']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def migrate_storage() -> str:
+    """Переносит данные из монолитных JSON-файлов в новый формат хранения."""
+    store = PortfolioStore()
+    migrated = store.migrate()
+    logger.info(f"Миграция портфелей: перенесено {migrated} "\
+                f"из {store.legacy_file} в {store.portfolios_dir}")
+
+    storage = RatesStorage()
+    history_cnt = storage.migrate_history()
+    logger.info(f"Миграция истории курсов: перенесено {history_cnt} записей "\
+                f"в {storage.history_dir}")
+    return (
+        f"Портфели перенесены в {store.portfolios_dir}: {migrated} шт.\n"
+        f"История курсов перенесена в {storage.history_dir}: {history_cnt} записей."
+    )
+
+
+def migrate_sqlite() -> str:
+    """Копирует пользователей, портфели и историю курсов из JSON-файлов в SQLite."""
+    from valutatrade_hub.infra.sqlite_store import SqliteStore
+
+    users = UserRepository().migrate_to_sqlite()
+    portfolios = PortfolioStore().migrate_to_sqlite()
+    history = RatesStorage().migrate_history_to_sqlite()
+    path = SqliteStore().path
+    logger.info(f"Миграция в SQLite ({path}): пользователей {users}, "\
+                f"портфелей {portfolios}, точек истории {history}")
+    hint = "" if SettingsLoader().get("STORAGE_BACKEND") == "sqlite" else \
+        '\nЧтобы использовать базу, укажите "STORAGE_BACKEND": "sqlite" в config.json.'
+    return (
+        f"Данные перенесены в {path}: пользователей {users}, "
+        f"портфелей {portfolios}, точек истории {history}.{hint}"
+    )
+
+
+def compact_history() -> str:
+    """Сжимает старую историю курсов по политике хранения HISTORY_RETENTION."""
+    from valutatrade_hub.parser_service.compaction import HistoryCompactor
+
+    stats = HistoryCompactor().run()
+    return (
+        f"Сжатие истории завершено: обработано сегментов {stats['segments']}, "
+        f"точек {stats['rows_in']} → корзин {stats['rows_out']}, "
+        f"удалено за сроком хранения {stats['dropped']}."
+    )
+
+
+def convert_history() -> str:
+    """Переносит JSON-историю курсов в бинарный файл (без повторов точек)."""
+    storage = RatesStorage()
+    count = storage.convert_to_binary()
+    logger.info(f"Конвертация истории: {count} новых записей "\
+                f"в {storage.binary_file}")
+    hint = "" if storage.history_backend == "binary" else \
+        '\nЧтобы использовать её, укажите "HISTORY_BACKEND": "binary" в config.json.'
+    return f"История курсов записана в {storage.binary_file}: "\
+        f"добавлено {count} записей.{hint}"
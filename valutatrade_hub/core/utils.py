@@ -1,61 +1,84 @@
 from datetime import datetime, timezone
-from venv import logger
+from threading import Condition, Lock, Thread
 
 from valutatrade_hub.core.exceptions import (
     ApiRequestError,
     RateNotFoundError,
 )
-from valutatrade_hub.infra.database import DatabaseManager
+from valutatrade_hub.infra.filelock import FileLock
 from valutatrade_hub.infra.settings import SettingsLoader
-from valutatrade_hub.parser_service.api_clients import (
-    CoinGeckoClient,
-    ExchangeRateApiClient,
-)
+from valutatrade_hub.logging_config import logger
 from valutatrade_hub.parser_service.config import ParserConfig
 from valutatrade_hub.parser_service.storage import RatesStorage
-from valutatrade_hub.parser_service.updater import RatesUpdater
 
 
-def load_json(path: str):
-    """Загрузка данных из json"""
-    try:
-        return DatabaseManager().load(path)
-    except FileNotFoundError:
-        return []
+class RateResult(tuple):
+    """
+    Результат get_exchange_rate: распаковывается как (rate, updated_at).
+    stale=True — курс взят из кеша после истечения TTL,
+    а его обновление запущено в фоне.
+    """
+
+    def __new__(cls, rate: float, updated_at: datetime, stale: bool = False):
+        result = super().__new__(cls, (rate, updated_at))
+        result.stale = stale
+        return result
 
+    @property
+    def rate(self) -> float:
+        return self[0]
 
-def save_json(path: str, data):
-    """Сохранение данных в json"""
-    DatabaseManager().save(path, data)
+    @property
+    def updated_at(self) -> datetime:
+        return self[1]
 
 
-def next_id(records: list) -> int:
-    """Вычисление нового id пользователя"""
-    if not records:
-        return 1
-    return max(u["user_id"] for u in records) + 1
+_background_refresh = Lock()
+
+
+def refresh_in_background(sources: list[str | None] | None = None) -> bool:
+    """
+    Запускает обновление курсов в фоновом потоке, если оно ещё не запущено.
+    sources — источники для обновления (None в списке или sources=None — все).
+    Возвращает True, если обновление было запущено этим вызовом.
+    """
+    if not _background_refresh.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            for source in sources or [None]:
+                refresh_rates(source)
+        except Exception as e:
+            logger.warning(f"Фоновое обновление курсов не удалось: {e}")
+        finally:
+            _background_refresh.release()
 
+    Thread(target=run, name="rates-refresh", daemon=True).start()
+    return True
 
-def find_rate(rates: dict, a: str, b: str):
-    """Пробует найти курс в прямом или обратном направлении."""
-    if (key := f"{a}_{b}") in rates:
-        return rates[key]["rate"], datetime.fromisoformat(rates[key]["updated_at"])
-    if (rev := f"{b}_{a}") in rates:
-        return 1 / rates[rev]["rate"], datetime.fromisoformat(rates[rev]["updated_at"])
-    raise RateNotFoundError(f"{a}→{b}")
 
 def update_rates(source: str | None = None):
-    """Вызывает обновление курсов через RatesUpdater."""
+    """
+    Вызывает обновление курсов через RatesUpdater.
+    source — ключ источника ('coingecko', 'exchangerate') или None для всех.
+    Курсы остальных источников в rates.json сохраняются.
+    """
+    # Клиенты тянут requests — импортируются только при реальном обновлении.
+    from valutatrade_hub.parser_service.api_clients import CLIENTS
+    from valutatrade_hub.parser_service.updater import RatesUpdater
+
+    if source is not None and source not in CLIENTS:
+        raise ValueError(f"Неизвестный источник '{source}'. "\
+                         f"Доступны: {', '.join(CLIENTS)}")
     try:
         config = ParserConfig()
-        if source == "coingecko":
-            clients = [CoinGeckoClient(config)]
-        elif source == "exchangerate":
-            clients = [ExchangeRateApiClient(config)]
-        else:
-            clients = [CoinGeckoClient(config), ExchangeRateApiClient(config)]
+        sources = [source] if source is not None else list(CLIENTS)
+        clients = [CLIENTS[name](config) for name in sources]
         storage = RatesStorage()
-        updater = RatesUpdater(clients, storage)
+        updater = RatesUpdater(clients, storage,
+                               concurrent=config.get("CONCURRENT_UPDATE", True),
+                               deadline=config.get("UPDATE_DEADLINE"))
         updated_cnt = updater.run_update()
     except ApiRequestError:
         raise
@@ -64,37 +87,161 @@ def update_rates(source: str | None = None):
     if updated_cnt == 0:
         raise ApiRequestError("Не удалось получить ни одного курса от всех клиентов.")
 
-def get_exchange_rate(from_currency: str, to_currency: str) -> tuple[float, datetime]:
+# Single-flight обновление курсов: один поток-лидер обновляет, остальные ждут
+# его результата. Между процессами лидера выбирает файловая блокировка.
+_flight_cond = Condition()
+_flights: dict[str | None, dict] = {}
+_refresh_stats = {"leader": 0, "coalesced": 0, "coalesced_cross_process": 0}
+
+
+def refresh_stats() -> dict:
     """
-    Возвращает курс между валютами из rates.json.
-    При истечении TTL - обновляет кеш.
+    Счётчики single-flight: leader — выполненные обновления,
+    coalesced — вызовы, дождавшиеся обновления другого потока,
+    coalesced_cross_process — вызовы, за которых курсы обновил другой процесс.
+    """
+    with _flight_cond:
+        return dict(_refresh_stats)
+
+
+def _source_refreshed_at(source: str | None) -> datetime | None:
+    """
+    Время самой свежей котировки источника в rates.json
+    (для source=None — самое раннее из этих времён по всем источникам).
+    """
+    snapshot = RatesStorage().load_snapshot()
+    if snapshot is None:
+        return None
+    latest: dict[str | None, datetime] = {}
+    for quote in snapshot.quotes:
+        prev = latest.get(quote.source)
+        if prev is None or quote.updated_at > prev:
+            latest[quote.source] = quote.updated_at
+    if source is not None:
+        return latest.get(source)
+    return min(latest.values(), default=None)
+
+
+def refresh_rates(source: str | None = None):
+    """
+    Обновляет курсы не более одного раза на группу одновременных вызовов.
+    Если обновление того же источника уже идёт в этом процессе, вызов ждёт его
+    завершения и разделяет результат (в том числе ошибку). Между процессами
+    обновление сериализуется блокировкой rates.json.lock; если, пока мы ждали
+    блокировку, котировки этого же источника обновил другой поток или процесс,
+    повторный запрос к API не делается. Обновление других источников
+    (и любые другие изменения rates.json) пропуском не считается.
+    """
+    with _flight_cond:
+        flight = _flights.get(source)
+        if flight is not None:
+            _refresh_stats["coalesced"] += 1
+            while not flight["done"]:
+                _flight_cond.wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return
+        flight = {"done": False, "error": None}
+        _flights[source] = flight
+
+    try:
+        before = _source_refreshed_at(source)
+        with FileLock(f"{RatesStorage().rates_file}.lock"):
+            after = _source_refreshed_at(source)
+            if after is not None and (before is None or after > before):
+                with _flight_cond:
+                    _refresh_stats["coalesced_cross_process"] += 1
+                return
+            update_rates(source)
+            with _flight_cond:
+                _refresh_stats["leader"] += 1
+    except Exception as e:
+        flight["error"] = e
+        raise
+    finally:
+        with _flight_cond:
+            flight["done"] = True
+            del _flights[source]
+            _flight_cond.notify_all()
+
+
+def _stale_sources(snapshot, from_currency: str, to_currency: str,
+                   ttl: float) -> list[str | None]:
+    """
+    Источники устаревших котировок, из которых собран курс.
+    Если у устаревшей котировки источник неизвестен (например, старый формат
+    rates.json), возвращает [None] — обновить нужно все источники.
+    """
+    from valutatrade_hub.parser_service.api_clients import CLIENTS
+
+    now = datetime.now(timezone.utc)
+    stale = {quote.source for quote in snapshot.legs(from_currency, to_currency)
+             if quote.updated_at is None
+             or (now - quote.updated_at).total_seconds() > ttl}
+    if not stale <= CLIENTS.keys():
+        return [None]
+    return sorted(stale)
+
+
+def get_exchange_rate(from_currency: str, to_currency: str) -> RateResult:
+    """
+    Возвращает курс между валютами (в т.ч. кросс-курс) из снимка rates.json.
+    При истечении TTL - обновляет кеш. С RATES_SWR_ENABLED в течение
+    RATES_STALE_GRACE_SECONDS после TTL (но не дольше RATES_MAX_STALENESS_SECONDS
+    от момента котировки) отдаёт устаревший курс сразу и обновляет кеш в фоне.
+    Обновляются только источники устаревших котировок, из которых собран курс.
     """
 
     from_currency, to_currency = from_currency.upper(), to_currency.upper()
     if from_currency == to_currency:
-        return 1.0, datetime.now()
+        return RateResult(1.0, datetime.now())
 
     storage = RatesStorage()
-    rates = storage.load_rates()
-    if not rates or "last_refresh" not in rates:
+    snapshot = storage.load_snapshot()
+    refreshed = False
+    if snapshot is None:
         logger.warning("Файл с курсами пуст или повреждён. " \
                         "Выполняется первичное обновление.")
-        update_rates()
-        rates = storage.load_rates()
+        refresh_rates()
+        refreshed = True
+        snapshot = storage.load_snapshot()
+        if snapshot is None:
+            raise RateNotFoundError(f"{from_currency}→{to_currency}")
 
     try:
-        rate, updated_at = find_rate(rates, from_currency, to_currency)
+        rate, updated_at = snapshot.rate(from_currency, to_currency)
     except RateNotFoundError:
+        if refreshed:
+            raise
         logger.info(f"Курс {from_currency}→{to_currency} не найден, обновление данных.")
-        update_rates()
-        rates = storage.load_rates()
-        rate, updated_at = find_rate(rates, from_currency, to_currency)
-
-    ttl = SettingsLoader().get("RATES_TTL_SECONDS", 3600)
-    if (datetime.now(timezone.utc) - updated_at).total_seconds() > ttl:
-        logger.info("Истёк TTL курсов - выполняется обновление...")
-        update_rates()
-        rates = storage.load_rates()
-        rate, updated_at = find_rate(rates, from_currency, to_currency)
-    return rate, updated_at
-
+        refresh_rates()
+        refreshed = True
+        snapshot = storage.load_snapshot()
+        if snapshot is None:
+            raise RateNotFoundError(f"{from_currency}→{to_currency}")
+        rate, updated_at = snapshot.rate(from_currency, to_currency)
+
+    settings = SettingsLoader()
+    ttl = settings.get("RATES_TTL_SECONDS", 3600)
+    age = (datetime.now(timezone.utc) - updated_at).total_seconds()
+    # Если обновление уже было, а курс всё ещё старый — источник не дал новых данных.
+    if age <= ttl or refreshed:
+        return RateResult(rate, updated_at)
+
+    sources = _stale_sources(snapshot, from_currency, to_currency, ttl)
+    if settings.get("RATES_SWR_ENABLED", False):
+        grace = settings.get("RATES_STALE_GRACE_SECONDS", 600)
+        max_staleness = settings.get("RATES_MAX_STALENESS_SECONDS", ttl + grace)
+        if age <= min(ttl + grace, max_staleness):
+            logger.info("Истёк TTL курсов - отдаём кеш и обновляем в фоне...")
+            refresh_in_background(sources)
+            return RateResult(rate, updated_at, stale=True)
+
+    logger.info("Истёк TTL курсов - выполняется обновление...")
+    for source in sources:
+        refresh_rates(source)
+    snapshot = storage.load_snapshot()
+    if snapshot is None:
+        raise RateNotFoundError(f"{from_currency}→{to_currency}")
+    rate, updated_at = snapshot.rate(from_currency, to_currency)
+    return RateResult(rate, updated_at)
@@ -8,18 +8,19 @@ from valutatrade_hub.logging_config import logger
 def log_action(action: str, verbose: bool = False):
     """
     Декоратор для логирования бизнес-операций (BUY, SELL, REGISTER, LOGIN).
+    Пользователь берётся из параметров username / user или из сессии,
+    метод которой декорирован (TradingSession.username).
     """
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            from valutatrade_hub.core import usecase
             bound = inspect.signature(func).bind(*args, **kwargs)
             bound.apply_defaults()
             params = bound.arguments
 
             username = params.get("username") or \
                         getattr(params.get("user", None), "username", None) or \
-                            getattr(usecase._current_user, "username", None)
+                            getattr(params.get("self", None), "username", None)
             currency = params.get("currency") or params.get("currency_code")
             amount = params.get("amount")
             base = params.get("base", "USD")
@@ -0,0 +1,85 @@
+import json
+import marshal
+
+# Сигнатуры форматов: по ним формат файла определяется при чтении.
+GZIP_MAGIC = b"\x1f\x8b"
+LZMA_MAGIC = b"\xfd7zXZ\x00"
+MARSHAL_MAGIC = b"VTM"
+
+
+def _encode_json(data) -> bytes:
+    return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def _encode_json_compact(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _encode_marshal(data) -> bytes:
+    # marshal быстрее json, но формат зависит от версии Python — она в заголовке.
+    return MARSHAL_MAGIC + bytes([marshal.version]) + marshal.dumps(data)
+
+
+ENCODERS = {
+    "json": _encode_json,
+    "json-compact": _encode_json_compact,
+    "marshal": _encode_marshal,
+}
+COMPRESSORS = ("gzip", "lzma")
+
+
+def validate(codec: str):
+    """Проверяет имя кодека вида '<формат>' или '<формат>+<сжатие>'."""
+    fmt, _, compression = codec.partition("+")
+    if fmt not in ENCODERS or compression and compression not in COMPRESSORS:
+        raise ValueError(f"Неизвестный кодек '{codec}'. Форматы: "\
+                         f"{', '.join(ENCODERS)}; сжатие: +{', +'.join(COMPRESSORS)}")
+
+
+def serialize(data, codec: str = "json") -> bytes:
+    """Сериализует документ форматом кодека, без сжатия."""
+    validate(codec)
+    return ENCODERS[codec.partition("+")[0]](data)
+
+
+def compress(raw: bytes, codec: str = "json") -> bytes:
+    """Сжимает сериализованный документ, если кодек этого требует."""
+    compression = codec.partition("+")[2]
+    if compression == "gzip":
+        import gzip
+        return gzip.compress(raw, compresslevel=6, mtime=0)
+    if compression == "lzma":
+        import lzma
+        return lzma.compress(raw)
+    return raw
+
+
+def encode(data, codec: str = "json") -> bytes:
+    """Сериализует документ кодеком, например 'json-compact' или 'marshal+lzma'."""
+    return compress(serialize(data, codec), codec)
+
+
+def decompress(raw: bytes) -> bytes:
+    """Снимает сжатие, определяя его по сигнатуре."""
+    if raw.startswith(GZIP_MAGIC):
+        import gzip
+        return gzip.decompress(raw)
+    if raw.startswith(LZMA_MAGIC):
+        import lzma
+        return lzma.decompress(raw)
+    return raw
+
+
+def deserialize(raw: bytes):
+    """Разбирает несжатый документ, определяя формат по сигнатуре."""
+    if raw.startswith(MARSHAL_MAGIC):
+        version = raw[len(MARSHAL_MAGIC)]
+        if version > marshal.version:
+            raise ValueError(f"Файл записан более новой версией marshal ({version})")
+        return marshal.loads(raw[len(MARSHAL_MAGIC) + 1:])
+    return json.loads(raw)
+
+
+def decode(raw: bytes):
+    """Восстанавливает документ, определяя сжатие и формат по сигнатуре."""
+    return deserialize(decompress(raw))
@@ -1,30 +1,248 @@
 import json
 import os
+import shutil
+import uuid
+from collections import OrderedDict
+from pathlib import PurePath
 from threading import Lock
 
+from valutatrade_hub.infra import codecs
+
+# Уровни надёжности записи: none — без fsync, file — fsync файла,
+# dir — fsync файла и каталога (переименование переживёт сбой питания).
+DURABILITY_LEVELS = ("none", "file", "dir")
+
 
 class DatabaseManager:
-    """Простой Singleton над JSON-файлами."""
+    """
+    Простой Singleton над JSON-файлами.
+    Разобранные документы кешируются по пути: повторное чтение неизменённого
+    файла (те же inode, mtime и размер) возвращает тот же объект без разбора.
+    Кеш ограничен бюджетом DB_CACHE_MAX_BYTES, при превышении вытесняются
+    давно не читавшиеся документы. Документ учитывается по размеру
+    несжатой сериализации, а не файла: со сжатием (+gzip, +lzma) файл
+    в разы меньше документа в памяти.
+    Возвращаемые документы общие: менять их можно только с последующим save().
+    Файлы перезаписываются атомарно: данные пишутся во временный файл рядом
+    и подменяют исходный через os.replace, поэтому читатель видит либо старую,
+    либо новую версию целиком. Надёжность записи задаёт DB_DURABILITY.
+    Формат документа выбирается по пути (DB_CODECS, по умолчанию DB_CODEC):
+    json, json-compact или marshal, с необязательным сжатием +gzip / +lzma.
+    При чтении формат определяется по содержимому файла.
+    """
 
     _instance = None
     _lock = Lock()
+    DEFAULT_CACHE_MAX_BYTES = 16 * 1024 * 1024
 
     def __new__(cls):
         with cls._lock:
             if cls._instance is None:
                 cls._instance = super().__new__(cls)
+                cls._instance._initialized = False
         return cls._instance
 
+    def __init__(self):
+        if self._initialized:
+            return
+        self._cache_lock = Lock()
+        # путь -> (отпечаток файла (inode, mtime, размер), документ,
+        #          размер несжатой сериализации)
+        self._cache: OrderedDict[str, tuple] = OrderedDict()
+        self._cache_bytes = 0
+        self._cache_max_bytes = self.DEFAULT_CACHE_MAX_BYTES
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self.durability = "file"
+        self.default_codec = "json"
+        self.codecs: dict[str, str] = {}
+        self._initialized = True
+
     def load(self, path: str):
-        """Загрузка данных из json."""
-        if not os.path.exists(path):
+        """Загрузка документа (формат определяется автоматически)."""
+        key = os.path.abspath(path)
+        try:
+            st = os.stat(key)
+        except FileNotFoundError:
             self.save(path, [])
             raise FileNotFoundError
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        fingerprint = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == fingerprint:
+                self._cache.move_to_end(key)
+                self._stats["hits"] += 1
+                return cached[1]
+            self._stats["misses"] += 1
+        with open(path, "rb") as f:
+            raw = codecs.decompress(f.read())
+        data = codecs.deserialize(raw)
+        self._remember(key, fingerprint, data, len(raw))
+        return data
 
     def save(self, path: str, data):
-        """Сохранение данных в json."""
+        """Атомарное сохранение документа (он сразу попадает в кеш)."""
+        codec = self.codec_for(path)
+        raw = codecs.serialize(data, codec)
+        st = self._write_atomic(path, codecs.compress(raw, codec))
+        self._remember(os.path.abspath(path),
+                       (st.st_ino, st.st_mtime_ns, st.st_size), data, len(raw))
+
+    def publish(self, source: str, path: str):
+        """
+        Атомарно делает уже записанный неизменяемый файл source доступным
+        под именем path (жёсткой ссылкой, без повторной записи данных).
+        """
+        tmp_path = self._temp_path(path)
+        try:
+            try:
+                os.link(source, tmp_path)
+            except OSError:  # файловая система без жёстких ссылок
+                shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._sync_dir(path)
+        key = os.path.abspath(source)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            st = os.stat(path)
+            self._remember(os.path.abspath(path),
+                           (st.st_ino, st.st_mtime_ns, st.st_size), *cached[1:])
+
+    def codec_for(self, path: str) -> str:
+        """Кодек для пути: первый подходящий шаблон из DB_CODECS или DB_CODEC."""
+        pure = PurePath(path)
+        for pattern, codec in self.codecs.items():
+            if pure.match(pattern):
+                return codec
+        return self.default_codec
+
+    def set_codecs(self, default: str = "json", by_pattern: dict | None = None):
+        """Задаёт кодек по умолчанию и кодеки по шаблонам путей."""
+        by_pattern = dict(by_pattern or {})
+        for codec in (default, *by_pattern.values()):
+            codecs.validate(codec)
+        self.default_codec = default
+        self.codecs = by_pattern
+
+    def set_durability(self, level: str):
+        """Задаёт уровень надёжности записи: none, file или dir."""
+        if level not in DURABILITY_LEVELS:
+            raise ValueError(f"Неизвестный уровень DB_DURABILITY '{level}'. "\
+                             f"Доступны: {', '.join(DURABILITY_LEVELS)}")
+        self.durability = level
+
+    def set_cache_budget(self, max_bytes: int):
+        """Задаёт бюджет кеша документов в байтах (0 — кеш отключён)."""
+        with self._cache_lock:
+            self._cache_max_bytes = max(0, int(max_bytes))
+            self._evict()
+
+    def invalidate(self, path: str | None = None):
+        """Сбрасывает кеш одного файла или весь кеш."""
+        with self._cache_lock:
+            if path is None:
+                self._cache.clear()
+                self._cache_bytes = 0
+            elif (cached := self._cache.pop(os.path.abspath(path), None)) is not None:
+                self._cache_bytes -= cached[2]
+
+    def cache_stats(self) -> dict:
+        """Счётчики кеша: попадания, промахи, вытеснения и текущий объём."""
+        with self._cache_lock:
+            return dict(self._stats, entries=len(self._cache),
+                        bytes=self._cache_bytes, max_bytes=self._cache_max_bytes)
+
+    def _remember(self, key: str, fingerprint: tuple, data, size: int):
+        with self._cache_lock:
+            previous = self._cache.pop(key, None)
+            if previous is not None:
+                self._cache_bytes -= previous[2]
+            if size > self._cache_max_bytes:
+                return
+            self._cache[key] = (fingerprint, data, size)
+            self._cache_bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._cache_bytes > self._cache_max_bytes:
+            _, (_, _, size) = self._cache.popitem(last=False)
+            self._cache_bytes -= size
+            self._stats["evictions"] += 1
+
+    def append(self, path: str, record):
+        """Дописывает одну запись в конец JSON Lines файла."""
+        self.append_many(path, [record])
+
+    def append_many(self, path: str, records):
+        """Дописывает несколько записей в JSON Lines файл одной операцией записи."""
         os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        created = not os.path.exists(path)
+        chunk = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        with open(path, "ab") as f:
+            f.write(chunk.encode("utf-8"))
+            if self.durability != "none":
+                f.flush()
+                os.fsync(f.fileno())
+        if created:
+            self._sync_dir(path)
+
+    def write_lines(self, path: str, records):
+        """Атомарно перезаписывает JSON Lines файл целиком."""
+        chunk = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        self._write_atomic(path, chunk.encode("utf-8"))
+
+    def _write_atomic(self, path: str, chunk: bytes) -> os.stat_result:
+        """Пишет во временный файл в том же каталоге и подменяет им path."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = self._temp_path(path)
+        try:
+            with open(tmp_path, "xb") as f:
+                f.write(chunk)
+                if self.durability != "none":
+                    f.flush()
+                    os.fsync(f.fileno())
+                st = os.fstat(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._sync_dir(path)
+        return st
+
+    @staticmethod
+    def _temp_path(path: str) -> str:
+        """Уникальное имя временного файла рядом с path (файл не создаётся)."""
+        directory, name = os.path.split(os.path.abspath(path))
+        return os.path.join(directory, f".{name}.{uuid.uuid4().hex[:12]}.tmp")
+
+    def _sync_dir(self, path: str):
+        """fsync каталога, чтобы создание и переименование файла пережили сбой."""
+        if self.durability != "dir" or os.name == "nt":
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def iter_lines(self, path: str, offset: int = 0):
+        """
+        Построчное чтение JSON Lines файла начиная с байтового смещения offset.
+        Возвращает пары (запись, смещение после записи).
+        Недописанная последняя строка пропускается.
+        """
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                if line.strip():
+                    yield json.loads(line), offset
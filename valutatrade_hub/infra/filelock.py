@@ -0,0 +1,73 @@
+import os
+from threading import Lock, get_ident
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# Блокировки, захваченные в этом процессе: путь → id потока-владельца.
+_held: dict[str, int] = {}
+_held_lock = Lock()
+
+
+class FileLock:
+    """
+    Межпроцессная рекомендательная блокировка на основе файла.
+    Использование: with FileLock("data/rates.json.lock"): ...
+    Повторный захват того же файла потоком, который уже держит блокировку,
+    не ждёт: вложенная блокировка ничего не делает, снимает её внешняя.
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self._fd = None
+        self._nested = False
+
+    def acquire(self):
+        """Блокирующий захват (ждёт, пока блокировку не отпустит другой процесс)."""
+        key = os.path.abspath(self.path)
+        with _held_lock:
+            if _held.get(key) == get_ident():
+                self._nested = True
+                return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        with _held_lock:
+            _held[key] = get_ident()
+
+    def release(self):
+        if self._nested:
+            self._nested = False
+            return
+        if self._fd is None:
+            return
+        with _held_lock:
+            _held.pop(os.path.abspath(self.path), None)
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
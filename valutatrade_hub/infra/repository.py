@@ -0,0 +1,310 @@
+import math
+import os
+from pathlib import Path
+from threading import RLock
+from typing import Callable
+
+from valutatrade_hub.core.exceptions import InsufficientFundsError
+from valutatrade_hub.infra.database import DatabaseManager
+from valutatrade_hub.infra.filelock import FileLock
+from valutatrade_hub.infra.settings import SettingsLoader
+
+
+def apply_deltas(wallets: dict, deltas: dict[str, float]) -> dict[str, tuple]:
+    """
+    Изменяет балансы кошельков {код: {"balance": ...}} на deltas {код: изменение}.
+    Недостающие кошельки создаются. Если какой-то баланс ушёл бы в минус,
+    выбрасывает InsufficientFundsError, а при нечисловом изменении (NaN,
+    бесконечность) — ValueError; в обоих случаях ничего не меняется.
+    Возвращает {код: (было, стало)}.
+    """
+    changes = {}
+    for code, delta in deltas.items():
+        old = float(wallets.get(code, {}).get("balance", 0.0))
+        if not math.isfinite(delta) or not math.isfinite(old + delta):
+            raise ValueError(f"Некорректное изменение баланса {code}: {delta}")
+        if delta < 0 and -delta > old:
+            raise InsufficientFundsError(old, -delta, code)
+        changes[code] = (old, old + delta)
+    for code, (_, new) in changes.items():
+        wallets[code] = {"balance": new}
+    return changes
+
+
+def _backend_store():
+    # sqlite3 загружается только при STORAGE_BACKEND=sqlite.
+    from valutatrade_hub.infra.sqlite_store import backend_store
+    return backend_store()
+
+
+class UserRepository:
+    """
+    Хранилище пользователей с индексами username → запись и user_id → запись.
+    Записи дописываются в JSON Lines журнал, счётчик id хранится отдельно,
+    поэтому регистрация и вход не требуют перечитывания всех пользователей.
+    Выдача id и запись в журнал идут под блокировкой users.jsonl.lock,
+    поэтому несколько процессов не выдают один id и не теряют записи друг друга.
+    С STORAGE_BACKEND=sqlite пользователи хранятся в таблице users.
+    """
+
+    _instance = None
+    _lock = RLock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super().__new__(cls)
+                cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        settings = SettingsLoader()
+        self.users_file = Path(settings.get("USERS_FILE", "data/users.json"))
+        self.log_file = Path(settings.get("USERS_LOG_FILE", "data/users.jsonl"))
+        self.meta_file = Path(settings.get("USERS_META_FILE",
+                                           "data/users_meta.json"))
+        self._by_name: dict[str, dict] = {}
+        self._by_id: dict[int, dict] = {}
+        self._offset = 0
+        self.sqlite = _backend_store()
+        self._initialized = True
+
+    def get_by_username(self, username: str) -> dict | None:
+        """Возвращает запись пользователя по имени или None."""
+        if self.sqlite is not None:
+            return self.sqlite.get_user_by_name(username)
+        with self._lock:
+            self._sync()
+            return self._by_name.get(username)
+
+    def get_by_id(self, user_id: int) -> dict | None:
+        """Возвращает запись пользователя по id или None."""
+        if self.sqlite is not None:
+            return self.sqlite.get_user_by_id(user_id)
+        with self._lock:
+            self._sync()
+            return self._by_id.get(user_id)
+
+    def allocate_id(self) -> int:
+        """Выдаёт следующий id пользователя и сохраняет счётчик на диск."""
+        if self.sqlite is not None:
+            return self.sqlite.next_user_id()
+        with self._lock, FileLock(self._file_lock_path()):
+            self._sync()
+            user_id = max(self._read_counter(), max(self._by_id, default=0) + 1)
+            DatabaseManager().save(self.meta_file, {"next_id": user_id + 1})
+            return user_id
+
+    def add(self, record: dict):
+        """Дописывает нового пользователя в журнал и индексы."""
+        if self.sqlite is not None:
+            self.sqlite.add_user(record)
+            return
+        with self._lock, FileLock(self._file_lock_path()):
+            self._sync()
+            if record["username"] in self._by_name:
+                raise ValueError(f"Имя пользователя '{record['username']}' уже занято")
+            DatabaseManager().append(self.log_file, record)
+            # Под блокировкой после нашей строки ничего не дописано:
+            # дочитывание индексирует её и сдвигает смещение ровно на неё.
+            self._sync()
+
+    def create(self, make_record: Callable[[int], dict], wallets: dict) -> dict:
+        """
+        Регистрирует пользователя: выдаёт id, записывает make_record(id)
+        и начальные кошельки. В SQLite всё это одна транзакция.
+        Возвращает запись пользователя.
+        """
+        if self.sqlite is not None:
+            return self.sqlite.create_user(make_record, wallets)
+        record = make_record(self.allocate_id())
+        self.add(record)
+        PortfolioStore().save(record["user_id"], wallets)
+        return record
+
+    def migrate_to_sqlite(self) -> int:
+        """
+        Копирует пользователей из JSON-журнала в SQLite.
+        Уже перенесённые пропускаются. Возвращает число добавленных.
+        """
+        from valutatrade_hub.infra.sqlite_store import SqliteStore
+
+        with self._lock:
+            self._sync()
+            return SqliteStore().import_users(list(self._by_id.values()))
+
+    def _file_lock_path(self) -> str:
+        return f"{self.log_file}.lock"
+
+    def _index(self, record: dict):
+        self._by_name[record["username"]] = record
+        self._by_id[record["user_id"]] = record
+
+    def _read_counter(self) -> int:
+        if not self.meta_file.exists():
+            return 1
+        return DatabaseManager().load(self.meta_file).get("next_id", 1)
+
+    def _sync(self):
+        """Дочитывает записи, добавленные в журнал с момента прошлой синхронизации."""
+        if not self.log_file.exists():
+            self._import_legacy()
+        if not self.log_file.exists() or \
+                os.path.getsize(self.log_file) == self._offset:
+            return
+        for record, offset in DatabaseManager().iter_lines(self.log_file,
+                                                           self._offset):
+            self._index(record)
+            self._offset = offset
+
+    def _import_legacy(self):
+        """Однократный перенос пользователей из users.json в журнал."""
+        if not self.users_file.exists():
+            return
+        with FileLock(self._file_lock_path()):
+            if self.log_file.exists():
+                return
+            users = DatabaseManager().load(self.users_file)
+            if not users:
+                return
+            DatabaseManager().append_many(self.log_file, users)
+            next_id = max(r["user_id"] for r in users) + 1
+            DatabaseManager().save(self.meta_file, {"next_id": next_id})
+
+
+class PortfolioStore:
+    """
+    Шардированное хранилище портфелей: по одному файлу на пользователя,
+    разложенному по подкаталогам data/portfolios/<shard>/<user_id>.json.
+    Сделка перезаписывает только файл торгующего пользователя.
+    С STORAGE_BACKEND=sqlite кошельки хранятся в таблице wallets.
+    """
+
+    _instance = None
+    _lock = RLock()
+    MIGRATED_MARKER = ".migrated"
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super().__new__(cls)
+                cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        settings = SettingsLoader()
+        self.legacy_file = Path(settings.get("PORTFOLIOS_FILE",
+                                             "data/portfolios.json"))
+        self.portfolios_dir = Path(settings.get("PORTFOLIOS_DIR",
+                                                "data/portfolios"))
+        self.shards = int(settings.get("PORTFOLIO_SHARDS", 256))
+        self.sqlite = _backend_store()
+        self._initialized = True
+
+    def path_for(self, user_id: int) -> Path:
+        """Путь к файлу портфеля пользователя."""
+        shard = f"{user_id % self.shards:02x}"
+        return self.portfolios_dir / shard / f"{user_id}.json"
+
+    def load(self, user_id: int) -> dict | None:
+        """
+        Возвращает кошельки пользователя в виде {код: {"balance": ...}}
+        или None, если портфеля нет.
+        """
+        if self.sqlite is not None:
+            return self.sqlite.load_wallets(user_id)
+        path = self.path_for(user_id)
+        if path.exists():
+            return DatabaseManager().load(path).get("wallets", {})
+        return self._load_legacy(user_id)
+
+    def save(self, user_id: int, wallets: dict):
+        """Сохраняет кошельки пользователя в его шард."""
+        if self.sqlite is not None:
+            self.sqlite.save_wallets(user_id, wallets)
+            return
+        DatabaseManager().save(self.path_for(user_id),
+                               {"user_id": user_id, "wallets": wallets})
+
+    def apply(self, user_id: int, deltas: dict[str, float]) -> dict[str, tuple]:
+        """
+        Атомарно меняет балансы кошельков пользователя (см. apply_deltas):
+        балансы читаются и записываются в одной транзакции SQLite или под
+        блокировкой файла портфеля, поэтому параллельные сделки не теряются.
+        Возвращает {код: (было, стало)}.
+        """
+        if self.sqlite is not None:
+            with self.sqlite.transaction() as conn:
+                wallets = self.sqlite.load_wallets(user_id, conn) or {}
+                changes = apply_deltas(wallets, deltas)
+                self.sqlite.save_wallets(user_id, wallets, conn)
+            return changes
+        with self._lock, FileLock(f"{self.path_for(user_id)}.lock"):
+            # Копия: документ из кеша DatabaseManager нельзя менять на месте.
+            wallets = {code: dict(info)
+                       for code, info in (self.load(user_id) or {}).items()}
+            changes = apply_deltas(wallets, deltas)
+            self.save(user_id, wallets)
+        return changes
+
+    def migrate(self) -> int:
+        """
+        Переносит все портфели из portfolios.json в шарды.
+        Уже существующие шарды не перезаписываются. Возвращает число перенесённых.
+        """
+        with self._lock:
+            migrated = 0
+            for data in self._read_legacy():
+                if self.path_for(data["user_id"]).exists():
+                    continue
+                self.save(data["user_id"], data.get("wallets", {}))
+                migrated += 1
+            self.portfolios_dir.mkdir(parents=True, exist_ok=True)
+            (self.portfolios_dir / self.MIGRATED_MARKER).touch()
+            return migrated
+
+    def migrate_to_sqlite(self) -> int:
+        """
+        Копирует портфели из шардов (и portfolios.json, если миграция в шарды
+        не выполнялась) в SQLite. Пользователи, у которых в базе уже есть
+        кошельки, пропускаются. Возвращает число перенесённых портфелей.
+        """
+        from valutatrade_hub.infra.sqlite_store import SqliteStore
+
+        with self._lock:
+            portfolios = {}
+            if not (self.portfolios_dir / self.MIGRATED_MARKER).exists():
+                portfolios = {d_["user_id"]: d_.get("wallets", {})
+                              for d_ in self._read_legacy()}
+            for path in self.portfolios_dir.glob("*/*.json"):
+                data = DatabaseManager().load(path)
+                portfolios[data["user_id"]] = data.get("wallets", {})
+            store = SqliteStore()
+            migrated = 0
+            with store.transaction() as conn:
+                for user_id, wallets in portfolios.items():
+                    if store.load_wallets(user_id, conn) is None and wallets:
+                        store.save_wallets(user_id, wallets, conn)
+                        migrated += 1
+            return migrated
+
+    def _read_legacy(self) -> list:
+        if not self.legacy_file.exists():
+            return []
+        return DatabaseManager().load(self.legacy_file)
+
+    def _load_legacy(self, user_id: int) -> dict | None:
+        """Ищет портфель в portfolios.json, пока миграция не выполнена."""
+        if (self.portfolios_dir / self.MIGRATED_MARKER).exists():
+            return None
+        data = next((d_ for d_ in self._read_legacy()
+                     if d_["user_id"] == user_id), None)
+        if data is None:
+            return None
+        wallets = data.get("wallets", {})
+        self.save(user_id, wallets)
+        return wallets
@@ -36,3 +36,8 @@ class SettingsLoader:
         if not self._config_path.exists():
             raise FileNotFoundError(f"Файл конфигурации {self._config_path} не найден")
         self._data = DatabaseManager().load(self._config_path)
+        DatabaseManager().set_cache_budget(self._data.get(
+            "DB_CACHE_MAX_BYTES", DatabaseManager.DEFAULT_CACHE_MAX_BYTES))
+        DatabaseManager().set_durability(self._data.get("DB_DURABILITY", "file"))
+        DatabaseManager().set_codecs(self._data.get("DB_CODEC", "json"),
+                                     self._data.get("DB_CODECS"))
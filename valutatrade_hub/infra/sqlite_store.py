@@ -0,0 +1,261 @@
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from threading import RLock, local
+from typing import Callable, Iterable, Iterator
+
+from valutatrade_hub.infra.database import DatabaseManager
+from valutatrade_hub.infra.settings import SettingsLoader
+
+STORAGE_BACKENDS = ("json", "sqlite")
+# Уровень DB_DURABILITY → PRAGMA synchronous. В режиме WAL значение NORMAL
+# не теряет целостность при сбое, но последняя транзакция может не сохраниться.
+SYNCHRONOUS = {"none": "OFF", "file": "NORMAL", "dir": "FULL"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    hashed_password TEXT NOT NULL,
+    salt TEXT NOT NULL,
+    registration_date TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS wallets (
+    user_id INTEGER NOT NULL,
+    currency_code TEXT NOT NULL,
+    balance REAL NOT NULL CHECK (balance >= 0),
+    PRIMARY KEY (user_id, currency_code)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rate_history (
+    id INTEGER PRIMARY KEY,
+    pair TEXT NOT NULL,
+    ts REAL NOT NULL,
+    rate REAL NOT NULL,
+    source TEXT,
+    UNIQUE (pair, ts)
+);
+CREATE INDEX IF NOT EXISTS rate_history_ts ON rate_history (ts);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Тексты запросов постоянные: sqlite3 кеширует подготовленные выражения
+# по тексту запроса, поэтому повторные вызовы не компилируют SQL заново.
+USER_COLUMNS = "user_id, username, hashed_password, salt, registration_date"
+SELECT_USER_BY_NAME = f"SELECT {USER_COLUMNS} FROM users WHERE username = ?"
+SELECT_USER_BY_ID = f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?"
+INSERT_USER = "INSERT INTO users (user_id, username, hashed_password, salt, "\
+    "registration_date) VALUES (:user_id, :username, :hashed_password, :salt, "\
+    ":registration_date)"
+IMPORT_USER = INSERT_USER.replace("INSERT", "INSERT OR IGNORE", 1)
+SELECT_COUNTER = "SELECT value FROM counters WHERE name = ?"
+SELECT_MAX_USER_ID = "SELECT COALESCE(MAX(user_id), 0) FROM users"
+UPSERT_COUNTER = "INSERT INTO counters (name, value) VALUES (?, ?) "\
+    "ON CONFLICT (name) DO UPDATE SET value = excluded.value"
+SELECT_WALLETS = "SELECT currency_code, balance FROM wallets WHERE user_id = ?"
+DELETE_WALLETS = "DELETE FROM wallets WHERE user_id = ?"
+UPSERT_WALLET = "INSERT INTO wallets (user_id, currency_code, balance) "\
+    "VALUES (?, ?, ?) ON CONFLICT (user_id, currency_code) "\
+    "DO UPDATE SET balance = excluded.balance"
+# Повтор пары на тот же момент заменяет курс: побеждает последняя запись,
+# как при чтении JSON Lines истории. Изменённая точка получает новый id,
+# чтобы её увидело дочитывание индекса (history_since); точный повтор
+# ничего не меняет.
+INSERT_HISTORY = "INSERT INTO rate_history (pair, ts, rate, source) "\
+    "VALUES (?, ?, ?, ?) ON CONFLICT (pair, ts) DO UPDATE SET "\
+    "rate = excluded.rate, source = excluded.source, "\
+    "id = (SELECT MAX(id) FROM rate_history) + 1 "\
+    "WHERE rate != excluded.rate OR source IS NOT excluded.source"
+SELECT_HISTORY = "SELECT pair, ts, rate, source FROM rate_history "\
+    "WHERE ts BETWEEN ? AND ? ORDER BY ts, id"
+SELECT_HISTORY_BEFORE = "SELECT id, pair, ts FROM rate_history WHERE ts < ?"
+DELETE_HISTORY = "DELETE FROM rate_history WHERE id = ?"
+SELECT_HISTORY_SINCE = "SELECT id, pair, ts, rate FROM rate_history "\
+    "WHERE id > ? ORDER BY id"
+
+
+def backend_store() -> "SqliteStore | None":
+    """SqliteStore, если в config.json выбран STORAGE_BACKEND=sqlite, иначе None."""
+    backend = SettingsLoader().get("STORAGE_BACKEND", "json")
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Неизвестное хранилище '{backend}'. "\
+                         f"Доступны: {', '.join(STORAGE_BACKENDS)}")
+    return SqliteStore() if backend == "sqlite" else None
+
+
+class SqliteStore:
+    """
+    Хранилище пользователей, портфелей и истории курсов в SQLite.
+    База работает в режиме WAL: чтение не блокирует запись, а запись
+    идёт короткими транзакциями BEGIN IMMEDIATE. У каждого потока своё
+    соединение. Файл базы задаётся SQLITE_FILE, ожидание занятой базы —
+    SQLITE_BUSY_TIMEOUT (секунды).
+    """
+
+    _instance = None
+    _lock = RLock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super().__new__(cls)
+                cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        settings = SettingsLoader()
+        self.path = Path(settings.get("SQLITE_FILE", "data/valutatrade.db"))
+        self.busy_timeout = float(settings.get("SQLITE_BUSY_TIMEOUT", 5))
+        self._local = local()
+        self._schema_ready = False
+        self._initialized = True
+
+    def connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока (создаётся при первом обращении)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # isolation_level=None: транзакциями управляет transaction().
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                   isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous="
+                         f"{SYNCHRONOUS[DatabaseManager().durability]}")
+            with self._lock:
+                if not self._schema_ready:
+                    conn.executescript(SCHEMA)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Транзакция с блокировкой записи с самого начала (BEGIN IMMEDIATE):
+        чтение и запись внутри неё видят согласованные данные.
+        При исключении все изменения откатываются.
+        """
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get_user_by_name(self, username: str) -> dict | None:
+        row = self.connection().execute(SELECT_USER_BY_NAME, (username,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def get_user_by_id(self, user_id: int) -> dict | None:
+        row = self.connection().execute(SELECT_USER_BY_ID, (user_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def next_user_id(self) -> int:
+        """Выдаёт следующий id пользователя (без повторов между процессами)."""
+        with self.transaction() as conn:
+            return self._next_user_id(conn)
+
+    @staticmethod
+    def _next_user_id(conn: sqlite3.Connection) -> int:
+        row = conn.execute(SELECT_COUNTER, ("user_id",)).fetchone()
+        max_id = conn.execute(SELECT_MAX_USER_ID).fetchone()[0]
+        user_id = max(row[0] if row else 1, max_id + 1)
+        conn.execute(UPSERT_COUNTER, ("user_id", user_id + 1))
+        return user_id
+
+    def create_user(self, make_record: Callable[[int], dict],
+                    wallets: dict) -> dict:
+        """
+        Регистрирует пользователя одной транзакцией: выдаёт id, записывает
+        make_record(id) и начальные кошельки. При ошибке не остаётся ни
+        пользователя без портфеля, ни израсходованного id.
+        """
+        try:
+            with self.transaction() as conn:
+                record = make_record(self._next_user_id(conn))
+                conn.execute(INSERT_USER, record)
+                self.save_wallets(record["user_id"], wallets, conn)
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Имя пользователя '{record['username']}' уже занято")
+        return record
+
+    def add_user(self, record: dict):
+        try:
+            with self.transaction() as conn:
+                conn.execute(INSERT_USER, record)
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Имя пользователя '{record['username']}' уже занято")
+
+    def import_users(self, records: Iterable[dict]) -> int:
+        """Добавляет пользователей, которых ещё нет в базе. Возвращает их число."""
+        with self.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(IMPORT_USER, records)
+            return conn.total_changes - before
+
+    def load_wallets(self, user_id: int,
+                     conn: sqlite3.Connection | None = None) -> dict | None:
+        """Кошельки пользователя {код: {"balance": ...}} или None, если их нет."""
+        rows = (conn or self.connection()).execute(SELECT_WALLETS, (user_id,))
+        wallets = {code: {"balance": balance} for code, balance in rows}
+        return wallets or None
+
+    def save_wallets(self, user_id: int, wallets: dict,
+                     conn: sqlite3.Connection | None = None):
+        """Заменяет кошельки пользователя (внутри транзакции conn или в своей)."""
+        if conn is None:
+            with self.transaction() as conn:
+                self.save_wallets(user_id, wallets, conn)
+            return
+        conn.execute(DELETE_WALLETS, (user_id,))
+        conn.executemany(UPSERT_WALLET, [(user_id, code, info["balance"])
+                                         for code, info in wallets.items()])
+
+    def add_history(self, rows: Iterable[tuple]) -> int:
+        """
+        Дописывает точки (пара, epoch, курс, источник) одной транзакцией.
+        Повтор той же пары на тот же момент заменяет прежний курс.
+        Возвращает число добавленных или изменённых точек.
+        """
+        with self.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(INSERT_HISTORY, rows)
+            return conn.total_changes - before
+
+    def iter_history(self, lo: float = float("-inf"),
+                     hi: float = float("inf")) -> Iterator[sqlite3.Row]:
+        """Точки истории с отметкой времени в [lo, hi] по возрастанию времени."""
+        yield from self.connection().execute(SELECT_HISTORY, (lo, hi))
+
+    def prune_history(self, before: float,
+                      select: Callable[[Iterator[tuple]], set[int]]) -> int:
+        """
+        Удаляет точки, id которых вернула select по потоку (id, пара, время)
+        точек старше before. Каждое удаление увеличивает счётчик
+        history_pruned, по нему индекс истории узнаёт, что его пора
+        перестроить. Возвращает число удалённых точек.
+        """
+        with self.transaction() as conn:
+            rows = (tuple(row) for row in conn.execute(SELECT_HISTORY_BEFORE,
+                                                       (before,)))
+            drop = select(rows)
+            if drop:
+                conn.executemany(DELETE_HISTORY, [(row_id,) for row_id in drop])
+                conn.execute(UPSERT_COUNTER, ("history_pruned",
+                                              self.counter("history_pruned", conn) + 1))
+        return len(drop)
+
+    def counter(self, name: str, conn: sqlite3.Connection | None = None) -> int:
+        row = (conn or self.connection()).execute(SELECT_COUNTER, (name,)).fetchone()
+        return row[0] if row else 0
+
+    def history_since(self, row_id: int) -> Iterator[sqlite3.Row]:
+        """Точки, добавленные после записи row_id (для дочитывания индекса)."""
+        yield from self.connection().execute(SELECT_HISTORY_SINCE, (row_id,))
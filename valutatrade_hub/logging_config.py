@@ -1,10 +1,32 @@
 import logging
-from logging.handlers import RotatingFileHandler
 from pathlib import Path
 
 from valutatrade_hub.infra.settings import SettingsLoader
 
 
+class _DeferredHandler(logging.Handler):
+    """
+    Создаёт настоящий обработчик при первой записи в лог: до этого
+    не читается конфигурация и не создаётся каталог логов.
+    """
+
+    def __init__(self, factory):
+        super().__init__()
+        self._factory = factory
+        self._target = None
+
+    def emit(self, record):
+        if self._target is None:
+            self._target = self._factory()
+        if record.levelno >= self._target.level:
+            self._target.handle(record)
+
+    def close(self):
+        if self._target is not None:
+            self._target.close()
+        super().close()
+
+
 class LoggerSingleton:
     _instance = None
 
@@ -18,6 +40,18 @@ class LoggerSingleton:
         if self._initialized:
             return
 
+        self.logger = logging.getLogger("valutatrade.actions")
+        # Уровень из конфигурации применяет обработчик, когда он будет создан.
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(_DeferredHandler(self._create_handler))
+        self.logger.propagate = False
+
+        self._initialized = True
+
+    @staticmethod
+    def _create_handler() -> logging.Handler:
+        from logging.handlers import RotatingFileHandler
+
         settings = SettingsLoader()
 
         log_dir = Path(settings.get("LOG_DIR", "logs"))
@@ -31,7 +65,8 @@ class LoggerSingleton:
             log_file,
             maxBytes=max_bytes,
             backupCount=backup_count,
-            encoding="utf-8"
+            encoding="utf-8",
+            delay=True,
         )
 
         formatter = logging.Formatter(
@@ -41,13 +76,7 @@ class LoggerSingleton:
         handler.setFormatter(formatter)
 
         level_name = settings.get("LOG_LEVEL", "INFO").upper()
-        level = getattr(logging, level_name, logging.INFO)
-
-        self.logger = logging.getLogger("valutatrade.actions")
-        self.logger.setLevel(level)
-        self.logger.addHandler(handler)
-        self.logger.propagate = False
-
-        self._initialized = True
+        handler.setLevel(getattr(logging, level_name, logging.INFO))
+        return handler
 
 logger = LoggerSingleton().logger
@@ -1,24 +1,147 @@
+import time
 from abc import ABC, abstractmethod
+from threading import Lock
 from typing import Dict
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from valutatrade_hub.core.exceptions import ApiRequestError
 from valutatrade_hub.decorators import log_api_call
 from valutatrade_hub.parser_service.config import ParserConfig
 
 
+class CappedRetry(Retry):
+    """Retry, который соблюдает Retry-After, но не ждёт дольше retry_after_cap."""
+
+    def __init__(self, *args, retry_after_cap: float | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.retry_after_cap = retry_after_cap
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.retry_after_cap = self.retry_after_cap
+        return retry
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is not None and self.retry_after_cap is not None:
+            return min(retry_after, self.retry_after_cap)
+        return retry_after
+
+
 class BaseApiClient(ABC):
-    """Абстрактный клиент для получения курсов валют."""
+    """
+    Абстрактный клиент для получения курсов валют.
+    Все экземпляры одного клиента используют общую HTTP-сессию с пулом
+    keep-alive соединений и повторами с экспоненциальной задержкой.
+    """
+
+    SOURCE_NAME = "API"
+    # Ключ источника в rates.json и в параметре --source.
+    SOURCE_KEY = "api"
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    _sessions: Dict[type, requests.Session] = {}
+    _stats: Dict[type, dict] = {}
+    _sessions_lock = Lock()
 
     def __init__(self, config: ParserConfig | None = None):
         self.config = config or ParserConfig()
 
+    @property
+    def session(self) -> requests.Session:
+        """HTTP-сессия клиента, общая для всех его экземпляров."""
+        cls = type(self)
+        with BaseApiClient._sessions_lock:
+            if cls not in BaseApiClient._sessions:
+                BaseApiClient._sessions[cls] = self._create_session()
+                BaseApiClient._stats[cls] = {
+                    "requests": 0, "errors": 0, "retries": 0, "total_ms": 0.0,
+                }
+            return BaseApiClient._sessions[cls]
+
+    def _create_session(self) -> requests.Session:
+        retry = CappedRetry(
+            total=self.config.get("HTTP_RETRIES", 3),
+            backoff_factor=self.config.get("HTTP_BACKOFF_FACTOR", 0.5),
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+            retry_after_cap=self.config.get("HTTP_MAX_RETRY_AFTER", 30),
+        )
+        pool_size = self.config.get("HTTP_POOL_SIZE", 4)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @classmethod
+    def connection_stats(cls) -> Dict[str, dict]:
+        """
+        Статистика по клиентам: число запросов, ошибок и повторов,
+        суммарное время и число открытых TCP-соединений.
+        Если соединений меньше, чем запросов, — работает keep-alive.
+        """
+        with BaseApiClient._sessions_lock:
+            result = {}
+            for client_cls, session in BaseApiClient._sessions.items():
+                stats = dict(BaseApiClient._stats[client_cls])
+                # Один адаптер смонтирован на http:// и https:// — считаем его раз.
+                adapters = {id(a): a for a in session.adapters.values()}.values()
+                stats["connections"] = sum(
+                    adapter.poolmanager.pools[key].num_connections
+                    for adapter in adapters
+                    for key in adapter.poolmanager.pools.keys()
+                )
+                result[client_cls.SOURCE_NAME] = stats
+            return result
+
+    def _get(self, url: str) -> dict:
+        """GET-запрос через пул соединений; возвращает разобранный JSON."""
+        timeout = self.config.settings.request_timeout
+        session = self.session
+        start = time.perf_counter()
+        try:
+            response = session.get(url, timeout=timeout)
+        except requests.exceptions.Timeout:
+            self._record(start, error=True)
+            raise ApiRequestError("Превышено время ожидания ответа")
+        except requests.exceptions.ConnectionError:
+            self._record(start, error=True)
+            raise ApiRequestError("Ошибка соединения (проверьте интернет или URL)")
+        except requests.exceptions.RequestException as e:
+            self._record(start, error=True)
+            raise ApiRequestError(f"Сбой при запросе: {e}")
+
+        retries = getattr(response.raw, "retries", None)
+        self._record(start, error=not response.ok,
+                     retries=len(retries.history) if retries is not None else 0)
+        if not response.ok:
+            self.handle_http_error(response, self.SOURCE_NAME)
+
+        try:
+            return response.json()
+        except ValueError:
+            raise ApiRequestError("Некорректный JSON-ответ")
+
     @abstractmethod
     def fetch_rates(self) -> Dict[str, float]:
         """Получает словарь курсов валют в формате { 'BTC_USD': 59337.21 }."""
         pass
 
+    def _record(self, start: float, error: bool = False, retries: int = 0):
+        with BaseApiClient._sessions_lock:
+            stats = BaseApiClient._stats[type(self)]
+            stats["requests"] += 1
+            stats["errors"] += int(error)
+            stats["retries"] += retries
+            stats["total_ms"] += (time.perf_counter() - start) * 1000
+
     @staticmethod
     def handle_http_error(response: requests.Response, source: str):
         status = response.status_code
@@ -46,34 +169,20 @@ class BaseApiClient(ABC):
 class CoinGeckoClient(BaseApiClient):
     """Клиент для получения криптовалютных курсов с CoinGecko."""
 
+    SOURCE_NAME = "CoinGecko"
+    SOURCE_KEY = "coingecko"
+
     @log_api_call("CoinGecko")
     def fetch_rates(self) -> Dict[str, float]:
-        crypto_map = self.config.get("CRYPTO_ID_MAP")
-        cryptos = self.config.get("CRYPTO_CURRENCIES")
-        base = self.config.get("BASE_CURRENCY")
-        url = self.config.get("COINGECKO_URL")
-        timeout = self.config.get("REQUEST_TIMEOUT", 10)
+        settings = self.config.settings
+        crypto_map = settings.crypto_id_map
+        cryptos = settings.crypto_currencies
+        base = settings.base_currency
+        url = settings.coingecko_url
 
         ids = ",".join(crypto_map[c] for c in cryptos)
         vs = base.lower()
-        url = f"{url}?ids={ids}&vs_currencies={vs}"
-
-        try:
-            response = requests.get(url, timeout=timeout)
-        except requests.exceptions.Timeout:
-            raise ApiRequestError("Превышено время ожидания ответа")
-        except requests.exceptions.ConnectionError:
-            raise ApiRequestError("Ошибка соединения (проверьте интернет или URL)")
-        except requests.exceptions.RequestException as e:
-            raise ApiRequestError(f"Сбой при запросе: {e}")
-
-        if not response.ok:
-            self.handle_http_error(response, "CoinGecko")
-
-        try:
-            data = response.json()
-        except ValueError:
-            raise ApiRequestError("Некорректный JSON-ответ")
+        data = self._get(f"{url}?ids={ids}&vs_currencies={vs}")
 
         rates = {}
         for symbol, coin_id in crypto_map.items():
@@ -89,35 +198,20 @@ class CoinGeckoClient(BaseApiClient):
 class ExchangeRateApiClient(BaseApiClient):
     """Клиент для получения фиатных курсов с ExchangeRate-API."""
 
+    SOURCE_NAME = "ExchangeRate-API"
+    SOURCE_KEY = "exchangerate"
+
     @log_api_call("ExchangeRate-API")
     def fetch_rates(self) -> Dict[str, float]:
         api_key = self.config.get("EXCHANGERATE_API_KEY")
         if not api_key:
             raise ApiRequestError("Отсутствует ключ EXCHANGERATE_API_KEY")
 
-        base = self.config.get("BASE_CURRENCY")
-        fiat_currencies = self.config.get("FIAT_CURRENCIES")
-        base_url = self.config.get("EXCHANGERATE_API_URL")
-        timeout = self.config.get("REQUEST_TIMEOUT", 10)
-
-        url = f"{base_url}/{api_key}/latest/{base}"
-
-        try:
-            response = requests.get(url, timeout=timeout)
-        except requests.exceptions.Timeout:
-            raise ApiRequestError("Превышено время ожидания ответа")
-        except requests.exceptions.ConnectionError:
-            raise ApiRequestError("Ошибка соединения (проверьте интернет или URL)")
-        except requests.exceptions.RequestException as e:
-            raise ApiRequestError(f"Сбой при запросе: {e}")
-
-        if not response.ok:
-            self.handle_http_error(response, "ExchangeRate-API")
-
-        try:
-            data = response.json()
-        except ValueError:
-            raise ApiRequestError("Некорректный JSON-ответ")
+        settings = self.config.settings
+        base = settings.base_currency
+        fiat_currencies = settings.fiat_currencies
+        base_url = settings.exchangerate_api_url
+        data = self._get(f"{base_url}/{api_key}/latest/{base}")
 
         rates = {}
         conversion_rates = data.get("conversion_rates", {})
@@ -126,5 +220,10 @@ class ExchangeRateApiClient(BaseApiClient):
                 pair_key = f"{code}_{base}"
                 rates[pair_key] = 1 / conversion_rates[code]
 
-
         return rates
+
+
+# Доступные источники курсов по ключу SOURCE_KEY.
+CLIENTS: Dict[str, type[BaseApiClient]] = {
+    cls.SOURCE_KEY: cls for cls in (CoinGeckoClient, ExchangeRateApiClient)
+}
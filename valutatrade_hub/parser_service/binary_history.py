@@ -0,0 +1,177 @@
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from valutatrade_hub.infra.filelock import FileLock
+
+MAGIC = b"VTRH"
+VERSION = 1
+# Заголовок: сигнатура, версия, число пар; затем словарь пар фиксированного размера.
+HEADER = struct.Struct("<4sHH")
+PAIR_SLOTS = 256
+PAIR_WIDTH = 16
+DATA_OFFSET = 64 + PAIR_SLOTS * PAIR_WIDTH
+# Запись: id пары, время (epoch, секунды), курс.
+RECORD = struct.Struct("<Hdd")
+RECORD_FIELDS = [("pair", "<u2"), ("ts", "<f8"), ("rate", "<f8")]
+
+
+def load_numpy():
+    """numpy нужен только для arrays(); импортируется при первом обращении."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class BinaryHistory:
+    """
+    История курсов в бинарном файле с записями фиксированной длины
+    (18 байт на точку вместо ~150 байт JSON). В заголовке хранится словарь
+    пар: id записи → код пары. Чтение идёт через mmap без копирования,
+    с numpy доступны структурированные массивы поверх отображённого файла.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def pairs(self) -> list[str]:
+        """Словарь пар из заголовка: индекс в списке — id пары в записях."""
+        if not self.path.exists():
+            return []
+        with open(self.path, "rb") as f:
+            return self._read_pairs(f)
+
+    def __len__(self) -> int:
+        if not self.path.exists():
+            return 0
+        # Недописанная последняя запись (сбой при записи) не учитывается.
+        return (os.path.getsize(self.path) - DATA_OFFSET) // RECORD.size
+
+    def append(self, points: Iterable[tuple[str, float, float]]) -> int:
+        """Дописывает точки (пара, epoch, курс). Возвращает их число."""
+        with FileLock(f"{self.path}.lock"):
+            return self._append(self.path, points)
+
+    def merge(self, points: Iterable[tuple[str, float, float]]) -> int:
+        """
+        Пересобирает файл: прежние записи и новые точки без повторов
+        (пара, время). Блокировка файла держится всю сборку, поэтому точки,
+        дописанные параллельно через append, не теряются. Готовый файл
+        подменяет прежний целиком. Возвращает число добавленных точек.
+        """
+        seen: set[tuple[str, float]] = set()
+
+        def unseen(source):
+            for pair, ts, rate in source:
+                if (pair, ts) not in seen:
+                    seen.add((pair, ts))
+                    yield pair, ts, rate
+
+        with FileLock(f"{self.path}.lock"):
+            tmp = self.path.with_name(f"{self.path.name}.tmp")
+            tmp.unlink(missing_ok=True)
+            self._append(tmp, unseen(self.scan()))
+            added = self._append(tmp, unseen(points))
+            os.replace(tmp, self.path)
+        return added
+
+    def prune(self, select: Callable[[Iterator[tuple[int, str, float]]], set[int]]
+              ) -> int:
+        """
+        Удаляет записи, номера которых вернула select по потоку
+        (номер, пара, время). Файл пересобирается под блокировкой
+        и подменяет прежний целиком. Возвращает число удалённых записей.
+        """
+        with FileLock(f"{self.path}.lock"):
+            drop = select((i, pair, ts)
+                          for i, (pair, ts, _) in enumerate(self.scan()))
+            if not drop:
+                return 0
+            tmp = self.path.with_name(f"{self.path.name}.tmp")
+            tmp.unlink(missing_ok=True)
+            self._append(tmp, (point for i, point in enumerate(self.scan())
+                               if i not in drop))
+            os.replace(tmp, self.path)
+        return len(drop)
+
+    def scan(self, start: int = 0) -> Iterator[tuple[str, float, float]]:
+        """Последовательное чтение точек начиная с записи start."""
+        count = len(self)
+        if start >= count:
+            return
+        pairs = self.pairs()
+        lo = DATA_OFFSET + start * RECORD.size
+        hi = DATA_OFFSET + count * RECORD.size
+        with open(self.path, "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                memoryview(mm) as view, view[lo:hi] as records:
+            for pair_id, ts, rate in RECORD.iter_unpack(records):
+                yield pairs[pair_id], ts, rate
+
+    def arrays(self):
+        """
+        Все записи как структурированный numpy-массив (поля pair, ts, rate),
+        отображённый на файл без копирования, и словарь пар.
+        """
+        np = load_numpy()
+        if np is None:
+            raise ImportError("Для arrays() нужен numpy: pip install numpy")
+        dtype = np.dtype(RECORD_FIELDS)
+        count = len(self)
+        if count == 0:
+            return np.empty(0, dtype=dtype), self.pairs()
+        records = np.memmap(self.path, dtype=dtype, mode="r",
+                            offset=DATA_OFFSET, shape=(count,))
+        return records, self.pairs()
+
+    @staticmethod
+    def _append(path: Path, points: Iterable[tuple[str, float, float]]) -> int:
+        """Дописывает точки в файл path (блокировку держит вызывающий)."""
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, 0).ljust(DATA_OFFSET, b"\0"))
+        with open(path, "r+b") as f:
+            pairs = BinaryHistory._read_pairs(f)
+            ids = {pair: i for i, pair in enumerate(pairs)}
+            chunk = bytearray()
+            for pair, ts, rate in points:
+                if pair not in ids:
+                    ids[pair] = BinaryHistory._add_pair(f, pairs, pair)
+                chunk += RECORD.pack(ids[pair], ts, rate)
+            count = (os.path.getsize(path) - DATA_OFFSET) // RECORD.size
+            f.seek(DATA_OFFSET + count * RECORD.size)
+            f.write(chunk)
+            f.truncate()
+        return len(chunk) // RECORD.size
+
+    @staticmethod
+    def _read_pairs(f) -> list[str]:
+        f.seek(0)
+        magic, version, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Неизвестный формат бинарной истории: {f.name}")
+        f.seek(64)
+        raw = f.read(count * PAIR_WIDTH)
+        return [raw[i:i + PAIR_WIDTH].rstrip(b"\0").decode("ascii")
+                for i in range(0, len(raw), PAIR_WIDTH)]
+
+    @staticmethod
+    def _add_pair(f, pairs: list[str], pair: str) -> int:
+        encoded = pair.encode("ascii")
+        if len(pairs) >= PAIR_SLOTS or len(encoded) > PAIR_WIDTH:
+            raise ValueError(f"Пару {pair} нельзя добавить в бинарную историю")
+        pair_id = len(pairs)
+        f.seek(64 + pair_id * PAIR_WIDTH)
+        f.write(encoded.ljust(PAIR_WIDTH, b"\0"))
+        pairs.append(pair)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(pairs)))
+        return pair_id
@@ -0,0 +1,267 @@
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from valutatrade_hub.infra.database import DatabaseManager
+from valutatrade_hub.infra.settings import SettingsLoader
+from valutatrade_hub.logging_config import logger
+from valutatrade_hub.parser_service.history import parse_bucket
+from valutatrade_hub.parser_service.snapshot import parse_timestamp
+from valutatrade_hub.parser_service.storage import (
+    TIER_FORMATS,
+    RatesStorage,
+    expand_history_entry,
+    period_bounds,
+)
+
+# Сколько хранить каждый уровень истории; None — хранить без ограничения.
+DEFAULT_RETENTION = {
+    "raw": "7d",
+    "1m": "30d",
+    "1h": "365d",
+    "1d": None,
+}
+
+
+class HistoryCompactor:
+    """
+    Многоуровневое хранение истории курсов.
+    Сырые точки хранятся HISTORY_RETENTION["raw"], затем сворачиваются
+    в минутные OHLC-корзины, те — в часовые, часовые — в дневные.
+    Данные старше срока последнего уровня удаляются или, с HISTORY_ARCHIVE,
+    переносятся в history/archive (с "gzip" — в сжатом виде).
+    Сегменты обрабатываются по одному, поэтому вся история в память
+    не загружается.
+    С HISTORY_BACKEND=binary и sqlite уровни хранятся в том же файле или
+    таблице: из точек старше срока уровня остаётся последняя в каждом его
+    интервале (как цена закрытия корзины), а точки старше срока последнего
+    уровня удаляются. HISTORY_ARCHIVE для этих форматов не применяется.
+    """
+
+    def __init__(self):
+        settings = SettingsLoader()
+        self.storage = RatesStorage()
+        policy = settings.get("HISTORY_RETENTION", DEFAULT_RETENTION)
+        unknown = set(policy) - {"raw", *TIER_FORMATS}
+        if unknown:
+            raise ValueError(f"Неизвестные уровни истории: {', '.join(unknown)}. "\
+                             f"Доступны: raw, {', '.join(TIER_FORMATS)}")
+        self.retention = {
+            level: None if value is None else parse_bucket(value)
+            for level, value in policy.items()
+        }
+        self.archive = settings.get("HISTORY_ARCHIVE", False)
+        self.archive_dir = self.storage.history_dir / "archive"
+
+    def run(self, now: datetime | None = None) -> dict:
+        """
+        Один проход сжатия: от сырых данных к дневным корзинам.
+        Возвращает статистику: обработанные сегменты, точки на входе,
+        корзины на выходе и удалённые (архивированные) файлы.
+        """
+        now = now or datetime.now(timezone.utc)
+        stats = {"segments": 0, "rows_in": 0, "rows_out": 0, "dropped": 0}
+        if self.storage.history_backend != "jsonl":
+            return self._prune(now, stats)
+        levels = self._levels()
+        for level, target in zip(levels, levels[1:] + [None]):
+            window = self.retention.get(level)
+            if window is None:
+                continue
+            cutoff = now - timedelta(seconds=window)
+            paths = self.storage.history_segments() if level == "raw" \
+                else self.storage.tier_segments(level)
+            for path in paths:
+                if period_bounds(path)[1] > cutoff:
+                    break
+                if target is None:
+                    self._drop(level, path)
+                    stats["dropped"] += 1
+                    continue
+                rows_in, rows_out = self._compact(level, path, target)
+                stats["segments"] += 1
+                stats["rows_in"] += rows_in
+                stats["rows_out"] += rows_out
+        logger.info(f"Сжатие истории: сегментов {stats['segments']}, "\
+                    f"точек {stats['rows_in']} → корзин {stats['rows_out']}, "\
+                    f"удалено {stats['dropped']}")
+        return stats
+
+    def _levels(self) -> list[str]:
+        return ["raw"] + [tier for tier in TIER_FORMATS if tier in self.retention]
+
+    def _prune(self, now: datetime, stats: dict) -> dict:
+        """Сжатие истории в бинарном файле или SQLite (см. описание класса)."""
+        raw_window = self.retention.get("raw")
+        if raw_window is not None:
+            now_ts = now.timestamp()
+
+            def select(points) -> set:
+                return self._surplus(points, now_ts, stats)
+
+            if self.storage.history_backend == "binary":
+                self.storage.binary_history().prune(select)
+            else:
+                self.storage.sqlite_store().prune_history(now_ts - raw_window,
+                                                          select)
+        logger.info(f"Сжатие истории ({self.storage.history_backend}): "\
+                    f"точек {stats['rows_in']} → {stats['rows_out']}, "\
+                    f"удалено за сроком хранения {stats['dropped']}")
+        return stats
+
+    def _step(self, age: float) -> float | None:
+        """Шаг хранения точки возраста age: 0 — как есть, None — удалить."""
+        for level in self._levels():
+            window = self.retention.get(level)
+            if window is None or age < window:
+                return 0 if level == "raw" else parse_bucket(level)
+        return None
+
+    def _surplus(self, points, now: float, stats: dict) -> set:
+        """
+        Ключи лишних точек из потока (ключ, пара, время): в каждом интервале
+        уровня остаётся самая поздняя точка, просроченные удаляются.
+        """
+        latest: dict[tuple, tuple[float, object]] = {}
+        surplus = set()
+        for key, pair, ts in points:
+            step = self._step(now - ts)
+            if step is None:
+                surplus.add(key)
+                stats["dropped"] += 1
+                continue
+            if not step:
+                continue
+            stats["rows_in"] += 1
+            slot = (pair, step, int(ts // step))
+            prev = latest.get(slot)
+            if prev is None:
+                latest[slot] = (ts, key)
+            elif ts >= prev[0]:
+                surplus.add(prev[1])
+                latest[slot] = (ts, key)
+            else:
+                surplus.add(key)
+        stats["rows_out"] = len(latest)
+        return surplus
+
+    def _compact(self, level: str, path: Path, target: str) -> tuple[int, int]:
+        """
+        Сворачивает один файл уровня level в корзины уровня target
+        и сливает их с уже записанными корзинами. Исходный файл удаляется
+        только после записи результата. Корзина помнит файлы, из которых
+        собрана (sources), поэтому повторный запуск после сбоя между записью
+        и удалением не добавляет тот же файл в корзину второй раз.
+        """
+        size = parse_bucket(target)
+        source = f"{level}/{path.name}"
+        by_file: dict[Path, dict[tuple, dict]] = {}
+        rows_in = 0
+        for bucket in self._read_buckets(level, path):
+            rows_in += 1
+            start = int(bucket["first_at"]) // size * size
+            target_path = self.storage.tier_path(
+                target, datetime.fromtimestamp(start, tz=timezone.utc))
+            buckets = by_file.setdefault(target_path, {})
+            key = (bucket["pair"], start)
+            # Корзина верхнего уровня помнит только файл, из которого собрана.
+            bucket["sources"] = {source}
+            if key in buckets:
+                _merge(buckets[key], bucket)
+            else:
+                buckets[key] = dict(bucket, start=start)
+
+        rows_out = 0
+        for target_path, buckets in by_file.items():
+            for bucket in self._read_buckets(target, target_path):
+                key = (bucket["pair"], bucket["start"])
+                if key in buckets and source not in bucket["sources"]:
+                    _merge(buckets[key], bucket)
+                else:
+                    # Корзины без этого файла или уже включающие его.
+                    buckets[key] = bucket
+            rows = [_dump(buckets[key]) for key in sorted(buckets,
+                                                          key=lambda k: (k[1], k[0]))]
+            DatabaseManager().write_lines(target_path, rows)
+            rows_out += len(rows)
+        self._drop(level, path)
+        return rows_in, rows_out
+
+    def _read_buckets(self, level: str, path: Path):
+        """Записи файла в виде корзин; сырая точка — корзина из одной точки."""
+        if level != "raw":
+            for row, _ in DatabaseManager().iter_lines(path):
+                yield {
+                    "pair": row["pair"],
+                    "start": _epoch(row["start"]),
+                    "first_at": _epoch(row["first_at"]),
+                    "last_at": _epoch(row["last_at"]),
+                    "open": row["open"], "high": row["high"],
+                    "low": row["low"], "close": row["close"],
+                    "count": row["count"],
+                    "sources": set(row.get("sources", ())),
+                }
+            return
+        last: dict[str, dict] = {}
+        for line, _ in DatabaseManager().iter_lines(path):
+            for entry in expand_history_entry(line, last):
+                ts = _epoch(entry["timestamp"])
+                rate = float(entry["rate"])
+                yield {
+                    "pair": f"{entry['from_currency']}_{entry['to_currency']}",
+                    "start": ts, "first_at": ts, "last_at": ts,
+                    "open": rate, "high": rate, "low": rate, "close": rate,
+                    "count": 1,
+                }
+
+    def _drop(self, level: str, path: Path):
+        """Удаляет файл истории или переносит его в архив."""
+        if not self.archive:
+            path.unlink()
+            return
+        archive_path = self.archive_dir / level / path.name
+        archive_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.archive != "gzip":
+            os.replace(path, archive_path)
+            return
+        # Архив читается редко, поэтому хранится сжатым.
+        import gzip
+        with open(path, "rb") as src, \
+                gzip.open(f"{archive_path}.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        path.unlink()
+
+
+def _merge(acc: dict, bucket: dict):
+    if bucket["first_at"] < acc["first_at"]:
+        acc["first_at"], acc["open"] = bucket["first_at"], bucket["open"]
+    if bucket["last_at"] >= acc["last_at"]:
+        acc["last_at"], acc["close"] = bucket["last_at"], bucket["close"]
+    acc["high"] = max(acc["high"], bucket["high"])
+    acc["low"] = min(acc["low"], bucket["low"])
+    acc["count"] += bucket["count"]
+    acc["sources"] = acc["sources"] | bucket["sources"]
+
+
+def _epoch(value: str) -> float:
+    return parse_timestamp(value).timestamp()
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+def _dump(bucket: dict) -> dict:
+    return {
+        "pair": bucket["pair"],
+        "start": _iso(bucket["start"]),
+        "first_at": _iso(bucket["first_at"]),
+        "last_at": _iso(bucket["last_at"]),
+        "open": bucket["open"],
+        "high": bucket["high"],
+        "low": bucket["low"],
+        "close": bucket["close"],
+        "count": bucket["count"],
+        "sources": sorted(bucket.get("sources", ())),
+    }
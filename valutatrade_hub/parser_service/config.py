@@ -1,11 +1,59 @@
 import json
 import os
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any
+from types import MappingProxyType
+from typing import Any, Mapping
 
 from valutatrade_hub.infra.database import DatabaseManager
 
 
+@dataclass(frozen=True)
+class ParserSettings:
+    """Неизменяемый типизированный снимок конфигурации парсера."""
+
+    exchangerate_api_key: str
+    coingecko_url: str
+    exchangerate_api_url: str
+    base_currency: str
+    fiat_currencies: tuple[str, ...]
+    crypto_currencies: tuple[str, ...]
+    crypto_id_map: Mapping[str, str]
+    rates_file_path: str
+    history_file_path: str
+    request_timeout: float
+    http_retries: int
+    http_backoff_factor: float
+    http_max_retry_after: float
+    http_pool_size: int
+    concurrent_update: bool
+    update_deadline: float
+    raw: Mapping[str, Any] = field(repr=False)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ParserSettings":
+        return cls(
+            exchangerate_api_key=str(data["EXCHANGERATE_API_KEY"]),
+            coingecko_url=str(data["COINGECKO_URL"]),
+            exchangerate_api_url=str(data["EXCHANGERATE_API_URL"]),
+            base_currency=str(data["BASE_CURRENCY"]),
+            fiat_currencies=tuple(data["FIAT_CURRENCIES"]),
+            crypto_currencies=tuple(data["CRYPTO_CURRENCIES"]),
+            crypto_id_map=MappingProxyType(dict(data["CRYPTO_ID_MAP"])),
+            rates_file_path=str(data["RATES_FILE_PATH"]),
+            history_file_path=str(data["HISTORY_FILE_PATH"]),
+            request_timeout=float(data["REQUEST_TIMEOUT"]),
+            http_retries=int(data["HTTP_RETRIES"]),
+            http_backoff_factor=float(data["HTTP_BACKOFF_FACTOR"]),
+            http_max_retry_after=float(data["HTTP_MAX_RETRY_AFTER"]),
+            http_pool_size=int(data["HTTP_POOL_SIZE"]),
+            concurrent_update=bool(data["CONCURRENT_UPDATE"]),
+            update_deadline=float(data["UPDATE_DEADLINE"]),
+            raw=MappingProxyType(dict(data)),
+        )
+
+
 class ParserConfig:
     _instance = None
 
@@ -25,8 +73,17 @@ class ParserConfig:
         "RATES_FILE_PATH": "data/rates.json",
         "HISTORY_FILE_PATH": "data/exchange_rates.json",
         "REQUEST_TIMEOUT": 10,
+        "HTTP_RETRIES": 3,
+        "HTTP_BACKOFF_FACTOR": 0.5,
+        "HTTP_MAX_RETRY_AFTER": 30,
+        "HTTP_POOL_SIZE": 4,
+        "CONCURRENT_UPDATE": True,
+        "UPDATE_DEADLINE": 15,
     }
 
+    # Как часто (в секундах) проверять, не изменился ли файл конфигурации.
+    CHECK_INTERVAL = 1.0
+
     def __new__(cls, config_path: str = "parser_config.json"):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
@@ -37,10 +94,19 @@ class ParserConfig:
         if self._initialized:
             return
         self._config_path = Path(config_path)
-        self._data = {}
+        self._settings: ParserSettings | None = None
+        self._fingerprint: tuple | None = None
+        self._last_check = 0.0
+        self.reload_count = 0
         self.reload()
         self._initialized = True
 
+    @property
+    def settings(self) -> ParserSettings:
+        """Актуальный снимок конфигурации (перечитывается при изменении файла)."""
+        self._refresh_if_changed()
+        return self._settings
+
     def get(self, key: str, default: Any = None) -> Any:
         """
         Возвращает значение конфигурации по ключу.
@@ -51,35 +117,49 @@ class ParserConfig:
             env_value = os.getenv("EXCHANGERATE_API_KEY")
             if env_value is not None:
                 return env_value
-        self.reload()
-        return self._data.get(key, self.DEFAULTS.get(key, default))
+        return self.settings.raw.get(key, self.DEFAULTS.get(key, default))
 
     def reload(self):
         """Перезагрузка конфигурации с диска. Если файла нет — создаём с дефолтами."""
-
+        self.reload_count += 1
         try:
-            self._data = DatabaseManager().load(self._config_path)
+            data = DatabaseManager().load(self._config_path)
         except json.JSONDecodeError:
-            print(f"Ошибка чтения {self._config_path}, "/
-                    "восстановлены значения по умолчанию.")
-            self._data = self.DEFAULTS.copy()
+            print(f"Ошибка чтения {self._config_path}, "
+                  "восстановлены значения по умолчанию.")
+            data = self.DEFAULTS.copy()
         except FileNotFoundError:
-            print(f"Конфиг {self._config_path} не найден, "/
+            print(f"Конфиг {self._config_path} не найден, "
                   "создаю с настройками парсера по умолчанию.")
-            self._data = self.DEFAULTS.copy()
+            data = self.DEFAULTS.copy()
             self._config_path.parent.mkdir(parents=True, exist_ok=True)
-            DatabaseManager().save(self._config_path, self._data)
-            return
-
-        updated = False
-        for key, value in self.DEFAULTS.items():
-            if key not in self._data:
-                self._data[key] = value
-                updated = True
+            DatabaseManager().save(self._config_path, data)
+        else:
+            missing = {k: v for k, v in self.DEFAULTS.items() if k not in data}
+            if missing:
+                data.update(missing)
+                DatabaseManager().save(self._config_path, data)
 
-        if updated:
-            DatabaseManager().save(self._config_path, self._data)
+        self._settings = ParserSettings.from_dict(data)
+        self._fingerprint = self._stat()
+        self._last_check = time.monotonic()
 
     def as_dict(self) -> dict:
         """Возвращает полную конфигурацию в виде словаря."""
-        return self._data.copy()
+        return dict(self.settings.raw)
+
+    def _refresh_if_changed(self):
+        """Не чаще раза в CHECK_INTERVAL сверяет mtime/размер файла с загруженными."""
+        now = time.monotonic()
+        if now - self._last_check < self.CHECK_INTERVAL:
+            return
+        self._last_check = now
+        if self._stat() != self._fingerprint:
+            self.reload()
+
+    def _stat(self) -> tuple | None:
+        try:
+            st = os.stat(self._config_path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
@@ -0,0 +1,228 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from pathlib import Path
+from threading import RLock
+
+from valutatrade_hub.core.exceptions import RateNotFoundError
+from valutatrade_hub.infra.database import DatabaseManager
+from valutatrade_hub.parser_service.snapshot import parse_timestamp
+from valutatrade_hub.parser_service.storage import (
+    TIER_FORMATS,
+    RatesStorage,
+    expand_history_entry,
+)
+
+BUCKET_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_bucket(value: str) -> int:
+    """Переводит размер корзины вида '30s', '5m', '1h', '1d' в секунды."""
+    value = value.strip().lower()
+    try:
+        size = int(value[:-1]) * BUCKET_UNITS[value[-1]]
+    except (KeyError, ValueError, IndexError):
+        raise ValueError(f"Некорректный размер интервала '{value}'. "\
+                         "Примеры: 30s, 5m, 1h, 1d")
+    if size <= 0:
+        raise ValueError("Размер интервала должен быть положительным")
+    return size
+
+
+def _to_epoch(moment: datetime) -> float:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _from_epoch(ts: float) -> datetime:
+    return datetime.fromtimestamp(ts, tz=timezone.utc)
+
+
+def _file_id(path: Path) -> tuple:
+    st = path.stat()
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class RateHistory:
+    """
+    Индекс истории курсов: для каждой пары — отсортированные по времени
+    списки отметок (epoch) и значений. Запросы выполняются бинарным поиском,
+    поэтому их стоимость логарифмическая от размера истории.
+    Индекс строится один раз и затем дочитывает только новые строки сегментов.
+    Для сжатых периодов (см. compact-history) в индекс попадают цены закрытия
+    OHLC-корзин; после сжатия индекс перестраивается.
+    """
+
+    _instance = None
+    _lock = RLock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super().__new__(cls)
+                cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self.storage = RatesStorage()
+        self._times: dict[str, list[float]] = {}
+        self._rates: dict[str, list[float]] = {}
+        self._offsets: dict[Path, int] = {}
+        self._last: dict[str, dict] = {}
+        self._tiers: dict[Path, tuple] = {}
+        self._binary_count = 0
+        self._binary_ino = None
+        self._sqlite_id = 0
+        self._sqlite_pruned = 0
+        self._initialized = True
+
+    def refresh(self):
+        """Дочитывает в индекс записи, появившиеся с прошлого обновления."""
+        with self._lock:
+            if self.storage.history_backend == "binary":
+                self._refresh_binary()
+                return
+            if self.storage.history_backend == "sqlite":
+                store = self.storage.sqlite_store()
+                pruned = store.counter("history_pruned")
+                if pruned != self._sqlite_pruned:
+                    # Старые точки прорежены (compact-history) — индекс заново.
+                    self._times, self._rates, self._sqlite_id = {}, {}, 0
+                    self._sqlite_pruned = pruned
+                for row in store.history_since(self._sqlite_id):
+                    self._insert(row["pair"], row["ts"], row["rate"])
+                    self._sqlite_id = row["id"]
+                return
+            segments = self.storage.history_segments()
+            tiers = {path: _file_id(path) for tier in TIER_FORMATS
+                     for path in self.storage.tier_segments(tier)}
+            # Файлы уровней перезаписываются целиком, а сжатые сегменты удаляются:
+            # в этих случаях дочитывать нечего, индекс строится заново.
+            if tiers != self._tiers or not self._offsets.keys() <= set(segments):
+                self._times, self._rates = {}, {}
+                self._offsets, self._last = {}, {}
+                for path in tiers:
+                    for bucket, _ in DatabaseManager().iter_lines(path):
+                        self._insert(bucket["pair"],
+                                     _to_epoch(parse_timestamp(bucket["last_at"])),
+                                     float(bucket["close"]))
+                self._tiers = tiers
+            for path in segments:
+                offset = self._offsets.get(path, 0)
+                if path.stat().st_size == offset:
+                    continue
+                for line, offset in DatabaseManager().iter_lines(path, offset):
+                    for entry in expand_history_entry(line, self._last):
+                        self._add(entry)
+                self._offsets[path] = offset
+
+    def _refresh_binary(self):
+        history = self.storage.binary_history()
+        if not history.exists():
+            return
+        ino = history.path.stat().st_ino
+        if ino != self._binary_ino:
+            # Файл пересобран (convert-history) — индекс строится заново.
+            self._times, self._rates, self._binary_count = {}, {}, 0
+            self._binary_ino = ino
+        for pair, ts, rate in history.scan(self._binary_count):
+            self._insert(pair, ts, rate)
+            self._binary_count += 1
+
+    def _add(self, entry: dict):
+        self._insert(f"{entry['from_currency']}_{entry['to_currency']}",
+                     _to_epoch(parse_timestamp(entry["timestamp"])),
+                     float(entry["rate"]))
+
+    def _insert(self, pair: str, ts: float, rate: float):
+        times = self._times.setdefault(pair, [])
+        rates = self._rates.setdefault(pair, [])
+        if not times or ts > times[-1]:
+            times.append(ts)
+            rates.append(rate)
+            return
+        i = bisect_right(times, ts)
+        if i and times[i - 1] == ts:
+            # Повтор точки на тот же момент: побеждает последняя запись.
+            rates[i - 1] = rate
+            return
+        times.insert(i, ts)
+        rates.insert(i, rate)
+
+    def pairs(self) -> list[str]:
+        """Пары, по которым есть история."""
+        self.refresh()
+        return sorted(self._times)
+
+    def _series(self, pair: str) -> tuple[list[float], list[float], bool]:
+        """Ряд пары; для обратной пары значения инвертируются на лету."""
+        self.refresh()
+        pair = pair.upper()
+        if pair in self._times:
+            return self._times[pair], self._rates[pair], False
+        from_curr, _, to_curr = pair.partition("_")
+        if (rev := f"{to_curr}_{from_curr}") in self._times:
+            return self._times[rev], self._rates[rev], True
+        raise RateNotFoundError(pair)
+
+    def as_of(self, pair: str, moment: datetime) -> tuple[float, datetime]:
+        """Последний известный курс пары на момент moment."""
+        times, rates, inverted = self._series(pair)
+        i = bisect_right(times, _to_epoch(moment)) - 1
+        if i < 0:
+            raise RateNotFoundError(f"{pair} на {moment.isoformat()}")
+        rate = rates[i]
+        return (1 / rate if inverted else rate), _from_epoch(times[i])
+
+    def _bounds(self, times: list[float], start: datetime | None,
+                end: datetime | None) -> tuple[int, int]:
+        lo = 0 if start is None else bisect_left(times, _to_epoch(start))
+        hi = len(times) if end is None else bisect_right(times, _to_epoch(end))
+        return lo, hi
+
+    def range(self, pair: str, start: datetime | None = None,
+              end: datetime | None = None) -> list[tuple[datetime, float]]:
+        """Все точки пары в интервале [start, end]."""
+        times, rates, inverted = self._series(pair)
+        lo, hi = self._bounds(times, start, end)
+        return [(_from_epoch(times[i]), 1 / rates[i] if inverted else rates[i])
+                for i in range(lo, hi)]
+
+    def resample(self, pair: str, bucket_seconds: int,
+                 start: datetime | None = None, end: datetime | None = None,
+                 how: str = "ohlc") -> list[dict]:
+        """
+        Агрегирует точки интервала в корзины фиксированной длины.
+        how='ohlc' — open/high/low/close, how='mean' — среднее значение.
+        Пустые корзины пропускаются.
+        """
+        if how not in ("ohlc", "mean"):
+            raise ValueError(f"Неизвестная агрегация '{how}'. Доступны: ohlc, mean")
+        times, rates, inverted = self._series(pair)
+        lo, hi = self._bounds(times, start, end)
+
+        result: list[dict] = []
+        key = None
+        for i in range(lo, hi):
+            rate = 1 / rates[i] if inverted else rates[i]
+            bucket_key = int(times[i]) // bucket_seconds * bucket_seconds
+            if bucket_key != key:
+                key = bucket_key
+                bucket = {"start": _from_epoch(key), "open": rate, "high": rate,
+                          "low": rate, "close": rate, "sum": 0.0, "count": 0}
+                result.append(bucket)
+            bucket["high"] = max(bucket["high"], rate)
+            bucket["low"] = min(bucket["low"], rate)
+            bucket["close"] = rate
+            bucket["sum"] += rate
+            bucket["count"] += 1
+
+        for bucket in result:
+            total = bucket.pop("sum")
+            if how == "mean":
+                bucket["mean"] = total / bucket["count"]
+                for field in ("open", "high", "low", "close"):
+                    del bucket[field]
+        return result
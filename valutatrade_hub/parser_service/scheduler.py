@@ -1,46 +1,206 @@
+import random
 import time
+from datetime import datetime, timezone
+from threading import Event, Lock, Thread
+from typing import Callable
 
-from valutatrade_hub.infra.logger import logger
-from valutatrade_hub.parser_service.api_clients import (
-    CoinGeckoClient,
-    ExchangeRateApiClient,
-)
+from valutatrade_hub.core import utils as u
+from valutatrade_hub.infra.settings import SettingsLoader
+from valutatrade_hub.logging_config import logger
+from valutatrade_hub.parser_service.api_clients import CLIENTS
+from valutatrade_hub.parser_service.compaction import HistoryCompactor
 from valutatrade_hub.parser_service.config import ParserConfig
 from valutatrade_hub.parser_service.storage import RatesStorage
-from valutatrade_hub.parser_service.updater import RatesUpdater
 
 
 class UpdateScheduler:
-    """Периодический запуск обновления курсов."""
+    """
+    Периодический запуск обновления курсов в фоновом потоке.
+    У каждого источника свой интервал; интервал не превышает доли TTL
+    курсов, чтобы кеш обновлялся до того, как устареет.
+    Запуски идут по фиксированной сетке (без накопления дрейфа)
+    с небольшим случайным смещением.
+    """
 
     _instance = None
 
-    def __new__(cls, interval_sec: int = 3600):
+    def __new__(cls, interval_sec: int | None = None):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance._initialized = False
         return cls._instance
 
-    def __init__(self, interval_sec: int = 3600):
+    def __init__(self, interval_sec: int | None = None):
         if getattr(self, "_initialized", False):
             return
-        self.interval = interval_sec
         self.storage = RatesStorage()
         self.config = ParserConfig()
-        self.clients = [
-            CoinGeckoClient(self.config),
-            ExchangeRateApiClient(self.config)
-        ]
-        self.updater = RatesUpdater(self.clients, self.storage)
+        self.jitter = float(self.config.get("SCHEDULER_JITTER", 5))
+        ttl = SettingsLoader().get("RATES_TTL_SECONDS", 3600)
+        prefetch = float(self.config.get("SCHEDULER_PREFETCH_RATIO", 0.8))
+        intervals = dict(self.config.get("SCHEDULER_INTERVALS",
+                                         {"coingecko": 300, "exchangerate": 3600}))
+
+        self._jobs: dict[str, dict] = {}
+        self._lock = Lock()
+        self._stop = Event()
+        # Будит цикл раньше срока: при остановке и при добавлении задачи.
+        self._wake = Event()
+        self._thread: Thread | None = None
+
+        for source in CLIENTS:
+            interval = min(interval_sec or intervals.get(source, 3600), ttl * prefetch)
+            self.add_job(source, interval, self._update_job(source),
+                         rates_job=True)
+        compaction = self.config.get("SCHEDULER_COMPACTION_INTERVAL")
+        if compaction:
+            self.add_job("compaction", float(compaction), HistoryCompactor().run)
         self._initialized = True
 
+    @staticmethod
+    def _update_job(source: str) -> Callable[[], None]:
+        # Через refresh_rates: обновления планировщика и запросов пользователей
+        # объединяются (single-flight) и сериализуются блокировкой rates.json.
+        def job():
+            u.refresh_rates(source)
+        return job
+
+    def add_job(self, name: str, interval: float, func: Callable[[], object],
+                rates_job: bool = False):
+        """
+        Регистрирует периодическую задачу. Первый запуск — сразу после start()
+        (или сразу, если планировщик уже работает); для задач обновления курсов
+        (rates_job) — когда кеш курсов подойдёт к сроку.
+        """
+        if interval <= 0:
+            raise ValueError("Интервал задачи должен быть положительным")
+        with self._lock:
+            slot = self._first_slot(float(interval), rates_job) \
+                if self.is_running() else None
+            self._jobs[name] = {
+                "func": func,
+                "interval": float(interval),
+                "rates_job": rates_job,
+                "slot": slot,
+                "fire_at": slot,
+                "runs": 0,
+                "errors": 0,
+                "last_run": None,
+                "last_duration_ms": None,
+                "last_error": None,
+            }
+        self._wake.set()
+
     def start(self):
-        """Запускает периодическое обновление курсов."""
-        logger.info(f"Запуск периодического обновления каждые {self.interval} секунд")
-        while True:
-            try:
-                self.updater.run_update()
-            except Exception as e:
-                logger.exception(f"Ошибка при периодическом обновлении курсов: {e}")
-            time.sleep(self.interval)
+        """Запускает планировщик в фоновом потоке (повторный вызов ничего не делает)."""
+        with self._lock:
+            if self.is_running():
+                return
+            for job in self._jobs.values():
+                job["slot"] = self._first_slot(job["interval"], job["rates_job"])
+                job["fire_at"] = job["slot"]
+            self._stop.clear()
+            self._wake.clear()
+            self._thread = Thread(target=self._loop, name="rates-scheduler",
+                                  daemon=True)
+            self._thread.start()
+        logger.info("Запуск периодического обновления: " + ", ".join(
+            f"{name} каждые {job['interval']:.0f} с"
+            for name, job in self._jobs.items()))
+
+    def stop(self, timeout: float | None = 10):
+        """Останавливает планировщик, дожидаясь завершения текущей задачи."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        logger.info("Периодическое обновление курсов остановлено")
+
+    def run_forever(self):
+        """Блокирующий запуск (для отдельного процесса обновления курсов)."""
+        self.start()
+        try:
+            while self._thread.is_alive():
+                self._thread.join(1)
+        except KeyboardInterrupt:
+            self.stop()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self) -> dict:
+        """Состояние планировщика и статистика по каждой задаче."""
+        now = time.monotonic()
+        with self._lock:
+            jobs = {
+                name: {
+                    "interval": job["interval"],
+                    "runs": job["runs"],
+                    "errors": job["errors"],
+                    "last_run": job["last_run"],
+                    "last_duration_ms": job["last_duration_ms"],
+                    "last_error": job["last_error"],
+                    "next_run_in": None if job["fire_at"] is None or
+                    not self.is_running() else max(0.0, job["fire_at"] - now),
+                }
+                for name, job in self._jobs.items()
+            }
+        return {"running": self.is_running(), "jobs": jobs}
+
+    def _rates_age(self) -> float:
+        """Возраст кеша курсов в секундах (бесконечность, если кеша нет)."""
+        snapshot = self.storage.load_snapshot()
+        if snapshot is None or snapshot.last_refresh is None:
+            return float("inf")
+        return (datetime.now(timezone.utc) - snapshot.last_refresh).total_seconds()
+
+    def _first_slot(self, interval: float, rates_job: bool) -> float:
+        now = time.monotonic()
+        if not rates_job:
+            return now
+        # Если кеш ещё свежий, первое обновление — когда он подойдёт к сроку.
+        return now + max(0.0, interval - self._rates_age())
+
+    def _loop(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            with self._lock:
+                due = [(name, job) for name, job in self._jobs.items()
+                       if job["fire_at"] is not None and job["fire_at"] <= now]
+            for name, job in due:
+                if self._stop.is_set():
+                    return
+                self._run_job(name, job)
+                self._schedule_next(job)
+            with self._lock:
+                next_fire = min((job["fire_at"] for job in self._jobs.values()
+                                 if job["fire_at"] is not None), default=now + 1)
+            self._wake.wait(max(0.0, next_fire - time.monotonic()))
+            self._wake.clear()
+
+    def _run_job(self, name: str, job: dict):
+        start = time.perf_counter()
+        job["last_run"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        try:
+            job["func"]()
+            job["last_error"] = None
+        except Exception as e:
+            job["errors"] += 1
+            job["last_error"] = str(e)
+            logger.exception(f"Ошибка периодической задачи {name}: {e}")
+        job["runs"] += 1
+        job["last_duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
 
+    def _schedule_next(self, job: dict):
+        """
+        Следующий запуск считается от сетки slot + k * interval, а не от времени
+        окончания задачи, поэтому длительность обновления не сдвигает расписание.
+        Пропущенные слоты (задача шла дольше интервала) не навёрстываются.
+        """
+        now = time.monotonic()
+        interval = job["interval"]
+        slot = job["slot"] + interval
+        if slot <= now:
+            slot += ((now - slot) // interval + 1) * interval
+        job["slot"] = slot
+        job["fire_at"] = slot + random.uniform(0, min(self.jitter, interval / 10))
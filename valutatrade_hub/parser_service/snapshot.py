@@ -0,0 +1,163 @@
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+
+from valutatrade_hub.core.exceptions import RateNotFoundError
+
+SERVICE_KEYS = ("source", "last_refresh", "version")
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Разбирает ISO-время; время без часового пояса считается UTC."""
+    ts = datetime.fromisoformat(value)
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+class Quote(NamedTuple):
+    """Прямая котировка из rates.json с уже разобранными полями."""
+    pair: str
+    from_currency: str
+    to_currency: str
+    rate: float
+    updated_at: datetime
+    source: str | None = None
+
+
+@dataclass(frozen=True)
+class RatesSnapshot:
+    """
+    Неизменяемый снимок курсов.
+    Валютам присвоены целочисленные id, для каждой пары валют заранее
+    посчитан курс (прямой, обратный или кросс-курс через базовую валюту),
+    поэтому получение курса — это два обращения к словарю и к матрице.
+    """
+
+    base: str
+    codes: tuple[str, ...]
+    ids: Mapping[str, int]
+    quotes: tuple[Quote, ...]
+    last_refresh: datetime | None
+    # Номер версии rates.json, из которой построен снимок.
+    version: int | None
+    _rates: tuple[tuple[float | None, ...], ...]
+    _updated: tuple[tuple[datetime | None, ...], ...]
+    # Котировки, через которые валюта (по id) выражена в базовой.
+    _paths: tuple[tuple[Quote, ...] | None, ...]
+    # Прямые котировки по паре id (в обе стороны).
+    _direct: Mapping[tuple[int, int], Quote]
+
+    @classmethod
+    def from_rates(cls, rates: dict, base: str) -> "RatesSnapshot":
+        """Строит снимок из словаря формата rates.json."""
+        base = base.upper()
+        quotes = []
+        for pair, info in rates.items():
+            if pair in SERVICE_KEYS:
+                continue
+            from_curr, to_curr = pair.split("_")
+            quotes.append(Quote(pair, from_curr, to_curr, float(info["rate"]),
+                                parse_timestamp(info["updated_at"]),
+                                info.get("source")))
+
+        codes = sorted({q.from_currency for q in quotes} |
+                       {q.to_currency for q in quotes} | {base})
+        ids = {code: i for i, code in enumerate(codes)}
+        last_refresh = rates.get("last_refresh")
+        last_refresh = parse_timestamp(last_refresh) if last_refresh else None
+
+        value, value_updated, paths = cls._triangulate(quotes, base)
+
+        size = len(codes)
+        matrix = [[None] * size for _ in range(size)]
+        updated = [[None] * size for _ in range(size)]
+        for i, a in enumerate(codes):
+            for j, b in enumerate(codes):
+                if a not in value or b not in value:
+                    continue
+                matrix[i][j] = value[a] / value[b]
+                updated[i][j] = _oldest(value_updated[a], value_updated[b],
+                                        last_refresh)
+        # Прямые котировки точнее кросс-курсов — ими перекрываем матрицу.
+        direct = {}
+        for q in quotes:
+            i, j = ids[q.from_currency], ids[q.to_currency]
+            matrix[i][j], updated[i][j] = q.rate, q.updated_at
+            matrix[j][i], updated[j][i] = 1 / q.rate, q.updated_at
+            direct[(i, j)] = direct[(j, i)] = q
+
+        return cls(
+            base=base,
+            codes=tuple(codes),
+            ids=MappingProxyType(ids),
+            quotes=tuple(sorted(quotes, key=lambda q: q.pair)),
+            last_refresh=last_refresh,
+            version=rates.get("version"),
+            _rates=tuple(tuple(row) for row in matrix),
+            _updated=tuple(tuple(row) for row in updated),
+            _paths=tuple(paths.get(code) for code in codes),
+            _direct=MappingProxyType(direct),
+        )
+
+    @staticmethod
+    def _triangulate(quotes: list[Quote], base: str):
+        """
+        Обходом в ширину от базовой валюты находит стоимость каждой валюты
+        в базовой, время самой старой котировки на пути к ней и сам путь.
+        """
+        edges: dict[str, list[tuple[str, float, Quote]]] = {}
+        for q in quotes:
+            edges.setdefault(q.from_currency, []).append(
+                (q.to_currency, 1 / q.rate, q))
+            edges.setdefault(q.to_currency, []).append(
+                (q.from_currency, q.rate, q))
+
+        value = {base: 1.0}
+        value_updated: dict[str, datetime | None] = {base: None}
+        paths: dict[str, tuple[Quote, ...]] = {base: ()}
+        queue = deque([base])
+        while queue:
+            code = queue.popleft()
+            for other, factor, q in edges.get(code, []):
+                if other in value:
+                    continue
+                # 1 other = value[code] * factor базовых единиц
+                value[other] = value[code] * factor
+                value_updated[other] = _oldest(value_updated[code], q.updated_at)
+                paths[other] = paths[code] + (q,)
+                queue.append(other)
+        return value, value_updated, paths
+
+    def has_currency(self, code: str) -> bool:
+        """Есть ли курс валюты хотя бы к одной другой валюте."""
+        i = self.ids.get(code.upper())
+        return i is not None and any(
+            r is not None for j, r in enumerate(self._rates[i]) if j != i)
+
+    def rate(self, from_currency: str, to_currency: str) -> tuple[float, datetime]:
+        """Курс from → to и время самой старой использованной котировки."""
+        i = self.ids.get(from_currency.upper())
+        j = self.ids.get(to_currency.upper())
+        if i is None or j is None or self._rates[i][j] is None:
+            raise RateNotFoundError(f"{from_currency}→{to_currency}")
+        return self._rates[i][j], self._updated[i][j]
+
+
+    def legs(self, from_currency: str, to_currency: str) -> tuple[Quote, ...]:
+        """
+        Котировки, из которых получен курс from → to: прямая котировка
+        или пути обеих валют к базовой. По ним видно, какой источник обновлять.
+        """
+        i = self.ids.get(from_currency.upper())
+        j = self.ids.get(to_currency.upper())
+        if i is None or j is None or self._rates[i][j] is None:
+            raise RateNotFoundError(f"{from_currency}→{to_currency}")
+        if (i, j) in self._direct:
+            return (self._direct[(i, j)],)
+        return self._paths[i] + self._paths[j]
+
+
+def _oldest(*moments: datetime | None) -> datetime | None:
+    known = [m for m in moments if m is not None]
+    return min(known) if known else None
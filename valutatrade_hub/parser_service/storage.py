@@ -1,20 +1,123 @@
-from datetime import datetime, timezone
+import os
+from datetime import datetime, timedelta, timezone
+from itertools import chain
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterator
 
 from valutatrade_hub.infra.database import DatabaseManager
+from valutatrade_hub.infra.filelock import FileLock
 from valutatrade_hub.infra.settings import SettingsLoader
+from valutatrade_hub.parser_service.binary_history import BinaryHistory
+from valutatrade_hub.parser_service.snapshot import (
+    SERVICE_KEYS,
+    RatesSnapshot,
+    parse_timestamp,
+)
+
+# Формат имени сегмента истории для каждого периода ротации.
+SEGMENT_FORMATS = {
+    "hour": "%Y-%m-%dT%H",
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+}
+SEGMENT_PREFIX = "rates-"
+SEGMENT_SUFFIX = ".jsonl"
+HISTORY_STATE_FILE = "history_state.json"
+HISTORY_BACKENDS = ("jsonl", "binary", "sqlite")
+# Уровни сжатой истории (OHLC-корзины) и формат имени их файлов:
+# минутные корзины хранятся по дням, часовые — по месяцам, дневные — по годам.
+TIER_FORMATS = {
+    "1m": "%Y-%m-%d",
+    "1h": "%Y-%m",
+    "1d": "%Y",
+}
+
+
+def period_bounds(path: Path) -> tuple[datetime, datetime]:
+    """Начало и конец периода, который покрывает файл сегмента или уровня."""
+    name = path.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+    for fmt in ("%Y-%m-%dT%H", "%Y-%m-%d", "%Y-%m", "%Y"):
+        try:
+            start = datetime.strptime(name, fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+        if fmt == "%Y-%m-%dT%H":
+            end = start + timedelta(hours=1)
+        elif fmt == "%Y-%m-%d":
+            end = start + timedelta(days=1)
+        elif fmt == "%Y-%m":
+            end = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:
+            end = start.replace(year=start.year + 1)
+        return start, end
+    raise ValueError(f"Некорректное имя сегмента истории: {path.name}")
+
+
+def _pair_row(pair: str, rate: float, timestamp: str, source) -> Dict:
+    from_curr, to_curr = pair.split("_")
+    return {
+        "id": f"{pair}_{timestamp}",
+        "from_currency": from_curr,
+        "to_currency": to_curr,
+        "rate": rate,
+        "timestamp": timestamp,
+        "source": source,
+    }
+
+
+def expand_history_entry(entry: Dict, last: Dict[str, Dict]) -> list[Dict]:
+    """
+    Восстанавливает полные записи истории из строки сегмента.
+    Строка-отметка {"timestamp", "unchanged": [...]} означает, что курсы
+    перечисленных пар на этот момент не изменились: для них повторяется
+    последняя известная запись. last — последние записи по парам,
+    обновляется по мере чтения сегментов по порядку.
+    """
+    if "unchanged" not in entry:
+        last[f"{entry['from_currency']}_{entry['to_currency']}"] = entry
+        return [entry]
+    rows = []
+    for pair in entry["unchanged"]:
+        prev = last.get(pair)
+        if prev is not None:
+            rows.append(_pair_row(pair, prev["rate"], entry["timestamp"],
+                                  prev.get("source")))
+    return rows
 
-settings = SettingsLoader()
 
 class RatesStorage:
     """Хранилище для курсов валют."""
 
+    # Последний построенный снимок и отпечаток rates.json, из которого он получен.
+    _snapshot: RatesSnapshot | None = None
+    _snapshot_fingerprint: tuple | None = None
+
     def __init__(self):
+        settings = SettingsLoader()
         self.rates_file = Path(settings.get("RATES_FILE",
                                             "data/rates.json"))
         self.history_file = Path(settings.get("HISTORY_FILE",
                                               "data/exchange_rates.json"))
+        self.history_dir = Path(settings.get("HISTORY_DIR", "data/history"))
+        self.segment_period = settings.get("HISTORY_SEGMENT", "day")
+        self.delta_tolerance = float(settings.get("HISTORY_DELTA_TOLERANCE", 0.0))
+        self.keyframe_seconds = float(settings.get("HISTORY_KEYFRAME_SECONDS", 3600))
+        # С STORAGE_BACKEND=sqlite история по умолчанию тоже хранится в базе.
+        self.history_backend = settings.get(
+            "HISTORY_BACKEND",
+            "sqlite" if settings.get("STORAGE_BACKEND") == "sqlite" else "jsonl")
+        self.binary_file = Path(settings.get("HISTORY_BINARY_FILE",
+                                             self.history_dir / "rates.bin"))
+        self.versions_dir = Path(settings.get("RATES_VERSIONS_DIR",
+                                              "data/rates_versions"))
+        self.keep_versions = int(settings.get("RATES_KEEP_VERSIONS", 5))
+        self.base_currency = settings.get("BASE_CURRENCY", "USD")
+        if self.segment_period not in SEGMENT_FORMATS:
+            raise ValueError(f"Неизвестный период сегмента истории "\
+                             f"'{self.segment_period}'")
+        if self.history_backend not in HISTORY_BACKENDS:
+            raise ValueError(f"Неизвестный формат истории '{self.history_backend}'. "\
+                             f"Доступны: {', '.join(HISTORY_BACKENDS)}")
         self.rates_file.parent.mkdir(parents=True, exist_ok=True)
 
     def load_rates(self) -> Dict:
@@ -23,30 +126,267 @@ class RatesStorage:
             return {}
         return DatabaseManager().load(self.rates_file)
 
-    def save_rates(self, rates: Dict):
+    def load_snapshot(self) -> RatesSnapshot | None:
         """
-        Сохранить актуальные курсы (rates.json)
-        и добавить в историю (exchange_rates.json).
+        Снимок курсов для быстрых запросов.
+        Пересобирается, только если rates.json изменился с прошлого раза.
         """
-        DatabaseManager().save(self.rates_file, rates)
+        fingerprint = self._fingerprint()
+        if fingerprint is None:
+            return None
+        cls = type(self)
+        if cls._snapshot is None or cls._snapshot_fingerprint != fingerprint:
+            rates = self.load_rates()
+            if not rates:
+                return None
+            cls._snapshot = RatesSnapshot.from_rates(rates, self.base_currency)
+            cls._snapshot_fingerprint = fingerprint
+        return cls._snapshot
+
+    def publish_snapshot(self, snapshot: RatesSnapshot):
+        """Делает снимок текущим для только что сохранённого rates.json."""
+        cls = type(self)
+        cls._snapshot = snapshot
+        cls._snapshot_fingerprint = self._fingerprint()
 
+    def _fingerprint(self) -> tuple | None:
         try:
-            history = DatabaseManager().load(self.history_file)
+            st = os.stat(self.rates_file)
         except FileNotFoundError:
-            history = []
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
 
-        now_iso = datetime.now(timezone.utc).isoformat()
+    def save_rates(self, rates: Dict) -> Dict:
+        """
+        Сохранить актуальные курсы (rates.json)
+        и дописать их в текущий сегмент истории.
+        Пары, которых нет в rates, сохраняют прежние значения и источник.
+        Каждое сохранение получает номер version. Версия сначала пишется
+        неизменяемым файлом в RATES_VERSIONS_DIR, затем атомарно подменяет
+        rates.json, поэтому читатели без блокировок видят целую версию.
+        Чтение, выбор номера версии и публикация идут под блокировкой
+        rates.json.lock, поэтому номера версий не повторяются.
+        Хранятся последние RATES_KEEP_VERSIONS версий (0 — без версий).
+        Возвращает итоговое содержимое rates.json.
+        """
+        with FileLock(f"{self.rates_file}.lock"):
+            merged = dict(self.load_rates())
+            merged.update(rates)
+            merged["version"] = int(merged.get("version", 0)) + 1
+            if self.keep_versions > 0:
+                version_path = self.version_path(merged["version"])
+                DatabaseManager().save(version_path, merged)
+                DatabaseManager().publish(version_path, self.rates_file)
+                for old in self.versions()[:-self.keep_versions]:
+                    self.version_path(old).unlink(missing_ok=True)
+            else:
+                DatabaseManager().save(self.rates_file, merged)
+        self.append_history(rates)
+        return merged
+
+    def version_path(self, version: int) -> Path:
+        return self.versions_dir / f"rates-{version:08d}.json"
+
+    def versions(self) -> list[int]:
+        """Номера сохранённых версий rates.json по возрастанию."""
+        if not self.versions_dir.exists():
+            return []
+        return sorted(int(p.stem.removeprefix("rates-"))
+                      for p in self.versions_dir.glob("rates-*.json"))
+
+    def load_version(self, version: int) -> Dict:
+        """Содержимое конкретной версии rates.json (версия не меняется)."""
+        path = self.version_path(version)
+        if not path.exists():
+            raise FileNotFoundError(path)
+        return DatabaseManager().load(path)
+
+    def append_history(self, rates: Dict) -> int:
+        """
+        Дописывает курсы в сегмент истории, не перечитывая уже записанное.
+        Полная запись пишется только для пар, курс которых изменился больше
+        чем на HISTORY_DELTA_TOLERANCE (относительно последнего записанного),
+        а также для опорных записей: первой в сегменте и не реже раза в
+        HISTORY_KEYFRAME_SECONDS. Остальные пары попадают в одну короткую
+        строку-отметку. Возвращает число полных записей.
+        С HISTORY_BACKEND=binary каждая точка пишется в бинарный файл целиком,
+        с HISTORY_BACKEND=sqlite — в таблицу rate_history (повтор пары
+        на тот же момент заменяет курс).
+        """
+        if self.history_backend == "binary":
+            return self.binary_history().append(
+                (pair, parse_timestamp(data["updated_at"]).timestamp(),
+                 float(data["rate"]))
+                for pair, data in rates.items() if pair not in SERVICE_KEYS)
+        if self.history_backend == "sqlite":
+            return self.sqlite_store().add_history(
+                (pair, parse_timestamp(data["updated_at"]).timestamp(),
+                 float(data["rate"]), data.get("source", rates.get("source")))
+                for pair, data in rates.items() if pair not in SERVICE_KEYS)
+        now = datetime.now(timezone.utc)
+        segment = self.segment_path(now).name
+        state_path = self.history_dir / HISTORY_STATE_FILE
+        state = DatabaseManager().load(state_path) if state_path.exists() else {}
+        written = state.setdefault("pairs", {})
+
+        entries = []
+        unchanged: dict[str, list] = {}
         for pair, data in rates.items():
-            if pair in ("source", "last_refresh"):
+            if pair in SERVICE_KEYS:
+                continue
+            rate, timestamp = data["rate"], data["updated_at"]
+            prev = written.get(pair)
+            keyframe = prev is None or prev["segment"] != segment \
+                or now.timestamp() - prev["keyframe_at"] >= self.keyframe_seconds
+            if not keyframe and abs(rate - prev["rate"]) <= \
+                    self.delta_tolerance * abs(prev["rate"]):
+                unchanged.setdefault(timestamp, []).append(pair)
                 continue
-            entry = {
-                "id": f"{pair}_{now_iso}",
-                "from_currency": pair.split("_")[0],
-                "to_currency": pair.split("_")[1],
-                "rate": data["rate"],
-                "timestamp": data["updated_at"],
-                "source": rates.get("source", "ParserService"),
+            entries.append(_pair_row(pair, rate, timestamp, data.get(
+                "source", rates.get("source", "ParserService"))))
+            written[pair] = {
+                "rate": rate,
+                "segment": segment,
+                "keyframe_at": now.timestamp() if keyframe else prev["keyframe_at"],
             }
-            history.append(entry)
+        entries.extend({"timestamp": timestamp, "unchanged": pairs}
+                       for timestamp, pairs in unchanged.items())
+        if entries:
+            DatabaseManager().append_many(self.segment_path(now), entries)
+            DatabaseManager().save(state_path, state)
+        return len(entries) - len(unchanged)
+
+    def segment_path(self, moment: datetime) -> Path:
+        """Путь к сегменту истории, в который попадает момент времени."""
+        name = moment.astimezone(timezone.utc).strftime(
+            SEGMENT_FORMATS[self.segment_period])
+        return self.history_dir / f"{SEGMENT_PREFIX}{name}{SEGMENT_SUFFIX}"
+
+    def history_segments(self, start: datetime | None = None,
+                         end: datetime | None = None) -> list[Path]:
+        """
+        Сегменты истории в хронологическом порядке.
+        Если задан интервал, возвращаются только пересекающиеся с ним сегменты.
+        """
+        segments = self._list_periods(self.history_dir)
+        result = []
+        for i, (seg_start, path) in enumerate(segments):
+            seg_end = segments[i + 1][0] if i + 1 < len(segments) else None
+            if end is not None and seg_start > end:
+                break
+            if start is not None and seg_end is not None and seg_end <= start:
+                continue
+            result.append(path)
+        return result
+
+    def iter_history(self, start: datetime | None = None,
+                     end: datetime | None = None) -> Iterator[Dict]:
+        """
+        Потоковое чтение истории курсов по сегментам (или из бинарного файла,
+        или из SQLite по индексу времени).
+        Пропущенные при записи неизменившиеся курсы восстанавливаются,
+        записи с отметкой времени вне [start, end] пропускаются.
+        """
+        if self.history_backend == "binary":
+            lo = float("-inf") if start is None else start.timestamp()
+            hi = float("inf") if end is None else end.timestamp()
+            for pair, ts, rate in self.binary_history().scan():
+                if lo <= ts <= hi:
+                    yield _pair_row(pair, rate, datetime.fromtimestamp(
+                        ts, tz=timezone.utc).isoformat(), None)
+            return
+        if self.history_backend == "sqlite":
+            lo = float("-inf") if start is None else start.timestamp()
+            hi = float("inf") if end is None else end.timestamp()
+            for row in self.sqlite_store().iter_history(lo, hi):
+                yield _pair_row(row["pair"], row["rate"], datetime.fromtimestamp(
+                    row["ts"], tz=timezone.utc).isoformat(), row["source"])
+            return
+        yield from self._iter_segments(start, end)
+
+    def _iter_segments(self, start: datetime | None,
+                       end: datetime | None) -> Iterator[Dict]:
+        last: Dict[str, Dict] = {}
+        for path in self.history_segments(start, end):
+            for line, _ in DatabaseManager().iter_lines(path):
+                for entry in expand_history_entry(line, last):
+                    if start is None and end is None:
+                        yield entry
+                        continue
+                    ts = parse_timestamp(entry["timestamp"])
+                    if (start is None or ts >= start) and (end is None or ts <= end):
+                        yield entry
+
+    def binary_history(self) -> BinaryHistory:
+        return BinaryHistory(self.binary_file)
+
+    @staticmethod
+    def sqlite_store():
+        # sqlite3 загружается только при работе с историей в SQLite.
+        from valutatrade_hub.infra.sqlite_store import SqliteStore
+        return SqliteStore()
+
+    def migrate_history_to_sqlite(self) -> int:
+        """
+        Копирует JSON-историю (exchange_rates.json, если ещё не перенесён,
+        и сегменты) в таблицу rate_history. Точки, уже записанные в базу,
+        пропускаются. Возвращает число добавленных точек.
+        """
+        legacy = DatabaseManager().load(self.history_file) \
+            if self.history_file.exists() else []
+        return self.sqlite_store().add_history(
+            (f"{entry['from_currency']}_{entry['to_currency']}",
+             parse_timestamp(entry["timestamp"]).timestamp(),
+             float(entry["rate"]), entry.get("source"))
+            for entry in chain(legacy, self._iter_segments(None, None)))
+
+    def convert_to_binary(self) -> int:
+        """
+        Переносит JSON-историю (exchange_rates.json, если ещё не перенесён,
+        и сегменты) в бинарный файл. Точки, уже записанные в файл,
+        сохраняются, повторы (пара, время) пропускаются.
+        Возвращает число добавленных точек.
+        """
+        legacy = DatabaseManager().load(self.history_file) \
+            if self.history_file.exists() else []
+        return self.binary_history().merge(
+            (f"{entry['from_currency']}_{entry['to_currency']}",
+             parse_timestamp(entry["timestamp"]).timestamp(),
+             float(entry["rate"]))
+            for entry in chain(legacy, self._iter_segments(None, None)))
+
+    def migrate_history(self) -> int:
+        """
+        Переносит историю из exchange_rates.json в сегменты.
+        Исходный файл переименовывается в *.migrated. Возвращает число записей.
+        """
+        if not self.history_file.exists():
+            return 0
+        history = DatabaseManager().load(self.history_file)
+        by_segment: dict[Path, list] = {}
+        for entry in history:
+            ts = parse_timestamp(entry["timestamp"])
+            by_segment.setdefault(self.segment_path(ts), []).append(entry)
+        for path, entries in by_segment.items():
+            DatabaseManager().append_many(path, entries)
+        os.replace(self.history_file,
+                   self.history_file.with_name(self.history_file.name + ".migrated"))
+        return len(history)
+
+    def tier_path(self, tier: str, moment: datetime) -> Path:
+        """Файл уровня сжатой истории, в который попадает момент времени."""
+        name = moment.astimezone(timezone.utc).strftime(TIER_FORMATS[tier])
+        return self.history_dir / tier / f"{SEGMENT_PREFIX}{name}{SEGMENT_SUFFIX}"
+
+    def tier_segments(self, tier: str) -> list[Path]:
+        """Файлы уровня сжатой истории в хронологическом порядке."""
+        return [path for _, path in self._list_periods(self.history_dir / tier)]
 
-        DatabaseManager().save(self.history_file, history)
+    @staticmethod
+    def _list_periods(directory: Path) -> list[tuple[datetime, Path]]:
+        if not directory.exists():
+            return []
+        return sorted(
+            (period_bounds(p)[0], p) for p in directory.iterdir()
+            if p.name.startswith(SEGMENT_PREFIX) and p.name.endswith(SEGMENT_SUFFIX)
+        )
@@ -1,9 +1,12 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timezone
-from typing import List
+from typing import Dict, List
 
 from valutatrade_hub.core.exceptions import ApiRequestError
 from valutatrade_hub.logging_config import logger
 from valutatrade_hub.parser_service.api_clients import BaseApiClient
+from valutatrade_hub.parser_service.snapshot import RatesSnapshot
 from valutatrade_hub.parser_service.storage import RatesStorage
 
 
@@ -11,36 +14,50 @@ class RatesUpdater:
     """
     Координирует процесс обновления курсов валют.
     Получает данные от клиентов, объединяет их и сохраняет в storage.
+    Каждая пара помечается источником, который её вернул.
+    В конкурентном режиме клиенты опрашиваются параллельно с общим дедлайном.
     """
 
-    def __init__(self, clients: List[BaseApiClient], storage: RatesStorage):
+    def __init__(self, clients: List[BaseApiClient], storage: RatesStorage,
+                 concurrent: bool = True, deadline: float | None = None):
         self.clients = clients
         self.storage = storage
+        self.concurrent = concurrent
+        self.deadline = deadline
+        self.snapshot: RatesSnapshot | None = None
+        # Результаты последнего опроса: имя клиента -> статус, время, число курсов.
+        self.last_timings: Dict[str, dict] = {}
 
     def run_update(self) -> int:
         """
-        Запускает процесс обновления курсов.
+        Запускает процесс обновления курсов и строит по ним снимок self.snapshot.
         Возвращает количество обновленных курсов.
         """
         updated_rates = {}
         now = datetime.now(timezone.utc)
         now_iso = now.isoformat(timespec="seconds")
 
-        for client in self.clients:
-            client_name = client.__class__.__name__
-            try:
-                rates = client.fetch_rates()
-                for pair, rate in rates.items():
-                    updated_rates[pair] = {
-                        "rate": rate,
-                        "updated_at": now_iso
-                    }
-            except ApiRequestError as e:
-                logger.error(f"[{client_name}] Ошибка обновления курсов: {e}")
-                continue
-            except Exception as e:
-                logger.exception(f"[{client_name}] Неожиданная ошибка: {e}")
-                continue
+        # У каждого запуска свой словарь: клиент, опоздавший к прошлому запуску,
+        # пишет в словарь того запуска и не искажает текущие замеры.
+        timings: Dict[str, dict] = {}
+        if self.concurrent and len(self.clients) > 1:
+            fetched = self._fetch_concurrent(timings)
+        else:
+            fetched = [(client, self._fetch_one(client, timings))
+                       for client in self.clients]
+        self.last_timings = timings
+
+        for client, rates in fetched:
+            for pair, rate in (rates or {}).items():
+                updated_rates[pair] = {
+                    "rate": rate,
+                    "updated_at": now_iso,
+                    "source": client.SOURCE_KEY,
+                }
+
+        summary = ", ".join(f"{name}={t['status']}/{t['elapsed_ms']} мс"
+                            for name, t in timings.items())
+        logger.info(f"Опрос клиентов: {summary}")
 
         if not updated_rates:
             logger.warning("Не удалось получить ни одного курса от всех клиентов.")
@@ -49,7 +66,56 @@ class RatesUpdater:
         updated_rates["source"] = "ParserService"
         updated_rates["last_refresh"] = now_iso
 
-        self.storage.save_rates(updated_rates)
+        merged = self.storage.save_rates(updated_rates)
+        self.snapshot = RatesSnapshot.from_rates(merged, self.storage.base_currency)
+        self.storage.publish_snapshot(self.snapshot)
         logger.info(f"Обновление завершено: {len(self.clients)} клиентов опрошены, "
                     f"{len(updated_rates) - 2} пар курсов сохранено")
         return len(updated_rates)
+
+    def _fetch_one(self, client: BaseApiClient,
+                   timings: Dict[str, dict]) -> Dict[str, float] | None:
+        """Опрашивает одного клиента и записывает время ответа в timings."""
+        client_name = client.__class__.__name__
+        start = time.perf_counter()
+        status, rates = "ok", None
+        try:
+            rates = client.fetch_rates()
+        except ApiRequestError as e:
+            status = "error"
+            logger.error(f"[{client_name}] Ошибка обновления курсов: {e}")
+        except Exception as e:
+            status = "error"
+            logger.exception(f"[{client_name}] Неожиданная ошибка: {e}")
+        # setdefault: опоздавший клиент не перетирает уже записанный таймаут
+        timings.setdefault(client_name, {
+            "status": status,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+            "count": len(rates) if rates else 0,
+        })
+        return rates
+
+    def _fetch_concurrent(self, timings: Dict[str, dict]
+                          ) -> List[tuple[BaseApiClient, Dict[str, float] | None]]:
+        """
+        Опрашивает всех клиентов параллельно.
+        Клиенты, не ответившие до дедлайна, пропускаются: их курсы
+        останутся прежними до следующего обновления.
+        """
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=len(self.clients),
+                                      thread_name_prefix="rates-fetch")
+        futures = {executor.submit(self._fetch_one, client, timings): client
+                   for client in self.clients}
+        done, not_done = wait(futures, timeout=self.deadline)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        elapsed = round((time.perf_counter() - start) * 1000, 2)
+        for future in not_done:
+            client_name = futures[future].__class__.__name__
+            timings[client_name] = {
+                "status": "timeout", "elapsed_ms": elapsed, "count": 0,
+            }
+            logger.warning(f"[{client_name}] Не ответил за {self.deadline} с, "\
+                           f"курсы источника не обновлены")
+        return [(futures[future], future.result()) for future in done]